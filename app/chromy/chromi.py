@@ -1,12 +1,15 @@
 import json
+import hashlib
 import time
 import shutil
 import subprocess
+from collections.abc import Callable
+from functools import lru_cache
 from logging import Logger
 from os import PathLike
 from pathlib import Path
 from PySide6.QtCore import Qt, QModelIndex, QSortFilterProxyModel
-from PySide6.QtGui import QIcon
+from PySide6.QtGui import QIcon, QImage, QPixmap
 from PySide6.QtWidgets import QWidget
 
 from app.common.utils import (
@@ -14,13 +17,18 @@ from app.common.utils import (
     show_quick_tip
 )
 from app.common.logger import FakeLogger
-from app.common.icons import (
-    create_round_icon_from_pixmap, create_mono_icon,
-    argb32_to_rgb,
-)
-from app.common.profile_pic import create_profile_pic
+from app.common.icons import round_image, mono_image, argb32_to_rgb
+from app.common.profile_pic import create_profile_image
+from app.common.thumbnails import avatar_cache
 from app.chromy.structs import Extension, Bookmark, Profile
 
+# (已完成, 总数, 当前项)，可以在其中抛出异常来中止
+ProgressFunc = Callable[[int, int, str], None]
+
+
+def _no_progress(done: int, total: int, item: str):
+    pass
+
 
 class ChromInstance(object):
 
@@ -179,13 +187,16 @@ class ChromInstance(object):
 
         self._fetch_extensions_from_preferences(secure_pref_file, profile)
 
-    def fetch_extensions_from_all_profiles(self):
+    def fetch_extensions_from_all_profiles(self, progress: ProgressFunc = None):
+        progress = progress or _no_progress
         self.extensions.clear()
-        for profile_id in self.profiles:
+        for i, profile_id in enumerate(self.profiles):
+            progress(i, len(self.profiles), profile_id)
             profile = self.profiles[profile_id]
 
             self._fetch_extensions_in_pref(profile)  # 一般来说这里是没有插件的，为了兼容考虑
             self._fetch_extensions_in_secure_pref(profile)
+        progress(len(self.profiles), len(self.profiles), "")
 
     def _fetch_bookmarks_from_one_type(
             self,
@@ -214,9 +225,11 @@ class ChromInstance(object):
             for child in bookmark_info["children"]:
                 self._fetch_bookmarks_from_one_type(child, profile, new_path_ls)
 
-    def fetch_bookmarks_from_all_profiles(self):
+    def fetch_bookmarks_from_all_profiles(self, progress: ProgressFunc = None):
+        progress = progress or _no_progress
         self.bookmarks.clear()
-        for profile_id in self.profiles:
+        for i, profile_id in enumerate(self.profiles):
+            progress(i, len(self.profiles), profile_id)
             profile = self.profiles[profile_id]
             profile_dir = Path(profile.profile_dir)
 
@@ -242,8 +255,11 @@ class ChromInstance(object):
             for bmk_type in bookmarks_info:
                 bookmark_info = bookmarks_info[bmk_type]
                 self._fetch_bookmarks_from_one_type(bookmark_info, profile, [""])
+        progress(len(self.profiles), len(self.profiles), "")
 
-    def _delete_bookmarks_in_one_folder(self, bookmark_info: dict, urls_to_delete: list[str], profile: Profile):
+    def _delete_bookmarks_in_one_folder(self, bookmark_info: dict, urls_to_delete: list[str], profile: Profile,
+                                        removed: list[tuple[str, str]]):
+        # 只改文件中的数据，内存中的书签由 apply_deleted_bookmarks 更新
         if bookmark_info["type"] != "folder":
             return
 
@@ -255,22 +271,37 @@ class ChromInstance(object):
                 url = child["url"]
                 if url in urls_to_delete:
                     children.pop(i)
-                    # 更新 profiles
-                    if url in profile.bookmarks:
-                        profile.bookmarks.pop(url)
-                    # 更新 bookmarks
-                    if url in self.bookmarks and profile.id in self.bookmarks[url].profiles:
-                        self.bookmarks[url].profiles.pop(profile.id)
-                        # 如果没有任何用户有这个书签了，直接把书签删掉
-                        if len(self.bookmarks[url].profiles) == 0:
-                            self.bookmarks.pop(url)
-
+                    removed.append((url, profile.id))
                     self.logger.info(f"[DELETE] deleted {url} from {profile.id}")
             else:
-                self._delete_bookmarks_in_one_folder(child, urls_to_delete, profile)
-
-    def delete_bookmarks(self, urls_to_delete: list[str], profile_ids: list[str] = None):
+                self._delete_bookmarks_in_one_folder(child, urls_to_delete, profile, removed)
+
+    def apply_deleted_bookmarks(self, removed: list[tuple[str, str]]):
+        """把 delete_bookmarks 从文件中删掉的书签同步到内存，要在 GUI 线程中调用"""
+        for url, profile_id in removed:
+            # 更新 profiles
+            profile = self.profiles.get(profile_id)
+            if profile is not None and url in profile.bookmarks:
+                profile.bookmarks.pop(url)
+            # 更新 bookmarks
+            if url in self.bookmarks and profile_id in self.bookmarks[url].profiles:
+                self.bookmarks[url].profiles.pop(profile_id)
+                # 如果没有任何用户有这个书签了，直接把书签删掉
+                if len(self.bookmarks[url].profiles) == 0:
+                    self.bookmarks.pop(url)
+
+    def delete_bookmarks(self, urls_to_delete: list[str], profile_ids: list[str] = None,
+                         progress: ProgressFunc = None,
+                         removed: list[tuple[str, str]] = None) -> list[tuple[str, str]]:
+        """
+        只修改书签文件，可以在子线程中运行，内存中的数据不变
+
+        :param removed: 删掉的 (url, 用户 ID) 追加到这里，中途取消时也能知道已经删了哪些
+        :return: removed
+        """
         # 原理参考删除插件的函数注释
+        if removed is None:
+            removed = []
         default_profile_ids = set()
         for url in urls_to_delete:
             if url in self.bookmarks:
@@ -281,7 +312,10 @@ class ChromInstance(object):
         else:
             profile_ids = default_profile_ids.intersection(profile_ids)
 
-        for profile_id in profile_ids:
+        # 每个用户的文件改完才检查是否取消，不会留下改了一半的文件
+        progress = progress or _no_progress
+        for i, profile_id in enumerate(profile_ids):
+            progress(i, len(profile_ids), profile_id)
             profile = self.profiles[profile_id]
 
             # 删除可能的备份文件
@@ -301,11 +335,17 @@ class ChromInstance(object):
             if "checksum" in bookmark_data:
                 bookmark_data.pop("checksum")
 
+            found: list[tuple[str, str]] = []
             if "roots" in bookmark_data:
                 for bmk_root in bookmark_data["roots"]:
-                    self._delete_bookmarks_in_one_folder(bookmark_data["roots"][bmk_root], urls_to_delete, profile)
+                    self._delete_bookmarks_in_one_folder(bookmark_data["roots"][bmk_root], urls_to_delete,
+                                                         profile, found)
 
             bookmark_file.write_text(json.dumps(bookmark_data, ensure_ascii=False, indent=4), encoding="utf-8")
+            # 文件写好了才算删掉
+            removed.extend(found)
+        progress(len(profile_ids), len(profile_ids), "")
+        return removed
 
     def search_bookmarks(self, url_contains: str, profile_ids: list[str] = None) -> dict[str, Bookmark]:
         if profile_ids is None:
@@ -324,28 +364,23 @@ class ChromInstance(object):
             ext_ids: list[str],
             profile: Profile,
             special_parts_path: list[str],  # 要么是 ["protection", "macs", ...] 要么是 [..., "pinned_extensions"]
-    ):
-        # 在 Secure Preferences 或者 Preferences 中删除插件数据
+    ) -> set[str]:
+        # 在 Secure Preferences 或者 Preferences 中删除插件数据，返回删掉的插件 ID
+        # 只改文件，内存中的插件由 apply_deleted_extensions 更新
 
         try:
             either_pref_data: dict = json.loads(either_pref_file.read_text(encoding="utf-8"))
         except json.JSONDecodeError:
             self.logger.info(f'[DELETE] [{either_pref_file}] is not valid JSON')
-            return
+            return set()
 
+        found = set()
         ext_settings: dict[str, dict] = get_with_chained_keys(either_pref_data, ["extensions", "settings"])
         if ext_settings is not None:
             for ext_id in ext_ids:
                 if ext_id in ext_settings:
                     ext_settings.pop(ext_id)
-                    # 更新 Profiles
-                    if ext_id in profile.extensions:
-                        profile.extensions.remove(ext_id)
-                    # 更新 Extensions
-                    if ext_id in self.extensions and profile.id in self.extensions[ext_id].profiles:
-                        self.extensions[ext_id].profiles.remove(profile.id)
-                        if len(self.extensions[ext_id].profiles) == 0:
-                            self.extensions.pop(ext_id)
+                    found.add(ext_id)
                     self.logger.info(f"[DELETE] deleted {ext_id} from {profile.id}")
         # else:
             # 太多信息，不要了
@@ -368,25 +403,26 @@ class ChromInstance(object):
             # self.logger.warning(f'[DELETE] [{either_pref_file}] does not contain {"/".join(special_parts_path)}')
 
         either_pref_file.write_text(json.dumps(either_pref_data, ensure_ascii=False, indent=4), encoding="utf-8")
+        return found
 
-    def _delete_extensions_in_secure_pref(self, ext_ids: list[str], profile: Profile):
+    def _delete_extensions_in_secure_pref(self, ext_ids: list[str], profile: Profile) -> set[str]:
         if len(profile.secure_pref_file) == 0:
-            return
+            return set()
         secure_pref_file = Path(profile.secure_pref_file)
 
-        self._delete_extension_from_preferences(
+        return self._delete_extension_from_preferences(
             secure_pref_file,
             ext_ids,
             profile,
             ["protection", "macs", "extensions", "settings"],
         )
 
-    def _delete_extensions_in_pref(self, ext_ids: list[str], profile: Profile):
+    def _delete_extensions_in_pref(self, ext_ids: list[str], profile: Profile) -> set[str]:
         if len(profile.pref_file) == 0:
-            return
+            return set()
         pref_file = Path(profile.pref_file)
 
-        self._delete_extension_from_preferences(
+        return self._delete_extension_from_preferences(
             pref_file,
             ext_ids,
             profile,
@@ -404,7 +440,30 @@ class ChromInstance(object):
             if ext_dir.exists():
                 shutil.rmtree(ext_dir, ignore_errors=True)
 
-    def delete_extensions(self, ext_ids_to_delete: list[str], profile_ids: list[str] = None):
+    def apply_deleted_extensions(self, removed: list[tuple[str, str]]):
+        """把 delete_extensions 从文件中删掉的插件同步到内存，要在 GUI 线程中调用"""
+        for ext_id, profile_id in removed:
+            # 更新 Profiles
+            profile = self.profiles.get(profile_id)
+            if profile is not None and ext_id in profile.extensions:
+                profile.extensions.remove(ext_id)
+            # 更新 Extensions
+            if ext_id in self.extensions and profile_id in self.extensions[ext_id].profiles:
+                self.extensions[ext_id].profiles.remove(profile_id)
+                if len(self.extensions[ext_id].profiles) == 0:
+                    self.extensions.pop(ext_id)
+
+    def delete_extensions(self, ext_ids_to_delete: list[str], profile_ids: list[str] = None,
+                          progress: ProgressFunc = None,
+                          removed: list[tuple[str, str]] = None) -> list[tuple[str, str]]:
+        """
+        只修改文件和删除插件目录，可以在子线程中运行，内存中的数据不变
+
+        :param removed: 删掉的 (插件 ID, 用户 ID) 追加到这里，中途取消时也能知道已经删了哪些
+        :return: removed
+        """
+        if removed is None:
+            removed = []
         # 若插件A存在于 1、2、3，插件B存在于 2、3、4，那么一共要操作的用户是 1、2、3、4
         # 这里是取并集
         default_profile_ids = set()
@@ -418,43 +477,93 @@ class ChromInstance(object):
         else:
             profile_ids = default_profile_ids.intersection(profile_ids)
 
-        for profile_id in profile_ids:
+        progress = progress or _no_progress
+        for i, profile_id in enumerate(profile_ids):
+            progress(i, len(profile_ids), profile_id)
             profile = self.profiles[profile_id]
-            self._delete_extensions_in_secure_pref(ext_ids_to_delete, profile)
-            self._delete_extensions_in_pref(ext_ids_to_delete, profile)
+            found = self._delete_extensions_in_secure_pref(ext_ids_to_delete, profile)
+            found |= self._delete_extensions_in_pref(ext_ids_to_delete, profile)
             self._delete_extensions_from_disk(ext_ids_to_delete, profile)
+            removed.extend((ext_id, profile_id) for ext_id in found)
+        progress(len(profile_ids), len(profile_ids), "")
+        return removed
+
+
+def profile_picture_source(browser: str, profile: Profile) -> tuple:
+    """
+    决定用户头像从哪里来，只检查图片文件是否存在，不读取也不绘制。
+    返回的元组可以作为缓存的 key，头像的来源相同就是同一个图片，与是哪个浏览器、哪个用户无关
+    """
+    if browser in ["chrome", "chromium", "edge"] and len(profile.gaia_picture_file_name) != 0:
+        profile_pic = Path(profile.profile_dir, profile.gaia_picture_file_name)
+        try:
+            st = profile_pic.stat()
+        except OSError:
+            st = None
+        if st is not None:
+            return "picture", str(profile_pic), st.st_mtime_ns, st.st_size
 
-
-def get_profile_picture(browser: str, profile: Profile) -> QIcon:
     if browser in ["chrome", "chromium"]:
-        if len(profile.gaia_picture_file_name) != 0:
-            profile_pic = Path(profile.profile_dir, profile.gaia_picture_file_name)
-            if profile_pic.exists():
-                return create_round_icon_from_pixmap(QIcon(str(profile_pic)).pixmap(96, 96), 96)
-        if len(profile.avatar_icon) != 0:
-            if profile.avatar_icon != "IDR_PROFILE_AVATAR_26":
-                return create_round_icon_from_pixmap(
-                    QIcon(get_icon_path(profile.avatar_icon, f"chrome_avatars")).pixmap(96, 96),
-                    size=96
-                )
-        return create_profile_pic(profile.default_avatar_fill_color, profile.default_avatar_stroke_color)
+        if len(profile.avatar_icon) != 0 and profile.avatar_icon != "IDR_PROFILE_AVATAR_26":
+            return "round", get_icon_path(profile.avatar_icon, "chrome_avatars")
+        return "svg", profile.default_avatar_fill_color, profile.default_avatar_stroke_color
+
+    if browser in ["edge", "brave", "vivaldi", "yandex"] and len(profile.avatar_icon) != 0:
+        return "resource", get_icon_path(profile.avatar_icon, f"{browser}_avatars")
+
+    return "mono", profile.default_avatar_fill_color
+
+
+def _scaled_to_fill(image: QImage, size: int) -> QImage:
+    return image.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatioByExpanding,
+                        Qt.TransformationMode.SmoothTransformation)
 
-    elif browser == "edge":
-        if len(profile.gaia_picture_file_name) != 0:
-            profile_pic = Path(profile.profile_dir, profile.gaia_picture_file_name)
-            if profile_pic.exists():
-                return create_round_icon_from_pixmap(QIcon(str(profile_pic)).pixmap(96, 96), 96)
-        if len(profile.avatar_icon) != 0:
-            return QIcon(get_icon_path(profile.avatar_icon, f"{browser}_avatars"))
 
-    elif browser in ["brave", "vivaldi", "yandex"]:
-        if len(profile.avatar_icon) != 0:
-            return QIcon(get_icon_path(profile.avatar_icon, f"{browser}_avatars"))
+def render_profile_picture(source: tuple, size: int = 96) -> QImage:
+    """
+    按 profile_picture_source 的结果绘制头像，只用 QImage，可以在子线程中调用。
+    绘制结果按来源的内容保存在磁盘上，头像图片以文件内容的哈希为名，下次启动直接读取
+    """
+    kind = source[0]
+    if kind == "picture":
+        try:
+            data = Path(source[1]).read_bytes()
+        except OSError:
+            return QImage()
+        name = hashlib.sha1(data).hexdigest()
+    else:
+        data = b""
+        name = hashlib.sha1(repr(source).encode("utf-8")).hexdigest()
+    name = f"{name}_{size}"
+
+    image = avatar_cache.get(name)
+    if not image.isNull():
+        return image
+
+    if kind == "picture":
+        image = round_image(_scaled_to_fill(QImage.fromData(data), size), size)
+    elif kind == "round":
+        image = round_image(_scaled_to_fill(QImage(source[1]), size), size)
+    elif kind == "svg":
+        image = create_profile_image(source[1], source[2])
+    elif kind == "resource":
+        image = QImage(source[1])
+    else:
+        image = mono_image(argb32_to_rgb(4294967296 + source[1]), "round", size)
 
-    return create_mono_icon(argb32_to_rgb(4294967296 + profile.default_avatar_fill_color), "round")
+    if not image.isNull():
+        avatar_cache.put(name, image)
+    return image
+
+
+def get_profile_picture(browser: str, profile: Profile) -> QIcon:
+    """同步获取头像，会在当前线程读取和绘制，表格中用 icon_loader 异步加载"""
+    return QIcon(QPixmap.fromImage(render_profile_picture(profile_picture_source(browser, profile))))
 
 
+@lru_cache(maxsize=4096)
 def sort_profiles_id_func(profile_id: str) -> int:
+    # 排序时每次比较都会调用，用户 ID 不多，解析过的直接取缓存
     if profile_id == "Default":
         return 0
     else:
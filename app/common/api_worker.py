@@ -1,19 +1,32 @@
 import requests
 from PySide6.QtCore import QObject, Signal
 from app.common.utils import APIException, SAFE_MARKS_API
+from app.common.uploader import BatchUploader
+from app.common.marks_fetcher import SafeMarksFetcher
+
+# (连接超时, 读取超时)，单位秒，服务器没有响应时不会一直卡住
+API_TIMEOUT = (5, 30)
 
 
 # --- API 工作线程 ---
 class ApiWorker(QObject):
     """在单独的线程中执行网络请求，避免 GUI 冻结"""
     # 定义信号
-    queryNecessaryFinished = Signal(list)
-    addBatchFinished = Signal(list)
+    # 标记列表、被删除的插件 ID、是否为完整列表、新的条件请求参数；没有变化时列表为空且不完整
+    queryNecessaryFinished = Signal(list, list, bool, dict)
+    # 服务器的响应、这一批的插件 ID
+    addBatchFinished = Signal(list, list)
+    # 上传失败的插件 ID
+    addBatchFailed = Signal(list)
+    # 这次上传中已经有结果的数量、总数
+    uploadProgress = Signal(int, int)
     error = Signal(str)
 
-    def __init__(self):
+    def __init__(self, validators: dict[str, str] = None):
         super().__init__()
-        self.session = requests.Session()
+        # 上次获取时服务器返回的 ETag、Last-Modified 和增量游标
+        self.fetcher = SafeMarksFetcher(f"{SAFE_MARKS_API}/query_necessary", API_TIMEOUT, validators)
+        self.uploader = BatchUploader(f"{SAFE_MARKS_API}/add_batch", API_TIMEOUT)
 
     @staticmethod
     def _handle_response(response):
@@ -29,17 +42,28 @@ class ApiWorker(QObject):
     def do_query_necessary(self):
         """执行 query_necessary 操作"""
         try:
-            response = self.session.get(f"{SAFE_MARKS_API}/query_necessary")
-            data = self._handle_response(response)
-            self.queryNecessaryFinished.emit(data)
+            result = self.fetcher.fetch()
+            # 没有变化时 marks 和 removed 都为空
+            self.queryNecessaryFinished.emit(result.marks, result.removed, result.full, result.validators)
         except Exception as e:
             self.error.emit(str(e))
 
     def do_add_batch(self, extensions: list[dict[str, str | int]]):
-        """执行 add_batch 操作"""
-        try:
-            response = self.session.post(f"{SAFE_MARKS_API}/add_batch", json=extensions)
-            data = self._handle_response(response)
-            self.addBatchFinished.emit(data)
-        except Exception as e:
-            self.error.emit(str(e))
+        """执行 add_batch 操作，分批上传，每批完成后都单独通知"""
+        done = 0
+        for batch, response, error in self.uploader.upload(extensions):
+            ext_ids = [e["ID"] for e in batch]
+            done += len(batch)
+            try:
+                if error is not None:
+                    raise error
+                data = self._handle_response(response)
+                self.addBatchFinished.emit(data, ext_ids)
+            except Exception as e:
+                self.addBatchFailed.emit(ext_ids)
+                self.error.emit(str(e))
+            self.uploadProgress.emit(done, len(extensions))
+
+    def stop(self):
+        """退出前调用，正在重试等待的上传会立即放弃，下次启动时继续"""
+        self.uploader.stop()
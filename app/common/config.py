@@ -2,6 +2,7 @@ from pathlib import Path
 from qfluentwidgets import (
     QConfig, qconfig, Theme, BoolValidator, ConfigItem,
     SmoothMode, OptionsValidator, EnumSerializer, OptionsConfigItem,
+    RangeConfigItem, RangeValidator,
 )
 from app.common.utils import get_app_dir
 
@@ -13,6 +14,9 @@ class Config(QConfig):
     smooth_mode = OptionsConfigItem("Personalize", "SmoothMode", SmoothMode.NO_SMOOTH,
                                     OptionsValidator(SmoothMode), EnumSerializer(SmoothMode), restart=True)
 
+    slow_query_ms = RangeConfigItem("Debug", "SlowQueryMs", 100, RangeValidator(1, 5000), restart=True)
+    log_to_file = ConfigItem("Debug", "LogToFile", False, BoolValidator(), restart=True)
+
 
 VERSION = '4.1.1'
 ORG_NAME = "Oranje"
@@ -20,6 +24,10 @@ APP_NAME = "ChromHelper"
 ZH_APP_NAME = "浏览器助手"
 APP_DIR = get_app_dir(ORG_NAME, APP_NAME)
 SENT_CACHE_FILE = Path(APP_DIR, "sent_ext.json")
+SAFE_MARKS_CACHE_FILE = Path(APP_DIR, "safe_marks.json")
+THUMBNAIL_DIR = Path(APP_DIR, "thumbnails")
+AVATAR_DIR = Path(APP_DIR, "avatars")
+LOG_FILE = Path(APP_DIR, "logs", f"{APP_NAME}.log")
 
 cfg = Config()
 cfg.themeMode.value = Theme.LIGHT
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import operator
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from itertools import compress, repeat
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from app.chromy.structs import Extension
+    from app.common.utils import SafeMark
+
+# 安全性 -2 ~ 1 加上这个偏移后存为一个字节
+SAFE_OFFSET = 2
+# 用户数存为一个字节，超过的按 255 算
+MAX_PROFILE_COUNT = 255
+
+
+def _clean(text: str) -> str:
+    # 制表符用作名称和描述的分隔符，不能出现在内容中
+    return text.lower().replace("\t", " ")
+
+
+def _and(a: bytes | bytearray, b: bytes | bytearray) -> bytes:
+    # 每个字节只有 0 和 1，按整数做与运算，不用逐个比较
+    n = len(a)
+    return (int.from_bytes(a, "little") & int.from_bytes(b, "little")).to_bytes(n, "little")
+
+
+class ExtensionColumns(object):
+    """
+    插件表格筛选用的数据，按行号预先算好，筛选时不再访问插件对象。
+    安全性和用户数各占一个字节，可以用 bytes.translate 一次算出整列的结果
+    """
+
+    def __init__(self, ext_ids: Iterable[str], extensions: Mapping[str, Extension],
+                 ext_safe_marks: Mapping[str, SafeMark]):
+        safe = bytearray()
+        profiles = bytearray()
+        self.profile_counts: dict[int, int] = {}  # 超过 MAX_PROFILE_COUNT 的行的实际用户数
+        self.texts: list[str] = []  # 小写的名称和描述
+        for row, ext_id in enumerate(ext_ids):
+            ext = extensions.get(ext_id)
+            mark = ext_safe_marks.get(ext_id)
+            safe.append((mark.safe if mark is not None else -2) + SAFE_OFFSET)
+            if ext is None:
+                profiles.append(0)
+                self.texts.append("")
+            else:
+                if len(ext.profiles) >= MAX_PROFILE_COUNT:
+                    self.profile_counts[row] = len(ext.profiles)
+                profiles.append(min(len(ext.profiles), MAX_PROFILE_COUNT))
+                self.texts.append(f"{_clean(ext.name)}\t{_clean(ext.description)}")
+
+        self.safe = safe
+        self.profiles = bytes(profiles)
+        # 安全性原地更新后加一，筛选结果据此判断是否过期
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self.safe)
+
+    def set_safe(self, row: int, safe: int):
+        self.safe[row] = safe + SAFE_OFFSET
+        self.version += 1
+
+
+@dataclass(frozen=True)
+class ExtensionFilter(object):
+    safe: frozenset[int] | None = None  # 接受的安全性，None 表示不限
+    text: str = ""                      # 空格分隔的关键词，都要出现在名称或描述中
+    min_profiles: int = 0               # 至少在多少个用户中
+
+    def mask(self, cols: ExtensionColumns) -> bytes:
+        """每行一个字节，1 为通过"""
+        n = len(cols)
+        mask = b"\x01" * n
+        if self.safe is not None:
+            table = bytes(int(v - SAFE_OFFSET in self.safe) for v in range(256))
+            mask = cols.safe.translate(table)
+        if self.min_profiles > 1:
+            m = min(self.min_profiles, MAX_PROFILE_COUNT)
+            table = bytes(int(v >= m) for v in range(256))
+            profile_mask = cols.profiles.translate(table)
+            if self.min_profiles > MAX_PROFILE_COUNT:
+                # 一个字节存不下，这些行再按实际用户数判断一次
+                profile_mask = bytearray(profile_mask)
+                for row, count in cols.profile_counts.items():
+                    profile_mask[row] = int(count >= self.min_profiles)
+            mask = _and(mask, profile_mask)
+        words = self.text.lower().split()
+        if len(words) == 0:
+            return bytes(mask)
+
+        # 只在还剩下的行中查找下一个关键词，map 和 compress 都在 C 中逐行执行
+        rows = list(compress(range(n), mask))
+        for word in words:
+            if len(rows) == 0:
+                break
+            texts = cols.texts if len(rows) == n else map(cols.texts.__getitem__, rows)
+            rows = list(compress(rows, map(operator.contains, texts, repeat(word))))
+        result = bytearray(n)
+        for row in rows:
+            result[row] = 1
+        return bytes(result)
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from collections.abc import Callable
+from functools import partial
+from PySide6.QtCore import QObject, QRunnable, QThread, QThreadPool, Signal
+from PySide6.QtGui import QIcon, QImage, QPixmap
+from app.common.utils import get_icon_path
+from app.common.thumbnails import thumbnail_cache
+
+# 缓存的图标最多占用多少字节（按解码后的图片计算），超过后淘汰最久没用过的
+ICON_CACHE_BYTES = 32 * 1024 * 1024
+# 解码时缩放到的边长，表格中最大显示 32，留出高分屏的余量
+ICON_DECODE_SIZE = 64
+
+
+class _DecodeTask(QRunnable):
+
+    def __init__(self, loader: "IconLoader", key: str, render: Callable[[], QImage]):
+        super().__init__()
+        self.loader = loader
+        self.key = key
+        self.render = render
+
+    def run(self):
+        # QImage 可以在子线程中使用，QPixmap 和 QIcon 只能在 GUI 线程创建
+        self.loader.decoded.emit(self.key, self.render())
+
+
+class IconLoader(QObject):
+    """
+    在线程池中读取图标（优先读磁盘上的缩略图）或者执行给定的渲染函数，完成后发出 loaded 信号，
+    所有模型共用一个按字节数限制大小的 LRU 缓存
+    """
+
+    loaded = Signal(str)  # 缓存的 key
+    decoded = Signal(str, QImage)
+
+    def __init__(self, max_bytes: int = ICON_CACHE_BYTES, decode_size: int = ICON_DECODE_SIZE, parent=None):
+        super().__init__(parent)
+        self.max_bytes = max_bytes
+        self.decode_size = decode_size
+        self.cache: OrderedDict[str, tuple[QIcon, int]] = OrderedDict()
+        self.cache_bytes = 0
+        self.pending: set[str] = set()
+        self._placeholder: QIcon | None = None
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(2, QThread.idealThreadCount() // 2))
+        # 子线程发出的信号会排队到本对象所在的 GUI 线程中处理
+        self.decoded.connect(self._on_decoded)
+
+    @property
+    def placeholder(self) -> QIcon:
+        """图标还没加载好，或者加载失败时显示的图标"""
+        if self._placeholder is None:
+            self._placeholder = QIcon(get_icon_path("none"))
+        return self._placeholder
+
+    def get(self, key: str, render: Callable[[], QImage] = None) -> QIcon | None:
+        """
+        已经缓存的直接返回，否则开始加载并返回 None，加载完成后发出 loaded 信号
+
+        :param key: 缓存的 key，没有给出 render 时为图标路径
+        :param render: 在子线程中生成图片的函数，默认读取 key 对应的图标
+        """
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key][0]
+        if key not in self.pending:
+            self.pending.add(key)
+            if render is None:
+                render = partial(thumbnail_cache.image, key, self.decode_size)
+            self.pool.start(_DecodeTask(self, key, render))
+        return None
+
+    def _on_decoded(self, key: str, image: QImage):
+        self.pending.discard(key)
+        if image.isNull():
+            # 文件不存在或者不是图片，记下占位图标，不再反复读取
+            icon, nbytes = self.placeholder, 0
+        else:
+            icon, nbytes = QIcon(QPixmap.fromImage(image)), image.sizeInBytes()
+
+        old = self.cache.pop(key, None)
+        if old is not None:
+            self.cache_bytes -= old[1]
+        self.cache[key] = (icon, nbytes)
+        self.cache_bytes += nbytes
+        while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+            _, (_, evicted) = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted
+        self.loaded.emit(key)
+
+    def clear(self):
+        self.cache.clear()
+        self.cache_bytes = 0
+
+
+icon_loader = IconLoader()
@@ -1,7 +1,7 @@
 from typing import Literal
 
 from PySide6.QtCore import Qt, QByteArray
-from PySide6.QtGui import QBrush, QColor, QIcon, QPainter, QPixmap
+from PySide6.QtGui import QBrush, QColor, QIcon, QImage, QPainter, QPixmap
 from PySide6.QtSvg import QSvgRenderer
 
 
@@ -9,27 +9,37 @@ def argb32_to_rgb(argb32: int):
     return argb32 & 0x00FFFFFF
 
 
-def get_icon_from_svg(svg_data: str, w: int = None, h: int = None) -> QIcon:
+def _blank_image(w: int, h: int) -> QImage:
+    image = QImage(w, h, QImage.Format.Format_ARGB32_Premultiplied)
+    image.fill(Qt.GlobalColor.transparent)
+    return image
+
+
+# 以下 *_image 函数只用 QImage 绘制，可以在子线程中调用；返回 QIcon 的只能在 GUI 线程调用
+
+def render_svg(svg_data: str, w: int = None, h: int = None) -> QImage:
     w = 128 if w is None else w
     h = 128 if h is None else h
 
     renderer = QSvgRenderer(QByteArray(svg_data.encode("utf-8")))
-    pixmap = QPixmap(w, h)
-    pixmap.fill(Qt.GlobalColor.transparent)
-    painter = QPainter(pixmap)
+    image = _blank_image(w, h)
+    painter = QPainter(image)
     renderer.render(painter)
     painter.end()
 
-    return QIcon(pixmap)
+    return image
 
 
-def create_mono_icon(
+def get_icon_from_svg(svg_data: str, w: int = None, h: int = None) -> QIcon:
+    return QIcon(QPixmap.fromImage(render_svg(svg_data, w, h)))
+
+
+def mono_image(
         color: str | int | Qt.GlobalColor,
         shape: Literal["rect", "round"],
-        size: int = 96) -> QIcon:
-    pixmap = QPixmap(size, size)
-    pixmap.fill(Qt.GlobalColor.transparent)
-    painter = QPainter(pixmap)
+        size: int = 96) -> QImage:
+    image = _blank_image(size, size)
+    painter = QPainter(image)
     painter.setRenderHint(QPainter.RenderHint.Antialiasing)
     painter.setBrush(QColor(color))
     painter.setPen(Qt.PenStyle.NoPen)
@@ -39,23 +49,30 @@ def create_mono_icon(
         painter.drawEllipse(0, 0, size, size)
     painter.end()
 
-    return QIcon(pixmap)
+    return image
 
 
-def create_round_icon_from_pixmap(pixmap: QPixmap, size: int = None):
+def create_mono_icon(
+        color: str | int | Qt.GlobalColor,
+        shape: Literal["rect", "round"],
+        size: int = 96) -> QIcon:
+    return QIcon(QPixmap.fromImage(mono_image(color, shape, size)))
+
+
+def round_image(source: QImage, size: int = None) -> QImage:
     if size is None:
-        # 创建一个和输入图片大小一样的 QPixmap，带透明背景
-        size = min(pixmap.width(), pixmap.height())  # 取最小边长来保证是正方形
+        # 取最小边长来保证是正方形
+        size = min(source.width(), source.height())
 
-    rounded_pixmap = QPixmap(size, size)
-    rounded_pixmap.fill(Qt.GlobalColor.transparent)  # 填充为透明背景
+    # 带透明背景
+    image = _blank_image(size, size)
 
     # 使用 QPainter 绘制圆形
-    painter = QPainter(rounded_pixmap)
+    painter = QPainter(image)
     painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
     # 创建一个圆形遮罩
-    brush = QBrush(pixmap)
+    brush = QBrush(source)
     painter.setBrush(brush)
     painter.setPen(Qt.PenStyle.NoPen)
 
@@ -64,5 +81,8 @@ def create_round_icon_from_pixmap(pixmap: QPixmap, size: int = None):
 
     painter.end()
 
-    # 将圆形图像转换为 QIcon
-    return QIcon(rounded_pixmap)
+    return image
+
+
+def create_round_icon_from_pixmap(pixmap: QPixmap, size: int = None):
+    return QIcon(QPixmap.fromImage(round_image(pixmap.toImage(), size)))
@@ -0,0 +1,76 @@
+from dataclasses import dataclass, field
+import requests
+
+
+class FetchError(Exception):
+    pass
+
+
+@dataclass
+class FetchResult(object):
+    marks: list[dict] = field(default_factory=list)    # [{"ID": ..., "SAFE": ...}]
+    removed: list[str] = field(default_factory=list)   # 增量结果中被服务器删除的插件 ID
+    full: bool = False                                 # marks 是否为完整列表
+    validators: dict[str, str] = field(default_factory=dict)
+    not_modified: bool = False                         # 304，和上次一样
+
+
+class SafeMarksFetcher(object):
+    """
+    获取安全标记，带上次的 ETag、Last-Modified 和增量游标发条件请求，
+    没有变化时服务器只回 304，有变化时可以只返回变化的部分
+    """
+
+    def __init__(self, url: str, timeout: tuple[float, float],
+                 validators: dict[str, str] = None, session: requests.Session = None):
+        self.url = url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        # requests 默认也会带上，这里写明，响应会自动解压
+        self.session.headers["Accept-Encoding"] = "gzip"
+        self.validators: dict[str, str] = dict(validators or {})
+
+    def _conditional_request(self) -> tuple[dict[str, str], dict[str, str]]:
+        headers = {}
+        params = {}
+        if "etag" in self.validators:
+            headers["If-None-Match"] = self.validators["etag"]
+        if "last_modified" in self.validators:
+            headers["If-Modified-Since"] = self.validators["last_modified"]
+        if "cursor" in self.validators:
+            # 只有服务器给过游标才发送，不认识这个参数的服务器会照常返回完整列表
+            params["since"] = self.validators["cursor"]
+        return headers, params
+
+    def fetch(self) -> FetchResult:
+        headers, params = self._conditional_request()
+        response = self.session.get(self.url, headers=headers, params=params, timeout=self.timeout)
+        if response.status_code == 304:
+            return FetchResult(validators=dict(self.validators), not_modified=True)
+        if not response.ok:
+            try:
+                detail = response.json().get("detail", response.text)
+            except (requests.JSONDecodeError, AttributeError):
+                detail = response.text
+            raise FetchError(f"API 错误 (状态 {response.status_code}): {detail}")
+
+        data = response.json()
+        if isinstance(data, dict):
+            # 支持增量的服务器返回 {"marks": [...], "removed": [...], "full": bool, "cursor": str}，
+            # removed 是上次游标之后被删除的插件 ID，完整列表不需要
+            marks = data.get("marks", [])
+            full = data.get("full", True)
+            removed = [] if full else list(data.get("removed", []))
+            cursor = data.get("cursor")
+        else:
+            marks, removed, full, cursor = data, [], True, None
+
+        validators = {}
+        if "ETag" in response.headers:
+            validators["etag"] = response.headers["ETag"]
+        if "Last-Modified" in response.headers:
+            validators["last_modified"] = response.headers["Last-Modified"]
+        if cursor is not None:
+            validators["cursor"] = str(cursor)
+        self.validators = validators
+        return FetchResult(marks, removed, full, dict(validators))
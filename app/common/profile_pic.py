@@ -1,6 +1,6 @@
-from PySide6.QtGui import QIcon
+from PySide6.QtGui import QIcon, QImage, QPixmap
 
-from app.common.icons import get_icon_from_svg
+from app.common.icons import render_svg
 
 # ChatGPT 生成
 # 十六进制颜色里不能有 alpha 通道，否则绘制不出来
@@ -30,13 +30,18 @@ def argb_to_rgb(argb_value: int) -> int:
     return rgba_value
 
 
+def create_profile_image(bg_rgba: int, fg_rgba: int) -> QImage:
+    # 可以在子线程中调用
+    bg = format(argb_to_rgb(4294967296 + bg_rgba), "x")
+    fg = format(argb_to_rgb(4294967296 + fg_rgba), "x")
+    return render_svg(profile_svg.format(bg_rgb=bg, fg_rgb=fg), 96, 96)
+
+
 def create_profile_pic(bg_rgba: int, fg_rgba: int) -> QIcon:
     if (bg_rgba, fg_rgba) in profile_icon_map:
         return profile_icon_map[(bg_rgba, fg_rgba)]
 
-    bg = format(argb_to_rgb(4294967296 + bg_rgba), "x")
-    fg = format(argb_to_rgb(4294967296 + fg_rgba), "x")
-    icon = get_icon_from_svg(profile_svg.format(bg_rgb=bg, fg_rgb=fg), 96, 96)
+    icon = QIcon(QPixmap.fromImage(create_profile_image(bg_rgba, fg_rgba)))
     profile_icon_map[(bg_rgba, fg_rgba)] = icon
 
     return icon
@@ -0,0 +1,158 @@
+import operator
+from itertools import compress, repeat
+from typing import Any
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+# 最多找多少条，再多也看不过来
+MAX_SEARCH_RESULTS = 1000
+# 每次在多少项中查找，找到的结果按块发出，也在块之间检查是否已被新的搜索取代
+SEARCH_CHUNK = 4096
+# 结果中显示的值最多多少个字符
+LABEL_VALUE_LENGTH = 80
+
+
+def value_text(value: Any) -> str:
+    """标量按 JSON 的写法转为文字，容器为空字符串"""
+    if isinstance(value, (dict, list)):
+        return ""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class RawDataIndex(object):
+    """
+    原始数据中所有键和值的索引。每一项记录父项在索引中的位置和自己在父项中的行号，
+    可以还原出从根到这一项的行号路径，与惰性创建子项的树模型一一对应
+    """
+
+    def __init__(self, raw_data: dict | list):
+        self.parents: list[int] = []  # 父项的位置，-1 为根
+        self.rows: list[int] = []     # 在父项中的行号
+        self.keys: list[str] = []
+        self.values: list[str] = []
+        self.texts: list[str] = []    # 小写的 "键\t值"，搜索用
+
+        # 不用递归，嵌套很深的数据也不会超出递归层数
+        stack = [(-1, raw_data)]
+        while len(stack) != 0:
+            parent, container = stack.pop()
+            if isinstance(container, dict):
+                items = container.items()
+            else:
+                items = ((f"[{i}]", v) for i, v in enumerate(container))
+            for row, (key, value) in enumerate(items):
+                pos = len(self.keys)
+                key = str(key)
+                text = value_text(value)
+                self.parents.append(parent)
+                self.rows.append(row)
+                self.keys.append(key)
+                self.values.append(text)
+                self.texts.append(f"{key.lower()}\t{text.lower()}")
+                if isinstance(value, (dict, list)) and len(value) != 0:
+                    stack.append((pos, value))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _chain(self, pos: int) -> list[int]:
+        chain = []
+        while pos != -1:
+            chain.append(pos)
+            pos = self.parents[pos]
+        chain.reverse()
+        return chain
+
+    def path(self, pos: int) -> list[int]:
+        """从根到这一项，每一层的行号"""
+        return [self.rows[p] for p in self._chain(pos)]
+
+    def label(self, pos: int) -> str:
+        keys = " / ".join(self.keys[p] for p in self._chain(pos))
+        value = self.values[pos]
+        if len(value) == 0:
+            return keys
+        if len(value) > LABEL_VALUE_LENGTH:
+            value = value[:LABEL_VALUE_LENGTH] + "…"
+        return f"{keys}: {value}"
+
+
+class _IndexTask(QRunnable):
+
+    def __init__(self, searcher: "RawDataSearcher", raw_data: dict | list):
+        super().__init__()
+        self.searcher = searcher
+        self.raw_data = raw_data
+
+    def run(self):
+        self.searcher.index = RawDataIndex(self.raw_data)
+        self.searcher.indexed.emit(len(self.searcher.index))
+
+
+class _SearchTask(QRunnable):
+
+    def __init__(self, searcher: "RawDataSearcher", generation: int, words: list[str]):
+        super().__init__()
+        self.searcher = searcher
+        self.generation = generation
+        self.words = words
+
+    def run(self):
+        index = self.searcher.index
+        texts = index.texts
+        total = 0
+        for start in range(0, len(texts), SEARCH_CHUNK):
+            if self.searcher.generation != self.generation:
+                return  # 已经有新的搜索了
+            end = min(start + SEARCH_CHUNK, len(texts))
+            rows = range(start, end)
+            chunk = texts[start:end]
+            for word in self.words:
+                hits = list(compress(range(len(chunk)), map(operator.contains, chunk, repeat(word))))
+                rows = [rows[i] for i in hits]
+                chunk = [chunk[i] for i in hits]
+                if len(rows) == 0:
+                    break
+            if len(rows) == 0:
+                continue
+            rows = rows[:MAX_SEARCH_RESULTS - total]
+            total += len(rows)
+            self.searcher.found.emit(self.generation, rows)
+            if total >= MAX_SEARCH_RESULTS:
+                break
+        self.searcher.finished.emit(self.generation, total)
+
+
+class RawDataSearcher(QObject):
+    """
+    创建后立即在子线程中建立索引，之后每次搜索也在子线程中进行，
+    找到的结果分批通过 found 信号发出。只有一个线程，搜索总在索引建好之后执行
+    """
+
+    indexed = Signal(int)           # 索引的项数
+    found = Signal(int, list)       # 搜索的序号，[索引中的位置]
+    finished = Signal(int, int)     # 搜索的序号，结果数
+
+    def __init__(self, raw_data: dict | list, parent: QObject = None):
+        super().__init__(parent)
+        self.index: RawDataIndex | None = None
+        # 每次搜索加一，旧的搜索发现序号变了就停止，发出的结果也按序号丢弃
+        self.generation = 0
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.pool.start(_IndexTask(self, raw_data))
+
+    def search(self, text: str) -> int:
+        """开始新的搜索并返回它的序号，关键词为空时只取消之前的搜索"""
+        self.generation += 1
+        words = text.lower().split()
+        if len(words) != 0:
+            self.pool.start(_SearchTask(self, self.generation, words))
+        return self.generation
+
+    def cancel(self):
+        self.generation += 1
@@ -0,0 +1,76 @@
+import json
+import os
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from app.common.utils import SafeMark
+
+
+class SafeMarkCache(object):
+    """
+    插件安全标记的本地缓存，启动时同步读取，不用等网络就能显示上次的标记。
+    联网获取到新标记后合并进来，再整体写回
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.fetched_at: float = 0.0  # 上次成功获取的时间戳，0 表示从未获取过
+        # 条件请求用的 etag、last_modified 和服务器给的增量游标 cursor
+        self.validators: dict[str, str] = {}
+
+    def load(self) -> dict[str, SafeMark]:
+        try:
+            data: dict = json.loads(self.path.read_text(encoding="utf-8"))
+        except (json.JSONDecodeError, FileNotFoundError, UnicodeDecodeError):
+            return {}
+        self.fetched_at = data.get("fetched_at", 0.0)
+        self.validators = data.get("validators", {})
+        marks: dict[str, int] = data.get("marks", {})
+        return {ext_id: SafeMark(id=ext_id, safe=safe) for ext_id, safe in marks.items()}
+
+    def save(self, marks: dict[str, SafeMark], fetched_at: float = None, validators: dict[str, str] = None):
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        if validators is not None:
+            self.validators = validators
+        data = {
+            "fetched_at": self.fetched_at,
+            "validators": self.validators,
+            "marks": {ext_id: mark.safe for ext_id, mark in marks.items()},
+        }
+        # 先写临时文件再替换，写到一半崩溃也不会损坏原来的缓存
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def apply(self, marks: dict[str, SafeMark], incoming: dict[str, int], removed: list[str],
+              full: bool, validators: dict[str, str]) -> dict[str, SafeMark]:
+        """把获取到的结果合并进 marks 并写回，返回有变化的标记"""
+        changed = merge_safe_marks(marks, incoming, full=full, removed=removed)
+        self.save(marks, validators=validators)
+        return changed
+
+
+def merge_safe_marks(current: dict[str, SafeMark], incoming: dict[str, int],
+                     full: bool = True, removed: Iterable[str] = ()) -> dict[str, SafeMark]:
+    """
+    把新获取的标记合并到 current 中
+
+    :param current: 当前的标记，会被原地修改
+    :param incoming: 新获取的标记，key 为插件 ID，value 为安全性
+    :param full: incoming 是否为完整列表，是则不在其中的标记视为已被移除
+    :param removed: 增量结果中被服务器删除的插件 ID
+    :return: 有变化的标记，被移除的标记安全性为 -2（未记录）
+    """
+    changed: dict[str, SafeMark] = {}
+    for ext_id, safe in incoming.items():
+        mark = current.get(ext_id)
+        if mark is None or mark.safe != safe:
+            current[ext_id] = SafeMark(id=ext_id, safe=safe)
+            changed[ext_id] = current[ext_id]
+    if full:
+        removed = current.keys() - incoming.keys()
+    for ext_id in removed:
+        if ext_id in current and ext_id not in incoming:
+            current.pop(ext_id)
+            changed[ext_id] = SafeMark(id=ext_id)
+    return changed
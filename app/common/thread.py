@@ -1,49 +1,293 @@
-from typing import Callable
-from PySide6.QtCore import Qt, QObject, QThread
-from PySide6.QtGui import QKeyEvent
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from enum import Enum, IntEnum
+from logging import Logger
+from typing import Any, Callable
+from PySide6.QtCore import QObject, QPoint, QRunnable, QThread, QThreadPool, Signal
 from PySide6.QtWidgets import QWidget
-from qfluentwidgets import MessageBoxBase, BodyLabel
+from qfluentwidgets import StateToolTip
+from app.common.logger import FakeLogger
 
+# 进度信号最多多久发一次，单位秒，太频繁反而拖慢界面
+PROGRESS_INTERVAL = 0.05
+# 退出时最多等待正在运行的任务多久，单位毫秒
+SHUTDOWN_WAIT_MS = 5000
 
-class TaskWorker(QThread):
 
-    def __init__(
-            self,
-            parent: QObject,
-            func: Callable,
-            *args,
-            **kwargs,
-    ):
+class FutureWatcher(QObject):
+    """把其他线程中 Future 的结果通过信号转到本对象所在的线程（一般是 GUI 线程）"""
+
+    finished = Signal(object)
+    failed = Signal(str)
+    _done = Signal(object)
+
+    def __init__(self, future: Future, parent: QObject = None):
+        super().__init__(parent)
+        # 从其他线程发出的信号会排队到本对象的线程中处理
+        self._done.connect(self._on_done)
+        future.add_done_callback(self._done.emit)
+
+    def _on_done(self, future: Future):
+        if future.cancelled():
+            self.failed.emit("cancelled")
+        elif future.exception() is not None:
+            self.failed.emit(str(future.exception()))
+        else:
+            self.finished.emit(future.result())
+        self.deleteLater()
+
+
+def watch_future(
+        future: Future,
+        parent: QObject,
+        on_finished: Callable[[Any], None] = None,
+        on_failed: Callable[[str], None] = None,
+) -> FutureWatcher:
+    watcher = FutureWatcher(future, parent)
+    if on_finished is not None:
+        watcher.finished.connect(on_finished)
+    if on_failed is not None:
+        watcher.failed.connect(on_failed)
+    return watcher
+
+
+class TaskPriority(IntEnum):
+    """线程池中排队的任务，优先级高的先开始"""
+    LOW = -10
+    NORMAL = 0
+    HIGH = 10
+
+
+class TaskState(Enum):
+    WAITING = "waiting"      # 同一个 key 的前一个任务还没结束
+    RUNNING = "running"      # 已经交给线程池，可能还在排队
+    FINISHED = "finished"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class TaskCancelled(Exception):
+    """任务在检查点发现已被取消时抛出，由调度器处理"""
+    pass
+
+
+class TaskContext(object):
+    """
+    任务函数的第一个参数。任务在合适的地方调用 progress 或者 check，
+    已被取消的话会抛出 TaskCancelled，取消是协作式的，不会强行中断线程
+    """
+
+    def __init__(self, handle: "TaskHandle"):
+        self._handle = handle
+        self._cancel = threading.Event()
+        self._last_emit = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise TaskCancelled()
+
+    def progress(self, done: int, total: int, item: str = ""):
+        """报告进度，还没完成时同时也是取消的检查点"""
+        if done < total:
+            self.check()
+        now = time.monotonic()
+        if done >= total or now - self._last_emit >= PROGRESS_INTERVAL:
+            self._last_emit = now
+            # 在子线程中调用，经私有信号排队到 GUI 线程后再发出 progressed
+            self._handle._progress.emit(done, total, item)
+
+
+class TaskHandle(QObject):
+    """提交任务后得到的句柄，信号都在 GUI 线程中发出，任务结束后最后发出 ended"""
+
+    progressed = Signal(int, int, str)  # 已完成、总数、当前项
+    finished = Signal(object)           # 任务函数的返回值
+    failed = Signal(str)
+    cancelled = Signal()
+    ended = Signal()
+    _done = Signal(object, object)      # TaskState、返回值或者错误信息
+    _progress = Signal(int, int, str)
+
+    def __init__(self, name: str, func: Callable[[TaskContext], Any], key: str | None,
+                 priority: TaskPriority, parent: "TaskScheduler"):
         super().__init__(parent)
+        self.name = name
         self.func = func
-        self.args = args
-        self.kwargs = kwargs
+        self.key = key
+        self.priority = priority
+        self.state = TaskState.WAITING
+        self.context = TaskContext(self)
+        # 子线程发出的信号会排队到本对象所在的 GUI 线程中处理
+        self._done.connect(self._on_done)
+        self._progress.connect(self._on_progress)
+
+    def cancel(self):
+        """请求取消，任务在下一个检查点停止；还没开始的不会再执行"""
+        self.context._cancel.set()
+
+    def is_active(self) -> bool:
+        return self.state in (TaskState.WAITING, TaskState.RUNNING)
+
+    def _on_progress(self, done: int, total: int, item: str):
+        self.progressed.emit(done, total, item)
+
+    def _on_done(self, state: TaskState, payload: Any):
+        self.state = state
+        if state == TaskState.FINISHED:
+            self.finished.emit(payload)
+        elif state == TaskState.FAILED:
+            self.failed.emit(payload)
+        else:
+            self.cancelled.emit()
+        self.ended.emit()
+        self.parent().task_ended(self)
+        self.deleteLater()
+
+
+class _TaskRunnable(QRunnable):
+
+    def __init__(self, handle: TaskHandle, logger: Logger | FakeLogger):
+        super().__init__()
+        self.handle = handle
+        self.logger = logger
 
     def run(self):
-        self.func(*self.args, **self.kwargs)
+        handle = self.handle
+        try:
+            handle.context.check()
+            result = handle.func(handle.context)
+        except TaskCancelled:
+            handle._done.emit(TaskState.CANCELLED, None)
+        except Exception as e:
+            self.logger.error(f"[TASK] {handle.name}: {e}\n{traceback.format_exc()}")
+            handle._done.emit(TaskState.FAILED, str(e))
+        else:
+            handle._done.emit(TaskState.FINISHED, result)
+
 
+class TaskScheduler(QObject):
+    """
+    所有后台任务共用一个线程池，不再阻塞界面。
+    给出相同 key 的任务（比如操作同一个浏览器数据目录的）按提交顺序逐个执行，不会同时读写
+    """
 
-class BlockingDialog(MessageBoxBase):
+    task_submitted = Signal(object)  # TaskHandle
 
-    def __init__(self, msg: str, parent: QWidget = None):
+    def __init__(self, parent: QObject = None):
         super().__init__(parent)
-        self.viewLayout.addWidget(BodyLabel(msg, self))
-        self.widget.setMinimumWidth(400)
-        self.buttonGroup.hide()
-
-    def keyPressEvent(self, event: QKeyEvent):
-        # 强制关闭的方法，尽量不要用
-        if event.key() == Qt.Key.Key_C and event.modifiers() == Qt.KeyboardModifier.ControlModifier:
-            self.close()
+        self.logger: Logger | FakeLogger = FakeLogger()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max(2, QThread.idealThreadCount()))
+        self.tasks: set[TaskHandle] = set()
+        self.waiting: dict[str, deque[TaskHandle]] = {}
+        self.busy_keys: set[str] = set()
+
+    def submit(self, name: str, func: Callable[..., Any], *args,
+               priority: TaskPriority = TaskPriority.NORMAL, key: str = None, **kwargs) -> TaskHandle:
+        """
+        提交任务，func 在子线程中以 func(ctx, *args, **kwargs) 的形式调用，ctx 为 TaskContext
+
+        :param name: 显示给用户的任务名称
+        :param priority: 在线程池中排队时的优先级
+        :param key: 相同 key 的任务不会同时执行
+        """
+        handle = TaskHandle(name, lambda ctx: func(ctx, *args, **kwargs), key, priority, self)
+        self.tasks.add(handle)
+        if key is not None and key in self.busy_keys:
+            self.waiting.setdefault(key, deque()).append(handle)
+        else:
+            self._start(handle)
+        self.task_submitted.emit(handle)
+        return handle
+
+    def _start(self, handle: TaskHandle):
+        if handle.key is not None:
+            self.busy_keys.add(handle.key)
+        handle.state = TaskState.RUNNING
+        self.pool.start(_TaskRunnable(handle, self.logger), int(handle.priority))
+
+    def task_ended(self, handle: TaskHandle):
+        self.tasks.discard(handle)
+        key = handle.key
+        if key is None:
+            return
+        queue = self.waiting.get(key)
+        if queue:
+            self._start(queue.popleft())
         else:
-            super().keyPressEvent(event)
+            self.waiting.pop(key, None)
+            self.busy_keys.discard(key)
+
+    def running(self, key: str = None) -> list[TaskHandle]:
+        """还没结束的任务，给出 key 时只看这个 key 的"""
+        return [t for t in self.tasks if key is None or t.key == key]
+
+    def cancel_all(self):
+        for handle in self.tasks:
+            handle.cancel()
+
+    def shutdown(self, msecs: int = SHUTDOWN_WAIT_MS):
+        """退出前调用，取消所有任务并等待正在执行的停下"""
+        self.cancel_all()
+        self.waiting.clear()
+        self.pool.waitForDone(msecs)
+
+
+_task_scheduler: TaskScheduler | None = None
+
+
+def get_task_scheduler() -> TaskScheduler:
+    """第一次用到时才创建，这时 QApplication 已经存在"""
+    global _task_scheduler
+    if _task_scheduler is None:
+        _task_scheduler = TaskScheduler()
+    return _task_scheduler
+
+
+# 每个窗口中正在显示的进度提示，新的排在下面
+_shown_tips: dict[QWidget, list[StateToolTip]] = {}
+
+
+def _forget_tip(window: QWidget, tip: StateToolTip):
+    tips = _shown_tips.get(window, [])
+    if tip in tips:
+        tips.remove(tip)
+
+
+def show_progress_tip(title: str, parent: QWidget, on_close: Callable[[], None] = None) -> StateToolTip:
+    """在窗口右上角显示不阻塞操作的进度提示，用户点关闭时调用 on_close"""
+    window = parent.window()
+    tip = StateToolTip(title, "等待中……", window)
+    if on_close is not None:
+        tip.closedSignal.connect(on_close)
+    tip.closedSignal.connect(lambda: _forget_tip(window, tip))
+    tips = _shown_tips.setdefault(window, [])
+    tip.move(tip.getSuitablePos() + QPoint(0, len(tips) * (tip.height() + 8)))
+    tips.append(tip)
+    tip.show()
+    return tip
+
 
+def finish_progress_tip(tip: StateToolTip, msg: str):
+    _forget_tip(tip.window(), tip)
+    tip.setContent(msg)
+    # 显示完成状态后自己淡出
+    tip.setState(True)
 
-def run_some_task(msg: str, parent: QWidget, func: Callable, *args, **kwargs):
-    worker = TaskWorker(parent, func, *args, **kwargs)
-    bda = BlockingDialog(msg, parent)
-    worker.finished.connect(bda.close)
 
-    worker.start()
-    # 堵塞，防止误触
-    bda.exec()
+def show_task_progress(handle: TaskHandle, parent: QWidget) -> StateToolTip:
+    """显示任务的进度，关闭提示即取消任务"""
+    tip = show_progress_tip(handle.name, parent, handle.cancel)
+    handle.progressed.connect(
+        lambda done, total, item: tip.setContent(f"{done}/{total} {item}".rstrip()))
+    handle.finished.connect(lambda _: finish_progress_tip(tip, "已完成"))
+    handle.failed.connect(lambda msg: finish_progress_tip(tip, f"失败：{msg}"))
+    handle.cancelled.connect(lambda: finish_progress_tip(tip, "已取消"))
+    return tip
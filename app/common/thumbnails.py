@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage, QImageReader
+from app.common.config import THUMBNAIL_DIR, AVATAR_DIR
+
+# 缩略图目录最多占用多少字节，超过后按最后使用时间删到 THUMBNAIL_TRIM_RATIO 以下
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+THUMBNAIL_TRIM_RATIO = 0.8
+# 渲染好的圆形头像，每个只有几 KB
+AVATAR_CACHE_BYTES = 16 * 1024 * 1024
+
+
+def _reader(path: str, size: int) -> tuple[QImageReader, bool]:
+    """比 size 大的图片在解码时就缩小，不会先解码出整张大图，返回的布尔值表示是否缩小了"""
+    reader = QImageReader(path)
+    full = reader.size()
+    if full.isValid() and max(full.width(), full.height()) > size:
+        reader.setScaledSize(full.scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio))
+        return reader, True
+    return reader, False
+
+
+class ThumbnailCache(object):
+    """
+    缩小后的图标保存在磁盘上，下次启动直接读取小图。
+    以源文件路径、修改时间、文件大小和缩略图尺寸作为 key，源文件变了自然就不会命中；
+    也可以用 get/put 按自己算的名称存取。可以在多个线程中同时使用
+    """
+
+    def __init__(self, directory: str | Path, max_bytes: int = THUMBNAIL_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total: int | None = None  # 第一次写入时才统计目录大小
+
+    @staticmethod
+    def _thumb_name(path: str, size: int) -> str | None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{size}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def get(self, name: str) -> QImage:
+        """按名称读取保存过的图片，没有则返回空的 QImage"""
+        thumb = Path(self.directory, f"{name}.png")
+        image = QImage(str(thumb))
+        if not image.isNull():
+            try:
+                # 用修改时间记录最后使用的时间，淘汰时先删最久没用的
+                os.utime(thumb)
+            except OSError:
+                pass
+        return image
+
+    def put(self, name: str, image: QImage):
+        self._store(Path(self.directory, f"{name}.png"), image)
+
+    def image(self, path: str, size: int) -> QImage:
+        """
+        取缩略图，没有就从源文件生成并保存。Qt 资源文件（:/ 开头）不缓存。
+        读取失败返回空的 QImage
+        """
+        if path.startswith(":"):
+            return _reader(path, size)[0].read()
+        name = self._thumb_name(path, size)
+        if name is None:
+            return QImage()
+
+        image = self.get(name)
+        if not image.isNull():
+            return image
+
+        reader, scaled = _reader(path, size)
+        image = reader.read()
+        # 本来就够小的不另存一份
+        if scaled and not image.isNull():
+            self.put(name, image)
+        return image
+
+    def _store(self, thumb: Path, image: QImage):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再替换，多个线程写同一个缩略图也不会读到一半的文件
+        tmp = thumb.with_name(f"{thumb.stem}.{threading.get_ident()}.tmp")
+        if not image.save(str(tmp), "PNG"):
+            tmp.unlink(missing_ok=True)
+            return
+        nbytes = tmp.stat().st_size
+        os.replace(tmp, thumb)
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan()
+            else:
+                self._total += nbytes
+            if self._total > self.max_bytes:
+                self._trim()
+
+    def _entries(self) -> list[os.DirEntry]:
+        try:
+            return [e for e in os.scandir(self.directory) if e.name.endswith(".png")]
+        except OSError:
+            return []
+
+    def _scan(self) -> int:
+        return sum(e.stat().st_size for e in self._entries())
+
+    def _trim(self):
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        target = self.max_bytes * THUMBNAIL_TRIM_RATIO
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.unlink(entry.path)
+                total -= size
+            except OSError:
+                pass
+        self._total = total
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries():
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+            self._total = 0
+
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_DIR)
+avatar_cache = ThumbnailCache(AVATAR_DIR, AVATAR_CACHE_BYTES)
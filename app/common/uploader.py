@@ -0,0 +1,146 @@
+import gzip
+import json
+import random
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+
+# 每个请求序列化后（压缩前）最多多少字节、多少条
+MAX_BATCH_BYTES = 256 * 1024
+MAX_BATCH_ITEMS = 1000
+# 同时进行的请求数
+MAX_WORKERS = 3
+# 每批最多尝试几次，重试间隔按指数增长并随机抖动
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# 这些状态码说明服务器暂时不可用，可以重试
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UploadCancelled(Exception):
+    pass
+
+
+def split_batches(items: list[dict], max_bytes: int = MAX_BATCH_BYTES,
+                  max_items: int = MAX_BATCH_ITEMS) -> list[list[dict]]:
+    """按序列化后的大小和条数切分，单条超过 max_bytes 的单独成批"""
+    batches = []
+    batch = []
+    size = 2  # []
+    for item in items:
+        n = len(json.dumps(item, ensure_ascii=False).encode("utf-8")) + 1  # 加上逗号
+        if len(batch) != 0 and (size + n > max_bytes or len(batch) >= max_items):
+            batches.append(batch)
+            batch = []
+            size = 2
+        batch.append(item)
+        size += n
+    if len(batch) != 0:
+        batches.append(batch)
+    return batches
+
+
+def _retry_after(response: requests.Response) -> float:
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        # 也可能是 HTTP 日期，不解析了，按退避时间来
+        return 0.0
+
+
+class BatchUploader(object):
+    """
+    把大量数据拆成多批上传，每批 gzip 压缩，限制并发数，
+    连接失败、超时或者服务器暂时不可用时按指数退避重试
+    """
+
+    def __init__(
+            self,
+            url: str,
+            timeout: tuple[float, float],
+            compress: bool = True,
+            max_workers: int = MAX_WORKERS,
+            max_attempts: int = MAX_ATTEMPTS,
+            backoff_base: float = BACKOFF_BASE,
+            max_bytes: int = MAX_BATCH_BYTES,
+            max_items: int = MAX_BATCH_ITEMS,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.compress = compress
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self._local = threading.local()
+        self._stop = threading.Event()
+
+    def _session(self) -> requests.Session:
+        # Session 不保证线程安全，每个线程用自己的
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _post(self, batch: list[dict], compress: bool = None) -> requests.Response:
+        body = json.dumps(batch, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if compress is None:
+            compress = self.compress
+        if compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        response = self._session().post(self.url, data=body, headers=headers, timeout=self.timeout)
+        if compress and response.status_code == 415:
+            # 服务器不接受压缩的请求体，只有这一次改为不压缩重发，不影响其他线程和之后的请求
+            return self._post(batch, compress=False)
+        if response.status_code in RETRY_STATUS:
+            raise RetryableError(f"HTTP {response.status_code}", _retry_after(response))
+        return response
+
+    def _send(self, batch: list[dict]) -> requests.Response:
+        for attempt in range(self.max_attempts):
+            if self._stop.is_set():
+                raise UploadCancelled("Upload cancelled")
+            try:
+                return self._post(batch)
+            except (requests.ConnectionError, requests.Timeout, RetryableError) as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                # 全抖动，避免多个请求同时重试
+                delay = random.uniform(0, min(BACKOFF_MAX, self.backoff_base * 2 ** attempt))
+                if isinstance(e, RetryableError):
+                    delay = max(delay, e.retry_after)
+                if self._stop.wait(delay):
+                    raise UploadCancelled("Upload cancelled")
+        raise UploadCancelled("No attempt made")
+
+    def upload(self, items: list[dict]) -> Iterator[tuple[list[dict], requests.Response | None, Exception | None]]:
+        """
+        逐批上传，每完成一批就产出一次，顺序与完成顺序一致
+
+        :return: (这一批的数据, 响应, 异常)，成功时异常为 None，失败时响应为 None
+        """
+        self._stop.clear()
+        batches = split_batches(items, self.max_bytes, self.max_items)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="uploader") as pool:
+            futures = {pool.submit(self._send, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+
+    def stop(self):
+        """取消还没完成的批次，可以在其他线程调用"""
+        self._stop.set()
@@ -1,6 +1,6 @@
 from typing import Callable
 
-from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QPoint, QSortFilterProxyModel
+from PySide6.QtCore import Qt, QModelIndex, QPoint
 from PySide6.QtGui import QFont
 from PySide6.QtWidgets import QTreeView, QWidget
 from qfluentwidgets import TreeView, RoundMenu, Action, SmoothMode
@@ -9,29 +9,29 @@ from qfluentwidgets import FluentIcon as Fi
 from app.common.utils import  accept_warning, show_quick_tip, get_icon_path
 from app.chromy.chromi import Bookmark, Profile, sort_profiles_id_func, ProfileSortFilterProxyModel
 from app.components.profiles_dialog import ShowProfilesDialog, ShowProfilesModel
-from app.common.thread import run_some_task
+from app.components.diff_model import DiffTableModel, SourceSortProxyModel, SORT_KEY_ROLE, collation_key, collation_keys
+from app.common.thread import get_task_scheduler, show_task_progress, TaskPriority
 from app.common.config import cfg
 
 
-class BookmarksModel(QAbstractTableModel):
+class BookmarksModel(DiffTableModel):
 
     def __init__(self, bookmarks: dict[str, Bookmark], parent=None):
-        super().__init__(parent)
+        super().__init__(bookmarks.keys(), parent)
         self.bookmarks = bookmarks
-        self.bookmark_urls = list(self.bookmarks.keys())
 
         self.headers = ["名称", "URL"]
 
-    def rowCount(self, parent: QModelIndex = ...):
-        return len(self.bookmark_urls)
-
     def columnCount(self, parent: QModelIndex = ...):
         return len(self.headers)
 
     def data(self, index: QModelIndex, role: int = ...):
         row = index.row()
         col = index.column()
-        bmk = self.bookmarks[self.bookmark_urls[row]]
+        bmk = self.bookmarks.get(self.keys[row])
+        if bmk is None:
+            # 已经删除，还没来得及移除这一行
+            return None
         if role == Qt.ItemDataRole.DisplayRole:
             if col == 0:
                 return bmk.name
@@ -39,6 +39,8 @@ class BookmarksModel(QAbstractTableModel):
                 return bmk.url
         elif role == Qt.ItemDataRole.UserRole:
             return bmk.url
+        elif role == SORT_KEY_ROLE:
+            return self.cached_sort_key(bmk.url, col)
         return None
 
     def headerData(self, section: int, orientation: Qt.Orientation, role: int = ...):
@@ -51,14 +53,20 @@ class BookmarksModel(QAbstractTableModel):
                 return font
         return None
 
-    def update_data(self, bookmarks: dict[str, Bookmark]):
-        self.beginResetModel()
-        # 避免报错
-        self.bookmarks.clear()
-        self.bookmarks.update(bookmarks)
-        self.bookmark_urls = list(self.bookmarks.keys())
+    def sort_key(self, url: str, column: int):
+        bmk = self.bookmarks.get(url)
+        if bmk is None:
+            return ""
+        return collation_key(bmk.name if column == 0 else bmk.url)
 
-        self.endResetModel()
+    def sort_keys(self, urls: list[str], column: int):
+        bookmarks = map(self.bookmarks.get, urls)
+        return collation_keys("" if bmk is None else bmk.name if column == 0 else bmk.url for bmk in bookmarks)
+
+    def update_data(self, bookmarks: dict[str, Bookmark]):
+        old = self.bookmarks
+        self.bookmarks = bookmarks
+        self.apply_diff(bookmarks.keys(), self.changed_keys(old, bookmarks, lambda b: (b.name,)))
 
 
 class BookmarksTable(TreeView):
@@ -70,7 +78,8 @@ class BookmarksTable(TreeView):
             profiles: dict[str, Profile] = None,
             userdata_dir: str = "",
             exec_path: str = "",
-            delete_func: Callable[[list[str], list[str]], None] = None,
+            delete_func: Callable[..., list[tuple[str, str]]] = None,
+            apply_deletion_func: Callable[[list[tuple[str, str]]], None] = None,
             parent: QWidget = None
     ):
         super().__init__(parent)
@@ -80,6 +89,7 @@ class BookmarksTable(TreeView):
         self.userdata_dir = userdata_dir
         self.exec_path = exec_path
         self.delete_func = delete_func
+        self.apply_deletion_func = apply_deletion_func
 
         self.menu_ctx = RoundMenu(parent=self)
         self.act_check = Action(icon=Fi.SEARCH, text="查看用户", parent=self)
@@ -94,7 +104,7 @@ class BookmarksTable(TreeView):
         self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
 
         self.bookmarks_model = BookmarksModel(self.bookmarks, self)
-        proxy_model = QSortFilterProxyModel(self)
+        proxy_model = SourceSortProxyModel(self)
         proxy_model.setSourceModel(self.bookmarks_model)
 
         self.setModel(proxy_model)
@@ -124,9 +134,22 @@ class BookmarksTable(TreeView):
                           f"你确定要删除这 {len(urls)} 个书签吗？"):
             return
 
-        run_some_task("正在删除，请稍等……", self,
-                      self.delete_func, urls, profile_ids)
-        self.update_after_deletion()
+        # 删除在后台进行，期间可以继续浏览，但不能再删除
+        self.act_delete.setEnabled(False)
+        # 先取出来，切换浏览器后 self.delete_func 会变
+        delete_func, apply_func = self.delete_func, self.apply_deletion_func
+        removed: list[tuple[str, str]] = []
+        handle = get_task_scheduler().submit(f"正在删除 {len(urls)} 个书签",
+                                             lambda ctx: delete_func(urls, profile_ids, progress=ctx.progress, removed=removed),
+                                             priority=TaskPriority.HIGH, key=self.userdata_dir)
+        # 子线程只改文件，内存中的数据在这里更新，中途取消时已经删掉的也要更新
+        handle.ended.connect(lambda: apply_func(removed))
+        handle.ended.connect(lambda: self.on_deletion_ended(removed))
+        show_task_progress(handle, self)
+
+    def on_deletion_ended(self, removed: list[tuple[str, str]]):
+        self.act_delete.setEnabled(True)
+        self.update_after_deletion(removed)
 
     def on_act_check_triggered(self):
         if len(self.selectedIndexes()) == 0:
@@ -155,15 +178,16 @@ class BookmarksTable(TreeView):
 
         ds = ShowProfilesDialog(
             bmk.name, get_icon_path("bookmark"), bmk.url,
-            self.userdata_dir, self.exec_path, self.delete_func, self
+            self.userdata_dir, self.exec_path, self.delete_func, self.apply_deletion_func, self
         )
         ds.trv_p.setModel(proxy_model)
 
         ds.deletion_finished.connect(self.update_after_deletion)
         ds.exec()
 
-    def update_after_deletion(self):
-        self.bookmarks_model.update_data(self.bookmarks)
+    def update_after_deletion(self, removed: list[tuple[str, str]]):
+        """:param removed: 已经删除的 [(网址, 用户 ID)]，只移除从所有用户中都删掉了的书签的行"""
+        self.bookmarks_model.remove_keys([url for url, _ in removed if url not in self.bookmarks])
 
     def update_model(
             self,
@@ -171,13 +195,15 @@ class BookmarksTable(TreeView):
             profiles: dict[str, Profile],
             userdata_dir: str,
             exec_path: str,
-            delete_func: Callable[[list[str], list[str]], None],
+            delete_func: Callable[..., list[tuple[str, str]]],
+            apply_deletion_func: Callable[[list[tuple[str, str]]], None],
     ):
         self.bookmarks = bookmarks
         self.profiles = profiles
         self.userdata_dir = userdata_dir
         self.exec_path = exec_path
         self.delete_func = delete_func
+        self.apply_deletion_func = apply_deletion_func
         self.bookmarks_model.update_data(bookmarks)
 
         self.setColumnWidth(0, 300)
@@ -15,6 +15,7 @@ from qfluentwidgets import FluentIcon as Fi
 from app.common.utils import get_icon_path, SUPPORTED_BROWSERS, accept_warning
 from app.chromy import get_browser_exec_path, get_browser_data_path
 from app.database.db_operations import DBManger
+from app.common.thread import watch_future
 
 
 class TTButtonWithItem(TransparentToolButton):
@@ -344,19 +345,26 @@ class ConfigInterface(QWidget):
         self.userdata_changed.emit(True)
 
     def reset_cards(self, is_init: bool = False):
-        # 清空卡片
+        # 如果是打开软件，就不重置，因为还会想保留上次的路径
+        if not is_init:
+            self.dbm.reset()
+        # 读操作排在重置之后，读出来之后再填充
+        watch_future(self.dbm.select_all_async(), self,
+                     lambda userdata_info: self.fill_cards(userdata_info, is_init))
+
+    def fill_cards(self, userdata_info: list[list[str]], is_init: bool = False):
+        # 清空卡片，放在这里是为了连续点重置时不会重复添加
         while len(self.card_list.cards) > 0:
             card = self.card_list.cards[-1]
             # 这里可能每移除一次就会触发一次信号，但是因为总量不会大，就这样吧
             self.card_list.remove_card(card)
 
-        # 如果是打开软件，就不重置，因为还会想保留上次的路径
-        if not is_init:
-            self.dbm.reset()
         # 填充数据
-        self.userdata_info = self.dbm.select_all()
+        self.userdata_info = userdata_info
         # 填充卡片
         for name, type_, exec_path, data_path in self.userdata_info:
             self.card_list.add_card(name, type_, exec_path, data_path)
 
-        self.userdata_changed.emit(True)
+        # 打开软件时主窗口自己会读取
+        if not is_init:
+            self.userdata_changed.emit(True)
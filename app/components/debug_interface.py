@@ -1,47 +1,129 @@
 # coding: utf8
+import queue
+from collections import deque
 from logging import (
     Logger, Handler, LogRecord,
     Formatter,
 )
-from qfluentwidgets import TextEdit
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from PySide6.QtCore import QTimer, Signal
+from qfluentwidgets import PlainTextEdit, RoundMenu, Action
+from qfluentwidgets import FluentIcon as Fi
+
+from app.common.config import cfg, LOG_FILE
 
 DEBUG_OUTPUT_CACHE = []
 
+# 输出页最多保留多少行，超过的从最早的开始丢弃
+LOG_VIEW_MAX_LINES = 5000
+# 多久把缓冲中的日志刷新到输出页一次，一秒最多刷新十次
+LOG_FLUSH_MS = 100
+# 日志文件写满后轮换，保留几个旧文件
+LOG_FILE_MAX_BYTES = 2 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
 
-class TextEditHandler(Handler):
+class BufferedLogHandler(Handler):
+    """
+    只把格式化好的日志放进有上限的缓冲，不碰任何控件，在哪个线程调用都可以。
+    由 GUI 线程定时取走，缓冲满了就丢弃最早的
+    """
 
-    def __init__(self, txe_wg: TextEdit, level: int | str = 0):
+    def __init__(self, max_lines: int = LOG_VIEW_MAX_LINES, level: int | str = 0):
         super().__init__(level=level)
-        self.txe_wg = txe_wg
+        # deque 的 append 和 popleft 本身是线程安全的
+        self.lines: deque[str] = deque(maxlen=max_lines)
 
     def emit(self, record: LogRecord):
-        msg = self.format(record)
-        self.txe_wg.append(msg)
-        self.txe_wg.moveCursor(self.txe_wg.textCursor().MoveOperation.End)
+        self.lines.append(self.format(record))
 
+    def take(self) -> list[str]:
+        lines = []
+        while True:
+            try:
+                lines.append(self.lines.popleft())
+            except IndexError:
+                return lines
 
-class DebugInterface(TextEdit):
+
+class DebugInterface(PlainTextEdit):
+    # 右键菜单中点了 SQL 语句统计，由主窗口让数据库把统计输出到日志
+    stats_requested = Signal()
 
     def __init__(self, name: str, logger: Logger, parent=None):
         super().__init__(parent)
         self.setObjectName(name.replace(" ", "-"))
         self.setReadOnly(True)
+        # 超过的行 Qt 会从头删掉，不用自己维护
+        self.setMaximumBlockCount(LOG_VIEW_MAX_LINES)
         self.logger = logger
         self.formatter = Formatter("%(asctime)s - %(levelname)s - %(message)s")
 
         self.load_previous_output()
 
-        self.txe_handler = TextEditHandler(self, self.logger.level)
-        self.txe_handler.setFormatter(self.formatter)
-        self.logger.addHandler(self.txe_handler)
+        self.buffer_handler = BufferedLogHandler(LOG_VIEW_MAX_LINES, self.logger.level)
+        self.buffer_handler.setFormatter(self.formatter)
+        handlers: list[Handler] = [self.buffer_handler]
+        if cfg.get(cfg.log_to_file):
+            Path(LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
+            file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_MAX_BYTES,
+                                               backupCount=LOG_FILE_BACKUPS, encoding="utf-8")
+            file_handler.setFormatter(self.formatter)
+            handlers.append(file_handler)
+
+        # 记录日志的线程只把记录放进队列，格式化和写文件都在监听线程中进行
+        self.log_queue = queue.SimpleQueue()
+        self.queue_handler = QueueHandler(self.log_queue)
+        self.queue_handler.setLevel(self.logger.level)
+        self.listener = QueueListener(self.log_queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        self.logger.addHandler(self.queue_handler)
 
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setInterval(LOG_FLUSH_MS)
+        self.flush_timer.timeout.connect(self.flush_logs)
+        self.flush_timer.start()
+
+        self.menu_ctx = RoundMenu(parent=self)
+        self.act_copy = Action(icon=Fi.COPY, text="复制", parent=self)
+        self.act_stats = Action(icon=Fi.SPEED_HIGH, text="SQL 语句统计", parent=self)
+        self.menu_ctx.addAction(self.act_copy)
+        self.menu_ctx.addAction(self.act_stats)
+        self.act_copy.triggered.connect(self.copy)
+        self.act_stats.triggered.connect(self.stats_requested)
 
     def load_previous_output(self):
-        """将之前缓存的输出加载到 TextEdit 中"""
+        """将之前缓存的输出加载到输出页中"""
         for text in DEBUG_OUTPUT_CACHE:
-            self.append(text)
+            self.appendPlainText(text)
         self.moveCursor(self.textCursor().MoveOperation.End)
 
+    def flush_logs(self):
+        lines = self.buffer_handler.take()
+        if len(lines) == 0:
+            return
+        bar = self.verticalScrollBar()
+        at_bottom = bar.value() == bar.maximum()
+        # 一批只追加一次
+        self.appendPlainText("\n".join(lines))
+        if at_bottom:
+            # 在看之前的输出时不要跳走
+            self.moveCursor(self.textCursor().MoveOperation.End)
+
+    def stop_logging(self):
+        """退出前调用，把还在队列中的日志写完"""
+        self.logger.removeHandler(self.queue_handler)
+        self.listener.stop()
+        self.flush_timer.stop()
+        self.flush_logs()
+        for handler in self.listener.handlers:
+            handler.close()
+
+    def contextMenuEvent(self, event):
+        self.act_copy.setEnabled(self.textCursor().hasSelection())
+        self.menu_ctx.exec(event.globalPos())
+
     def showEvent(self, event):
         super().showEvent(event)
         self.moveCursor(self.textCursor().MoveOperation.End)
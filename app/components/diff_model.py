@@ -0,0 +1,272 @@
+import locale
+from bisect import bisect_left, insort
+from collections.abc import Callable, Hashable, Iterable, Mapping
+from typing import Any
+
+from PySide6.QtCore import Qt, QAbstractItemModel, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+
+# 各模型的 data 对这个角色返回预先算好的排序键
+SORT_KEY_ROLE = Qt.ItemDataRole.UserRole + 1
+
+
+def collation_key(text: str) -> str:
+    """不区分大小写，按系统区域设置的规则排序的键"""
+    return locale.strxfrm(text.casefold())
+
+
+def collation_keys(texts: Iterable[str]) -> list[str]:
+    """collation_key 的批量版本，整列一次算完。C 区域设置下 strxfrm 不改变文本，直接跳过"""
+    folded = map(str.casefold, texts)
+    if locale.setlocale(locale.LC_COLLATE) in ("C", "POSIX"):
+        return list(folded)
+    return list(map(locale.strxfrm, folded))
+
+
+def row_runs(rows: Iterable[int]) -> list[tuple[int, int]]:
+    """把行号合并成连续的区间 [(start, end)]，从小到大，包含 end"""
+    runs = []
+    for row in sorted(set(rows)):
+        if len(runs) != 0 and runs[-1][1] == row - 1:
+            runs[-1] = (runs[-1][0], row)
+        else:
+            runs.append((row, row))
+    return runs
+
+
+class DiffTableModel(QAbstractTableModel):
+    """
+    每行对应一个 key 的表格模型。更新时比较新旧 key，
+    只对删除、新增和内容变化的行发出通知，不重置模型，选中和滚动位置都能保留。
+
+    排序也由模型自己完成：每列的排序键只算一次，按列缓存升序的 key 列表，
+    切换升降序只是反转，数据更新时只把变化的 key 插入到对应位置
+    """
+
+    def __init__(self, keys: Iterable[Hashable] = (), parent=None):
+        super().__init__(parent)
+        self.keys: list[Hashable] = list(keys)
+        self._rows: dict[Hashable, int] | None = None
+        # 列号 -> {key: 排序键}
+        self._sort_keys: dict[int, dict[Hashable, Any]] = {}
+        # 列号 -> 按该列升序排好的 key
+        self._orders: dict[int, list[Hashable]] = {}
+        self._sort: tuple[int, Qt.SortOrder] | None = None
+
+    @property
+    def rows(self) -> dict[Hashable, int]:
+        """key -> 行号，排序后用到时才重新建立"""
+        if self._rows is None:
+            self._rows = dict(zip(self.keys, range(len(self.keys))))
+        return self._rows
+
+    def rowCount(self, parent: QModelIndex = ...):
+        return len(self.keys)
+
+    def drop_cache(self, keys: Iterable[Hashable] | None):
+        """子类重写，清除这些 key 的缓存，None 表示全部"""
+        pass
+
+    def sort_key(self, key: Hashable, column: int) -> Any:
+        """子类重写，同一列的排序键类型要一致"""
+        return 0
+
+    def sort_keys(self, keys: list[Hashable], column: int) -> list[Any]:
+        """子类可以重写，第一次按某列排序时整列一次算出排序键，比逐个调用 sort_key 快"""
+        return [self.sort_key(key, column) for key in keys]
+
+    def rows_reordered(self):
+        """子类重写，行的顺序变了，按行号保存的数据需要作废"""
+        pass
+
+    def cached_sort_key(self, key: Hashable, column: int) -> Any:
+        cache = self._sort_keys.setdefault(column, {})
+        if key not in cache:
+            cache[key] = self.sort_key(key, column)
+        return cache[key]
+
+    def changed_keys(self, old: Mapping, new: Mapping, signature: Callable[[Any], tuple]) -> list[Hashable]:
+        """新旧数据中都有、但显示的内容不同的 key；同一个字典原地修改过的无法比较，视为没有变化"""
+        if old is new:
+            return []
+        return [key for key in self.keys
+                if key in old and key in new and signature(old[key]) != signature(new[key])]
+
+    def _reindex(self, start: int):
+        rows = self.rows
+        for row in range(start, len(self.keys)):
+            rows[self.keys[row]] = row
+
+    def _update_sort_cache(self, removed: Iterable[Hashable], added: list[Hashable], columns: Iterable[int] = None):
+        """removed 从缓存的顺序中去掉，added 重新计算排序键后插入，对应的数据要已经是新的"""
+        stale = set(removed).union(added)
+        if len(stale) == 0:
+            return
+        for column in list(self._sort_keys if columns is None else columns):
+            cache = self._sort_keys.get(column)
+            if cache is None:
+                continue
+            for key in stale:
+                cache.pop(key, None)
+            order = self._orders.get(column)
+            if order is None:
+                continue
+            if len(stale) > len(order) // 8:
+                # 变化太多，不如下次排序时整体重排
+                del self._orders[column]
+                continue
+            order = [key for key in order if key not in stale]
+            for key in added:
+                cache[key] = self.sort_key(key, column)
+                insort(order, key, key=cache.__getitem__)
+            self._orders[column] = order
+
+    def reset_keys(self, keys: Iterable[Hashable]):
+        self.beginResetModel()
+        self.keys = list(keys)
+        self._rows = None
+        self._sort_keys.clear()
+        self._orders.clear()
+        self.drop_cache(None)
+        self.endResetModel()
+        if self._sort is not None:
+            self.sort(*self._sort)
+
+    def _remove_rows(self, removed: Iterable[int]):
+        # 从后往前删，前面的行号不受影响，只重建第一个被删除的行之后的行号
+        rows = self.rows
+        runs = row_runs(removed)
+        for start, end in reversed(runs):
+            self.beginRemoveRows(QModelIndex(), start, end)
+            for key in self.keys[start:end + 1]:
+                rows.pop(key)
+            del self.keys[start:end + 1]
+            self.endRemoveRows()
+        if len(runs) != 0:
+            self._reindex(runs[0][0])
+
+    def remove_keys(self, keys: Iterable[Hashable]):
+        """
+        只删除这些 key 的行，数据要在调用前就删掉。
+        不用比较新旧的全部 key，排序缓存中也是按缓存的排序键二分查找，剩下的行顺序不变，不用重新排序
+        """
+        rows = self.rows
+        keys = [key for key in set(keys) if key in rows]
+        if len(keys) == 0:
+            return
+        self.drop_cache(keys)
+        for column, order in self._orders.items():
+            cache = self._sort_keys[column]
+            for key in keys:
+                i = bisect_left(order, cache[key], key=cache.__getitem__)
+                # 排序键相同的可能有好几个
+                while order[i] != key:
+                    i += 1
+                del order[i]
+        for cache in self._sort_keys.values():
+            for key in keys:
+                cache.pop(key, None)
+        self._remove_rows([rows[key] for key in keys])
+
+    def drop_sort_keys(self, columns: Iterable[int]):
+        """这几列的数据整个换掉了，清除它们的排序缓存，正在按其中一列排序的话重新排序"""
+        columns = list(columns)
+        for column in columns:
+            self._sort_keys.pop(column, None)
+            self._orders.pop(column, None)
+        if self._sort is not None and self._sort[0] in columns:
+            self.sort(*self._sort)
+
+    def apply_diff(self, new_keys: Iterable[Hashable], changed: Iterable[Hashable] = ()):
+        """
+        把行更新为 new_keys。数据要在调用前就替换成新的，
+        被删除的行在通知前可能还会被读取，data() 遇到不存在的 key 应返回 None
+
+        :param new_keys: 新的 key，已有的保持原来的位置，新增的加在最后，正在排序的话再重新排序
+        :param changed: 内容有变化的 key
+        """
+        new_keys = list(new_keys)
+        new_set = set(new_keys)
+        rows = self.rows
+        removed = [rows[key] for key in rows.keys() - new_set]
+        inserted = [key for key in new_keys if key not in rows]
+        if len(self.keys) != 0 and len(removed) + len(inserted) > len(self.keys):
+            # 变化比原有的行还多，比如切换了浏览器，逐段通知反而更慢
+            self.reset_keys(new_keys)
+            return
+
+        changed = [key for key in changed if key in rows and key in new_set]
+        removed_keys = [self.keys[row] for row in removed]
+        self.drop_cache(removed_keys + changed)
+        self._update_sort_cache(removed_keys + changed, inserted + changed)
+
+        self._remove_rows(removed)
+
+        if len(inserted) != 0:
+            first = len(self.keys)
+            self.beginInsertRows(QModelIndex(), first, first + len(inserted) - 1)
+            self.keys.extend(inserted)
+            self._reindex(first)
+            self.endInsertRows()
+
+        self.emit_rows_changed(changed)
+        if self._sort is not None and len(inserted) + len(changed) != 0:
+            self.sort(*self._sort)
+
+    def emit_rows_changed(self, keys: Iterable[Hashable], columns: tuple[int, int] = None):
+        """
+        :param columns: (第一列, 最后一列)，默认为所有列
+        """
+        first_col, last_col = columns or (0, self.columnCount() - 1)
+        rows = [self.rows[key] for key in keys if key in self.rows]
+        for start, end in row_runs(rows):
+            self.dataChanged.emit(self.index(start, first_col), self.index(end, last_col))
+
+    def update_sort_keys(self, keys: Iterable[Hashable], columns: Iterable[int]):
+        """某几列的内容变了但行没有增删时调用，正在按这几列排序的话重新排序"""
+        keys = [key for key in keys if key in self.rows]
+        columns = list(columns)
+        self._update_sort_cache(keys, keys, columns)
+        if self._sort is not None and self._sort[0] in columns and len(keys) != 0:
+            self.sort(*self._sort)
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.SortOrder.AscendingOrder):
+        if column < 0 or column >= self.columnCount():
+            self._sort = None
+            return
+        self._sort = (column, order)
+        ascending = self._orders.get(column)
+        if ascending is None:
+            cache = self._sort_keys.setdefault(column, {})
+            # 显示时可能已经算过一部分
+            missing = self.keys if len(cache) == 0 else [key for key in self.keys if key not in cache]
+            if len(missing) != 0:
+                cache.update(zip(missing, self.sort_keys(missing, column)))
+            ascending = self._orders[column] = sorted(self.keys, key=cache.__getitem__)
+        new_keys = ascending if order == Qt.SortOrder.AscendingOrder else ascending[::-1]
+        if new_keys != self.keys:
+            self._relayout(new_keys)
+
+    def _relayout(self, new_keys: list[Hashable]):
+        hint = QAbstractItemModel.LayoutChangeHint.VerticalSortHint
+        self.layoutAboutToBeChanged.emit([], hint)
+        # 要在发出 layoutAboutToBeChanged 之后取，代理和视图会在收到信号时保存自己的索引
+        persistent = self.persistentIndexList()
+        old_keys = self.keys
+        self.keys = list(new_keys)
+        self._rows = None
+        if len(persistent) != 0:
+            self.changePersistentIndexList(
+                persistent, [self.index(self.rows[old_keys[index.row()]], index.column()) for index in persistent])
+        self.rows_reordered()
+        self.layoutChanged.emit([], hint)
+
+
+class SourceSortProxyModel(QSortFilterProxyModel):
+    """代理本身不排序，交给 DiffTableModel 按缓存的排序键排好，代理只负责筛选"""
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.SortOrder.AscendingOrder):
+        source = self.sourceModel()
+        if isinstance(source, DiffTableModel):
+            source.sort(column, order)
+        else:
+            super().sort(column, order)
@@ -1,18 +1,21 @@
-from typing import Callable
+from dataclasses import replace
+from typing import Callable, Iterable
 
-from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QPoint, QSize, QSortFilterProxyModel
-from PySide6.QtGui import QIcon
+from PySide6.QtCore import Qt, QModelIndex, QPoint, QSize
 from PySide6.QtWidgets import (
     QTreeView, QStyleOptionViewItem
 )
 from qfluentwidgets import TreeView, RoundMenu, Action, TreeItemDelegate
 from qfluentwidgets import FluentIcon as Fi
 
-from app.common.utils import accept_warning, get_icon_path, show_quick_tip
-from app.common.utils import path_not_exist, SafeMark, SAFE_MAP, SAFE_MAP_ICON
-from app.common.thread import run_some_task
+from app.common.utils import accept_warning, show_quick_tip
+from app.common.utils import SafeMark, SAFE_MAP, SAFE_MAP_ICON
+from app.common.icon_loader import icon_loader
+from app.common.ext_filter import ExtensionColumns, ExtensionFilter
+from app.common.thread import get_task_scheduler, show_task_progress, TaskPriority
 from app.components.profiles_dialog import ShowProfilesDialog, ShowProfilesModel
 from app.components.rawdata_dialog import RawDataDialog
+from app.components.diff_model import DiffTableModel, SourceSortProxyModel, SORT_KEY_ROLE, collation_key, collation_keys
 from app.chromy.chromi import (
     Extension, Profile,
     sort_profiles_id_func,
@@ -84,20 +87,20 @@ class ColumnIconDelegate(TreeItemDelegate):
         return size
 
 
-class ExtensionsModel(QAbstractTableModel):
+class ExtensionsModel(DiffTableModel):
 
     def __init__(self, extensions: dict[str, Extension],
                  ext_safe_marks: dict[str, SafeMark], parent=None):
-        super().__init__(parent)
+        super().__init__(extensions.keys(), parent)
         self.extensions = extensions
         self.ext_safe_marks = ext_safe_marks
-        self.extension_ids = list(self.extensions.keys())
         self.headers = ["名称", "安全性", "描述"]
 
-        self.extensions_icon_cache: dict[str, QIcon] = {}
-
-    def rowCount(self, parent: QModelIndex = ...):
-        return len(self.extension_ids)
+        # 正在加载的图标路径 -> 用到它的插件 ID，加载好后只通知这些行
+        self.waiting_icons: dict[str, set[str]] = {}
+        icon_loader.loaded.connect(self.on_icon_loaded)
+        # 筛选用的数据，数据更新后第一次筛选时才重新计算
+        self._columns: ExtensionColumns | None = None
 
     def columnCount(self, parent: QModelIndex = ...):
         return len(self.headers)
@@ -105,8 +108,11 @@ class ExtensionsModel(QAbstractTableModel):
     def data(self, index: QModelIndex, role: int = ...):
         row = index.row()
         col = index.column()
-        ext_id = self.extension_ids[row]
-        ext = self.extensions[ext_id]
+        ext_id = self.keys[row]
+        ext = self.extensions.get(ext_id)
+        if ext is None:
+            # 已经删除，还没来得及移除这一行
+            return None
         safe = self.ext_safe_marks[ext_id].safe if ext_id in self.ext_safe_marks else -2
         if role == Qt.ItemDataRole.DisplayRole:
             if col == 0:
@@ -117,20 +123,19 @@ class ExtensionsModel(QAbstractTableModel):
                 return ext.description
         elif role == Qt.ItemDataRole.DecorationRole:
             if col == 0:
-                if ext_id in self.extensions_icon_cache:
-                    return self.extensions_icon_cache[ext_id]
-                else:
-                    if path_not_exist(ext.icon):
-                        icon = QIcon(get_icon_path("none"))
-                    else:
-                        icon = QIcon(ext.icon)
-                    self.extensions_icon_cache[ext_id] = icon
-                    return icon
+                # 不在 GUI 线程读取文件，先显示占位图标
+                icon = icon_loader.get(ext.icon)
+                if icon is None:
+                    self.waiting_icons.setdefault(ext.icon, set()).add(ext_id)
+                    return icon_loader.placeholder
+                return icon
             if col == 1:
                 return SAFE_MAP_ICON[safe]
         elif role == Qt.ItemDataRole.UserRole:
             # 任意一列都返回 id 和安全标记
             return ext.id, safe
+        elif role == SORT_KEY_ROLE:
+            return self.cached_sort_key(ext_id, col)
         return None
 
     def headerData(self, section: int, orientation: Qt.Orientation, role: int = ...):
@@ -139,40 +144,108 @@ class ExtensionsModel(QAbstractTableModel):
                 return self.headers[section]
         return None
 
-    def update_data(self, extensions: dict[str, Extension], ext_safe_marks: dict[str, SafeMark]):
-        self.beginResetModel()
-        self.extensions.clear()
-        self.extensions.update(extensions)
-        self.extension_ids = list(self.extensions.keys())
-
-        self.ext_safe_marks.clear()
-        self.ext_safe_marks.update(ext_safe_marks)
-
-        self.extensions_icon_cache.clear()
+    def on_icon_loaded(self, path: str):
+        ext_ids = self.waiting_icons.pop(path, None)
+        if ext_ids is not None:
+            self.emit_rows_changed(ext_ids, (0, 0))
+
+    def sort_key(self, ext_id: str, column: int):
+        ext = self.extensions.get(ext_id)
+        if column == 1:
+            return self.ext_safe_marks[ext_id].safe if ext_id in self.ext_safe_marks else -2
+        if ext is None:
+            return ""
+        return collation_key(ext.name if column == 0 else ext.description)
+
+    def sort_keys(self, ext_ids: list[str], column: int):
+        if column == 1:
+            return super().sort_keys(ext_ids, column)
+        extensions = map(self.extensions.get, ext_ids)
+        return collation_keys("" if ext is None else ext.name if column == 0 else ext.description
+                              for ext in extensions)
+
+    def rows_reordered(self):
+        self._columns = None
+
+    def filter_columns(self) -> ExtensionColumns:
+        if self._columns is None or len(self._columns) != len(self.keys):
+            self._columns = ExtensionColumns(self.keys, self.extensions, self.ext_safe_marks)
+        return self._columns
 
-        self.endResetModel()
-
-    def update_safe_marks(self, ext_safe_marks: dict[str, SafeMark]):
-        self.beginResetModel()
-        self.ext_safe_marks.clear()
-        self.ext_safe_marks.update(ext_safe_marks)
-        self.endResetModel()
-
-
-class SafeFilterProxyModel(QSortFilterProxyModel):
+    def update_data(self, extensions: dict[str, Extension], ext_safe_marks: dict[str, SafeMark]):
+        """删除后原地修改过的字典或者刷新后新的字典都可以，只通知有变化的行"""
+        self._columns = None
+        old = self.extensions
+        self.extensions = extensions
+        changed = self.changed_keys(old, extensions, lambda e: (e.name, e.description, e.icon))
+        marks_replaced = ext_safe_marks is not self.ext_safe_marks
+        self.ext_safe_marks = ext_safe_marks
+        self.apply_diff(extensions.keys(), changed)
+        if marks_replaced:
+            # 安全性一列缓存的排序键是按旧的标记算的
+            self.drop_sort_keys((1,))
+            self.emit_rows_changed(self.keys, (1, 1))
+
+    def remove_deleted(self, ext_ids: Iterable[str]):
+        """删除后调用，字典已经原地修改过，只移除从所有用户中都删掉了的插件的行"""
+        self._columns = None
+        self.remove_keys([ext_id for ext_id in ext_ids if ext_id not in self.extensions])
+
+    def update_safe_marks(self, changed_marks: dict[str, SafeMark]):
+        """
+        只更新有变化的标记，安全性为 -2 的表示已被移除。
+        不重置模型，只通知安全性一列的对应行，选中和滚动位置都不受影响
+        """
+        for ext_id, mark in changed_marks.items():
+            if mark.safe == -2:
+                self.ext_safe_marks.pop(ext_id, None)
+            else:
+                self.ext_safe_marks[ext_id] = mark
+            if self._columns is not None and ext_id in self.rows:
+                self._columns.set_safe(self.rows[ext_id], mark.safe)
+        self.emit_rows_changed(changed_marks.keys(), (1, 1))
+        self.update_sort_keys(changed_marks.keys(), (1,))
+
+
+class SafeFilterProxyModel(SourceSortProxyModel):
+    """
+    按安全性、名称和描述中的关键词以及所在用户数筛选。
+    筛选条件变化时对预先算好的整列数据一次算出结果，filterAcceptsRow 只是查表
+    """
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.accepted_status = set()
+        self.ext_filter = ExtensionFilter(safe=frozenset())
+        self._mask = b""
+        self._mask_of: tuple | None = None
+
+    def set_filter(self, **kwargs):
+        """参数同 ExtensionFilter，只修改给出的条件"""
+        ext_filter = replace(self.ext_filter, **kwargs)
+        if ext_filter == self.ext_filter:
+            return
+        self.ext_filter = ext_filter
+        self.invalidateFilter()
 
     def set_accepted_status(self, status: list[int]):
-        self.accepted_status = set(status)
-        self.invalidateFilter()
+        self.set_filter(safe=frozenset(status))
+
+    def source_updated(self):
+        # 用户数变化不会通知到行，按用户数筛选时要整体重新筛选
+        if self.ext_filter.min_profiles > 1:
+            self.invalidateFilter()
+
+    def _current_mask(self) -> bytes:
+        cols = self.sourceModel().filter_columns()
+        mask_of = (cols, cols.version, self.ext_filter)
+        if self._mask_of != mask_of:
+            self._mask = self.ext_filter.mask(cols)
+            self._mask_of = mask_of
+        return self._mask
 
     def filterAcceptsRow(self, source_row: int, source_parent, /):
-        index = self.sourceModel().index(source_row, 1, source_parent)
-        safe: int = self.sourceModel().data(index, Qt.ItemDataRole.UserRole)[1]
-        return safe in self.accepted_status
+        mask = self._current_mask()
+        return source_row < len(mask) and mask[source_row] == 1
 
 
 class ExtensionsTable(TreeView):
@@ -184,7 +257,8 @@ class ExtensionsTable(TreeView):
             profiles: dict[str, Profile] = None,
             userdata_dir: str = "",
             exec_path: str = "",
-            delete_func: Callable[[list[str], list[str]], None] = None,
+            delete_func: Callable[..., list[tuple[str, str]]] = None,
+            apply_deletion_func: Callable[[list[tuple[str, str]]], None] = None,
             ext_safe_marks: dict[str, SafeMark] = None,
             parent=None
     ):
@@ -195,6 +269,7 @@ class ExtensionsTable(TreeView):
         self.userdata_dir = userdata_dir
         self.exec_path = exec_path
         self.delete_func = delete_func
+        self.apply_deletion_func = apply_deletion_func
         self.ext_safe_marks = ext_safe_marks or {}
 
         self.menu_ctx = RoundMenu(parent=self)
@@ -250,9 +325,22 @@ class ExtensionsTable(TreeView):
                           f"你确定要删除这 {len(ext_ids)} 个插件吗？"):
             return
 
-        run_some_task("正在删除，请稍等……", self,
-                      self.delete_func, ext_ids, profile_ids)
-        self.update_after_deletion()
+        # 删除在后台进行，期间可以继续浏览，但不能再删除
+        self.act_delete.setEnabled(False)
+        # 先取出来，切换浏览器后 self.delete_func 会变
+        delete_func, apply_func = self.delete_func, self.apply_deletion_func
+        removed: list[tuple[str, str]] = []
+        handle = get_task_scheduler().submit(f"正在删除 {len(ext_ids)} 个插件",
+                                             lambda ctx: delete_func(ext_ids, profile_ids, progress=ctx.progress, removed=removed),
+                                             priority=TaskPriority.HIGH, key=self.userdata_dir)
+        # 子线程只改文件，内存中的数据在这里更新，中途取消时已经删掉的也要更新
+        handle.ended.connect(lambda: apply_func(removed))
+        handle.ended.connect(lambda: self.on_deletion_ended(removed))
+        show_task_progress(handle, self)
+
+    def on_deletion_ended(self, removed: list[tuple[str, str]]):
+        self.act_delete.setEnabled(True)
+        self.update_after_deletion(removed)
 
     def on_act_show_data_triggered(self):
         extension_ids = [index.data(Qt.ItemDataRole.UserRole)[0]
@@ -293,15 +381,17 @@ class ExtensionsTable(TreeView):
 
         ds = ShowProfilesDialog(
             ext.name, ext.icon, ext.id,
-            self.userdata_dir, self.exec_path, self.delete_func, self
+            self.userdata_dir, self.exec_path, self.delete_func, self.apply_deletion_func, self
         )
         ds.trv_p.setModel(proxy_model)
 
         ds.deletion_finished.connect(self.update_after_deletion)
         ds.exec()
 
-    def update_after_deletion(self):
-        self.extensions_model.update_data(self.extensions, self.ext_safe_marks)
+    def update_after_deletion(self, removed: list[tuple[str, str]]):
+        """:param removed: 已经删除的 [(插件 ID, 用户 ID)]"""
+        self.extensions_model.remove_deleted({ext_id for ext_id, _ in removed})
+        self.filter_model.source_updated()
 
     def update_model(
             self,
@@ -309,7 +399,8 @@ class ExtensionsTable(TreeView):
             profiles: dict[str, Profile],
             userdata_dir: str,
             exec_path: str,
-            delete_func: Callable[[list[str], list[str]], None],
+            delete_func: Callable[..., list[tuple[str, str]]],
+            apply_deletion_func: Callable[[list[tuple[str, str]]], None],
             ext_safe_marks: dict[str, SafeMark],
     ):
         self.profiles = profiles
@@ -317,11 +408,13 @@ class ExtensionsTable(TreeView):
         self.userdata_dir = userdata_dir
         self.exec_path = exec_path
         self.delete_func = delete_func
+        self.apply_deletion_func = apply_deletion_func
         self.ext_safe_marks = ext_safe_marks
         self.extensions_model.update_data(extensions, ext_safe_marks)
+        self.filter_model.source_updated()
 
         self.setColumnWidth(0, 250)
 
-    def update_safe_marks(self, ext_safe_marks: dict[str, SafeMark]):
-        self.ext_safe_marks = ext_safe_marks
-        self.extensions_model.update_safe_marks(ext_safe_marks)
+    def update_safe_marks(self, changed_marks: dict[str, SafeMark]):
+        # self.ext_safe_marks 与主窗口的是同一个字典，已经合并过了
+        self.extensions_model.update_safe_marks(changed_marks)
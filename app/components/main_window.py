@@ -1,14 +1,13 @@
-import json
 from logging import Logger
 from PySide6.QtWidgets import (
     QApplication, QHBoxLayout, QWidget, QVBoxLayout
 )
 from PySide6.QtGui import QIcon
 from PySide6.QtCore import (
-    Qt, QModelIndex, QAbstractListModel, QSize, QThread, Signal,
+    Qt, QModelIndex, QAbstractListModel, QSize, QThread, QTimer, Signal,
 )
 from qfluentwidgets import (
-    MSFluentWindow, NavigationItemPosition, PillPushButton,
+    MSFluentWindow, NavigationItemPosition, PillPushButton, SearchLineEdit, CompactSpinBox,
     PushButton, ModelComboBox, setTheme, SplashScreen, SystemThemeListener,
 )
 from qfluentwidgets import FluentIcon as Fi
@@ -19,12 +18,19 @@ from app.components.config_interface import ConfigInterface
 from app.components.debug_interface import DebugInterface
 from app.components.settings_interface import SettingsInterface
 from app.chromy import ChromInstance, Extension
-from app.common.thread import run_some_task
+from app.common.thread import (
+    get_task_scheduler, watch_future, show_task_progress, show_progress_tip, finish_progress_tip,
+    TaskContext, TaskHandle,
+)
 from app.common.api_worker import ApiWorker
 from app.common.utils import get_icon_path, SAFE_MAP_ICON, SafeMark
-from app.common.config import cfg, SENT_CACHE_FILE
+from app.common.config import cfg, SAFE_MARKS_CACHE_FILE
+from app.common.safe_marks import SafeMarkCache
 from app.database.db_operations import DBManger
 
+# 搜索框停止输入多久后开始筛选
+FILTER_DEBOUNCE_MS = 250
+
 
 class UserDataListModel(QAbstractListModel):
 
@@ -94,6 +100,15 @@ class CHMSFluentWindow(MSFluentWindow):
             self.safe_switches.append(c)
             self.hly_switches.addWidget(c)
 
+        self.sle_ext_search = SearchLineEdit(self.switches_group)
+        self.sle_ext_search.setPlaceholderText("搜索名称或描述")
+        self.sle_ext_search.setMinimumWidth(180)
+        self.spb_min_profiles = CompactSpinBox(self.switches_group)
+        self.spb_min_profiles.setRange(0, 9999)
+        self.spb_min_profiles.setToolTip("至少在多少个用户中，0 为不限")
+        self.hly_switches.addWidget(self.sle_ext_search)
+        self.hly_switches.addWidget(self.spb_min_profiles)
+
         self.hly_top.addWidget(self.switches_group)
         self.switches_group.hide()  # 一开始先隐藏
         self.hly_top.setSpacing(4)
@@ -123,15 +138,20 @@ class MainWindow(CHMSFluentWindow):
     def __init__(self, title: str, width: int, height: int, logger: Logger):
         super().__init__()
         self.logger = logger
-        self.dbm = DBManger()
+        self.dbm = DBManger(logger)
         self.chrom_ins_map: dict[str, ChromInstance] = {}
-        self.ext_safe_marks: dict[str, SafeMark] = {}
-        self.sent_ext_cache: list[str] = self.get_sent_ext()  # 已经发送过的插件 ID
+        # 正在后台读取的浏览器
+        self.scanning: dict[str, TaskHandle] = {}
+        self.upload_tip = None
+        get_task_scheduler().logger = logger
+        # 先用上次保存的标记，联网获取到之后只更新有变化的
+        self.safe_mark_cache = SafeMarkCache(SAFE_MARKS_CACHE_FILE)
+        self.ext_safe_marks: dict[str, SafeMark] = self.safe_mark_cache.load()
 
         self.theme_listener = SystemThemeListener(self)
 
-        userdata_info = self.dbm.select_all()
-        self.userdata_model = UserDataListModel(userdata_info, self)
+        # 先放空的模型，读出来之后再填充并选中第一个
+        self.userdata_model = UserDataListModel([], self)
         self.cmbx_browsers.setModel(self.userdata_model)
 
         self.profile_interface = ProfilesTable(name='profile', parent=self)
@@ -139,6 +159,7 @@ class MainWindow(CHMSFluentWindow):
         self.bookmark_interface = BookmarksTable(name='bookmark', parent=self)
         self.config_interface = ConfigInterface(name="config", dbm=self.dbm, parent=self)
         self.debug_interface = DebugInterface(name="debug", logger=logger, parent=self)
+        self.debug_interface.stats_requested.connect(lambda: self.dbm.log_stats())
         self.settings_interface = SettingsInterface(name="settings", parent=self)
         self.extension_interface.setProperty("is_extension", True)
         self.config_interface.setProperty("is_bottom", True)
@@ -158,15 +179,21 @@ class MainWindow(CHMSFluentWindow):
 
         # === API Worker ===
         self.api_thread = QThread()
-        self.worker = ApiWorker()
+        self.worker = ApiWorker(self.safe_mark_cache.validators)
         self.worker.moveToThread(self.api_thread)
         self.worker.queryNecessaryFinished.connect(self.process_ext_safe_marks)
         self.worker.error.connect(self.handle_api_error)
+        self.worker.addBatchFinished.connect(self.on_add_batch_finished)
+        self.worker.addBatchFailed.connect(self.on_add_batch_failed)
+        self.worker.uploadProgress.connect(self.on_upload_progress)
         self.EXT_SAFE_MARK_PROCESS_FINISHED.connect(self.extension_interface.update_safe_marks)
         self.START_QUERY_EXT_SAFE_MARK.connect(self.worker.do_query_necessary)
         self.START_SENDING_EXT.connect(self.prepare_sending_ext)
         self.EXT_PREPARED_FINISHED.connect(self.worker.do_add_batch)
         self.api_thread.start()
+        # 已上传的插件 ID 读完之前扫描完的浏览器，读完后再挑出要上传的
+        self.waiting_for_sent_store: list[dict[str, Extension]] = []
+        watch_future(self.dbm.sent_store.loading, self, self.on_sent_store_loaded)
 
         # ===== prepare for splashscreen ======
         self.setWindowTitle(title)
@@ -179,8 +206,8 @@ class MainWindow(CHMSFluentWindow):
         self.show()
 
         # 如果电脑慢，可能会花点时间
-        if self.userdata_model.rowCount() > 0:
-            self.cmbx_browsers.setCurrentIndex(0)
+        watch_future(self.dbm.select_all_async(), self,
+                     lambda userdata_info: self.update_userdata_model(userdata_info, True))
 
         self.splash.finish()
         self.theme_listener.start()
@@ -192,13 +219,28 @@ class MainWindow(CHMSFluentWindow):
             c.toggled.connect(self.update_filter)
             c.setChecked(True)
 
+        # 输入停下来一会儿再筛选，不要每敲一个字就筛一遍
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(FILTER_DEBOUNCE_MS)
+        self.filter_timer.timeout.connect(self.update_text_filter)
+        # 不能直接连到 start，信号的参数会被当成间隔时间
+        self.sle_ext_search.textChanged.connect(lambda _: self.filter_timer.start())
+        self.spb_min_profiles.valueChanged.connect(lambda _: self.filter_timer.start())
+
     def closeEvent(self, event):
         self.theme_listener.terminate()
         self.theme_listener.deleteLater()
+        # 没传完的还在上传队列中，下次启动时继续
+        self.worker.stop()
         self.api_thread.quit()
         self.api_thread.wait()
-        # 保存发送的插件缓存
-        SENT_CACHE_FILE.write_text(json.dumps(self.sent_ext_cache, ensure_ascii=False, indent=4), encoding="utf-8")
+        # 删除只在两个用户之间停下，不会留下改了一半的文件
+        get_task_scheduler().shutdown()
+        # 开了日志文件时留下这次运行的语句统计
+        self.dbm.log_stats()
+        self.dbm.close()
+        self.debug_interface.stop_logging()
         super().closeEvent(event)
 
     def post_init_window(self, width: int, height: int):
@@ -213,20 +255,14 @@ class MainWindow(CHMSFluentWindow):
         w, h = desktop.width(), desktop.height()
         self.move(w // 2 - self.width() // 2, h // 2 - self.height() // 2)
 
-    @staticmethod
-    def get_sent_ext() -> list[str]:
-        try:
-            with open(SENT_CACHE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
-
-    def process_ext_safe_marks(self, raw_ext_safe_marks: list[dict]):
-        self.ext_safe_marks.clear()
-        for e in raw_ext_safe_marks:
-            self.ext_safe_marks[e["ID"]] = SafeMark(id=e["ID"], safe=e["SAFE"])
-        self.EXT_SAFE_MARK_PROCESS_FINISHED.emit(self.ext_safe_marks)
-        self.logger.info("[API GET] 插件安全标记已更新。")
+    def process_ext_safe_marks(self, raw_ext_safe_marks: list[dict], removed: list[str],
+                               is_full: bool, validators: dict[str, str]):
+        incoming = {e["ID"]: e["SAFE"] for e in raw_ext_safe_marks}
+        # 增量结果里只有变化和被删除的标记，其他的保持不变
+        changed = self.safe_mark_cache.apply(self.ext_safe_marks, incoming, removed, is_full, validators)
+        if len(changed) > 0:
+            self.EXT_SAFE_MARK_PROCESS_FINISHED.emit(changed)
+        self.logger.info(f"[API GET] 插件安全标记已更新，{len(changed)} 个有变化。")
 
     def prepare_sending_ext(self, ext: dict[str, Extension]):
         # 这里就把所有插件都发了，如果重复服务器就忽略了
@@ -239,6 +275,43 @@ class MainWindow(CHMSFluentWindow):
             })
         self.EXT_PREPARED_FINISHED.emit(raw_ext_data)
 
+    def on_sent_store_loaded(self, result: tuple[set[str], list[list[str]]]):
+        self.dbm.sent_store.apply_loaded(result)
+        self.resume_sending_ext()
+        waiting, self.waiting_for_sent_store = self.waiting_for_sent_store, []
+        for extensions in waiting:
+            self.send_unsent_extensions(extensions)
+
+    def resume_sending_ext(self):
+        unfinished = self.dbm.sent_store.unfinished
+        if len(unfinished) == 0:
+            return
+        self.dbm.sent_store.mark_pending([ext_id for ext_id, _ in unfinished])
+        self.EXT_PREPARED_FINISHED.emit([{"ID": ext_id, "NAME": name} for ext_id, name in unfinished])
+        self.logger.info(f"[API POST] 继续发送上次未完成的 {len(unfinished)} 个插件 ID")
+
+    def on_add_batch_finished(self, response: list, ext_ids: list[str]):
+        self.dbm.sent_store.confirm(ext_ids)
+        self.logger.info(f"[API POST] 服务器已收到 {len(ext_ids)} 个插件 ID")
+
+    def on_upload_progress(self, done: int, total: int):
+        if self.upload_tip is None:
+            # 关闭提示就放弃还没传完的，它们留在上传队列中，下次刷新或启动时再传
+            # worker 在上传线程中忙着，要直接调用 stop，不能排队
+            self.upload_tip = show_progress_tip("正在上传插件 ID", self, lambda: self.worker.stop())
+            self.upload_tip.closedSignal.connect(self.on_upload_tip_closed)
+        self.upload_tip.setContent(f"{done}/{total}")
+        if done >= total:
+            finish_progress_tip(self.upload_tip, "已完成")
+            self.upload_tip = None
+
+    def on_upload_tip_closed(self):
+        self.upload_tip = None
+
+    def on_add_batch_failed(self, ext_ids: list[str]):
+        # 下次刷新时重新发送
+        self.dbm.sent_store.release(ext_ids)
+
     def handle_api_error(self, error_message: str):
         """显示来自工作线程的错误消息"""
         self.logger.error(f"[API ERROR] {error_message}")
@@ -256,6 +329,7 @@ class MainWindow(CHMSFluentWindow):
             chrom_ins.userdata_dir,
             exec_path,
             chrom_ins.delete_extensions,
+            chrom_ins.apply_deleted_extensions,
             self.ext_safe_marks,
         )
         self.bookmark_interface.update_model(
@@ -264,16 +338,63 @@ class MainWindow(CHMSFluentWindow):
             chrom_ins.userdata_dir,
             exec_path,
             chrom_ins.delete_bookmarks,
+            chrom_ins.apply_deleted_bookmarks,
         )
 
-    def _update_chrom_ins_map(self, name: str, data_path: str):
-        # 这个函数不要涉及 UI 操作，避免在子线程运行时出问题
+    def _fetch_chrom_ins(self, ctx: TaskContext, name: str, data_path: str) -> ChromInstance:
+        # 这个函数不要涉及 UI 操作，它在子线程中运行
         chrom_ins = ChromInstance(data_path, self.logger)
         chrom_ins.fetch_all_profiles()
-        chrom_ins.fetch_extensions_from_all_profiles()
-        chrom_ins.fetch_bookmarks_from_all_profiles()
+        chrom_ins.fetch_extensions_from_all_profiles(
+            lambda done, total, item: ctx.progress(done, total, f"插件：{item}"))
+        chrom_ins.fetch_bookmarks_from_all_profiles(
+            lambda done, total, item: ctx.progress(done, total, f"书签：{item}"))
+        # 只把变化的部分写入清单，不等待写完
+        self.dbm.inventory.sync(name, chrom_ins)
+        return chrom_ins
+
+    def current_browser_index(self) -> QModelIndex:
+        return self.cmbx_browsers.model().createIndex(self.cmbx_browsers.currentIndex(), 1)
+
+    def scan_browser(self, name: str, type_: str, exec_path: str, data_path: str, force: bool):
+        old = self.scanning.get(name)
+        if old is not None:
+            if not force:
+                return  # 已经在读了，读完会显示
+            old.cancel()
+        # 同一个数据目录的读取和删除按顺序执行
+        handle = get_task_scheduler().submit(f"正在获取 {name} 的数据", self._fetch_chrom_ins,
+                                             name, data_path, key=data_path)
+        self.scanning[name] = handle
+        handle.finished.connect(lambda chrom_ins: self.on_chrom_ins_fetched(name, type_, exec_path, chrom_ins))
+        handle.ended.connect(lambda: self.scanning.pop(name) if self.scanning.get(name) is handle else None)
+        show_task_progress(handle, self)
+
+    def on_chrom_ins_fetched(self, name: str, type_: str, exec_path: str, chrom_ins: ChromInstance):
         self.chrom_ins_map[name] = chrom_ins
 
+        if self.dbm.sent_store.loaded:
+            self.send_unsent_extensions(chrom_ins.extensions)
+        else:
+            self.waiting_for_sent_store.append(chrom_ins.extensions)
+
+        # 读取期间可能已经切换到别的浏览器了
+        if self.current_browser_index().data(Qt.ItemDataRole.EditRole) == name:
+            self.update_all_data(chrom_ins, type_, exec_path)
+
+    def send_unsent_extensions(self, extensions: dict[str, Extension]):
+        # 排除已经发送过的和正在发送的插件，因为不知道联网获取的啥时候到，所以这里不排除服务器上有的
+        # 也没必要多这个麻烦，如果服务器上有，服务器自己就忽略了
+        not_sent_ids = self.dbm.sent_store.filter_unsent(extensions.keys())
+        ready_to_sent: dict[str, Extension] = {}
+        for id_ in not_sent_ids:
+            ready_to_sent[id_] = extensions[id_]
+        if len(ready_to_sent) > 0:
+            # 服务器确认收到后才算发送过
+            self.dbm.sent_store.enqueue([[e.id, e.name] for e in ready_to_sent.values()])
+            self.START_SENDING_EXT.emit(ready_to_sent)
+            self.logger.info(f"[API POST] 发送 {len(ready_to_sent)} 个插件 ID")
+
     def update_by_one_index(self, index: QModelIndex, force: bool):
         name = index.data(Qt.ItemDataRole.EditRole)
         type_, exec_path, data_path = index.data(Qt.ItemDataRole.UserRole)
@@ -285,34 +406,25 @@ class MainWindow(CHMSFluentWindow):
             self.IS_INIT = False
 
         if force or name not in self.chrom_ins_map:
-            run_some_task("正在获取浏览器数据……", self,
-                          self._update_chrom_ins_map, name=name, data_path=data_path)
-
-            # 排除已经发送过的插件，因为不知道联网获取的啥时候到，所以这里不排除服务器上有的
-            # 也没必要多这个麻烦，如果服务器上有，服务器自己就忽略了
-            all_ext_ids = set(self.chrom_ins_map[name].extensions.keys())
-            sent_ids = set(self.sent_ext_cache)
-            not_sent_ids = all_ext_ids - sent_ids
-            ready_to_sent: dict[str, Extension] = {}
-            for id_ in not_sent_ids:
-                ready_to_sent[id_] = self.chrom_ins_map[name].extensions[id_]
-            if len(ready_to_sent) > 0:
-                self.START_SENDING_EXT.emit(ready_to_sent)
-                self.sent_ext_cache.extend(ready_to_sent.keys())
-                self.logger.info(f"[API POST] 发送 {len(ready_to_sent)} 个插件 ID")
-
-        self.update_all_data(self.chrom_ins_map[name], type_, exec_path)
+            # 在后台读取，读完再更新表格，期间仍显示之前读到的数据
+            self.scan_browser(name, type_, exec_path, data_path, force)
+        if name in self.chrom_ins_map:
+            self.update_all_data(self.chrom_ins_map[name], type_, exec_path)
 
     def on_pbn_refresh_clicked(self):
-        index = self.cmbx_browsers.model().createIndex(self.cmbx_browsers.currentIndex(), 1)
-        self.update_by_one_index(index, force=True)
+        self.update_by_one_index(self.current_browser_index(), force=True)
 
     def on_cmbx_browsers_current_index_changed(self, index: int):
         index = self.cmbx_browsers.model().createIndex(index, 1)
         self.update_by_one_index(index, force=False)
 
     def on_config_userdata_changed(self, is_reset: bool):
-        self.userdata_model.update_model(self.dbm.select_all())
+        # 不在这里等数据库，读出来之后再更新
+        watch_future(self.dbm.select_all_async(), self,
+                     lambda userdata_info: self.update_userdata_model(userdata_info, is_reset))
+
+    def update_userdata_model(self, userdata_info: list[list[str]], is_reset: bool):
+        self.userdata_model.update_model(userdata_info)
         if is_reset and self.userdata_model.rowCount() > 0:
             self.cmbx_browsers.setCurrentIndex(0)
 
@@ -324,3 +436,9 @@ class MainWindow(CHMSFluentWindow):
                 accepted_status.append(c.property("mark"))
 
         self.extension_interface.filter_model.set_accepted_status(accepted_status)
+
+    def update_text_filter(self):
+        self.extension_interface.filter_model.set_filter(
+            text=self.sle_ext_search.text(),
+            min_profiles=self.spb_min_profiles.value(),
+        )
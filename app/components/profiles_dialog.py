@@ -13,7 +13,7 @@ from qfluentwidgets import (
 
 from app.common.utils import accept_warning, show_quick_tip
 from app.chromy.chromi import open_profiles
-from app.common.thread import run_some_task
+from app.common.thread import get_task_scheduler, show_task_progress, TaskPriority
 from app.common.config import cfg
 
 
@@ -62,7 +62,7 @@ class ProfileCard(QWidget):
 
 class ShowProfilesDialog(MessageBoxBase):
 
-    deletion_finished = Signal()
+    deletion_finished = Signal(list)  # 已经删除的 [(插件 ID 或网址, 用户 ID)]
 
     def __init__(
             self,
@@ -71,7 +71,8 @@ class ShowProfilesDialog(MessageBoxBase):
             id_: str,
             userdata_dir: str,
             exec_path: str,
-            delete_func: Callable[[list[str], list[str]], None],
+            delete_func: Callable[..., list[tuple[str, str]]],
+            apply_deletion_func: Callable[[list[tuple[str, str]]], None],
             parent: QWidget = None
     ):
         super().__init__(parent)
@@ -79,6 +80,7 @@ class ShowProfilesDialog(MessageBoxBase):
         self.userdata_dir = userdata_dir
         self.exec_path = exec_path
         self.delete_func = delete_func
+        self.apply_deletion_func = apply_deletion_func
         self.setClosableOnMaskClicked(True)
 
         self.cw = QWidget(self)
@@ -129,7 +131,14 @@ class ShowProfilesDialog(MessageBoxBase):
                           f"你确定删除这 {len(profile_ids_to_delete)} 个吗？"):
             return
 
-        run_some_task("正在删除，请稍等……", self,
-                      self.delete_func, [self.id_], profile_ids_to_delete)
-        self.deletion_finished.emit()
+        delete_func, apply_func, id_ = self.delete_func, self.apply_deletion_func, self.id_
+        removed: list[tuple[str, str]] = []
+        handle = get_task_scheduler().submit(
+            f"正在从 {len(profile_ids_to_delete)} 个用户中删除",
+            lambda ctx: delete_func([id_], profile_ids_to_delete, progress=ctx.progress, removed=removed),
+            priority=TaskPriority.HIGH, key=self.userdata_dir)
+        # 对话框先关掉，删完后在 GUI 线程中更新内存中的数据，再通知表格更新
+        handle.ended.connect(lambda: apply_func(removed))
+        handle.ended.connect(lambda: self.deletion_finished.emit(removed))
+        show_task_progress(handle, self.parentWidget())
         self.accept()
@@ -1,5 +1,5 @@
-from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QPoint, QSize
-from PySide6.QtGui import QIcon
+from functools import partial
+from PySide6.QtCore import Qt, QModelIndex, QPoint, QSize
 from PySide6.QtWidgets import QTreeView, QWidget
 from qfluentwidgets import TreeView, RoundMenu, Action, SmoothMode
 from qfluentwidgets import FluentIcon as Fi
@@ -7,37 +7,46 @@ from qfluentwidgets import FluentIcon as Fi
 from app.chromy.structs import Profile
 from app.chromy.chromi import (
     sort_profiles_id_func,
-    ProfileSortFilterProxyModel,
     open_profiles,
-    get_profile_picture,
+    profile_picture_source,
+    render_profile_picture,
 )
 from app.common.utils import show_quick_tip
 from app.components.rawdata_dialog import RawDataDialog
+from app.components.diff_model import DiffTableModel, SourceSortProxyModel, SORT_KEY_ROLE, collation_key
+from app.common.icon_loader import icon_loader
 from app.common.config import cfg
 
 
-class ProfilesModel(QAbstractTableModel):
+def _profile_signature(profile: Profile) -> tuple:
+    # 显示的文字和决定头像的字段
+    return (profile.name, profile.user_name, profile.gaia_picture_file_name, profile.avatar_icon,
+            profile.default_avatar_fill_color, profile.default_avatar_stroke_color)
+
+
+class ProfilesModel(DiffTableModel):
 
     def __init__(self, browser: str, profiles: dict[str, Profile], parent=None):
-        super().__init__(parent)
+        super().__init__(sorted(profiles.keys(), key=sort_profiles_id_func), parent)
         self.browser = browser
         self.profiles = profiles
-        self.profile_ids = list(profiles.keys())
-        self.profile_ids.sort(key=sort_profiles_id_func)
 
-        self.profile_pic_cache: dict[str, QIcon] = {}
+        # 用户 ID -> 头像来源，避免每次重绘都去检查头像文件
+        self.pic_sources: dict[str, tuple] = {}
+        # 正在加载的头像 -> 用到它的用户 ID，加载好后只通知这些行
+        self.waiting_pics: dict[str, set[str]] = {}
+        icon_loader.loaded.connect(self.on_icon_loaded)
 
         self.headers = ["ID", "名称", "邮箱"]
 
-    def rowCount(self, parent: QModelIndex = ...):
-        return len(self.profile_ids)
-
     def columnCount(self, parent: QModelIndex = ...):
         return len(self.headers)
 
     def data(self, index: QModelIndex, role: int = ...):
-        profile_id = self.profile_ids[index.row()]
-        profile = self.profiles[profile_id]
+        profile_id = self.keys[index.row()]
+        profile = self.profiles.get(profile_id)
+        if profile is None:
+            return None
         col = index.column()
         if role == Qt.ItemDataRole.DisplayRole:
             col_map = {
@@ -48,13 +57,18 @@ class ProfilesModel(QAbstractTableModel):
             return col_map[col]
         elif role == Qt.ItemDataRole.DecorationRole:
             if col == 1:
-                cache_id = f"{self.browser}!{profile_id}"
-                if cache_id in self.profile_pic_cache:
-                    return self.profile_pic_cache[cache_id]
-                else:
-                    pic = get_profile_picture(self.browser, profile)
-                    self.profile_pic_cache[cache_id] = pic
-                    return pic
+                # 在子线程中绘制，按头像来源缓存，刷新和切换浏览器后相同的头像不用重新绘制
+                source = self.pic_sources.get(profile_id)
+                if source is None:
+                    source = self.pic_sources[profile_id] = profile_picture_source(self.browser, profile)
+                key = f"avatar:{source!r}"
+                pic = icon_loader.get(key, partial(render_profile_picture, source))
+                if pic is None:
+                    self.waiting_pics.setdefault(key, set()).add(profile_id)
+                    return icon_loader.placeholder
+                return pic
+        elif role == SORT_KEY_ROLE:
+            return self.cached_sort_key(profile_id, col)
         return None
 
     def headerData(self, section: int, orientation: Qt.Orientation, role: int = ...):
@@ -63,17 +77,31 @@ class ProfilesModel(QAbstractTableModel):
                 return self.headers[section]
         return None
 
-    def update_data(self, browser: str, profiles: dict[str, Profile]):
-        self.beginResetModel()
+    def sort_key(self, profile_id: str, column: int):
+        if column == 0:
+            return sort_profiles_id_func(profile_id)
+        profile = self.profiles.get(profile_id)
+        if profile is None:
+            return ""
+        return collation_key(profile.name if column == 1 else profile.user_name)
 
-        self.browser = browser
-        self.profiles = profiles
-        self.profile_ids = list(profiles.keys())
-        self.profile_ids.sort(key=sort_profiles_id_func)
-
-        self.profile_pic_cache.clear()
+    def on_icon_loaded(self, key: str):
+        profile_ids = self.waiting_pics.pop(key, None)
+        if profile_ids is not None:
+            self.emit_rows_changed(profile_ids, (1, 1))
 
-        self.endResetModel()
+    def update_data(self, browser: str, profiles: dict[str, Profile]):
+        profile_ids = sorted(profiles.keys(), key=sort_profiles_id_func)
+        old = self.profiles
+        self.profiles = profiles
+        # 头像文件可能变了，用到时再重新检查
+        self.pic_sources.clear()
+        if browser != self.browser:
+            # 换了浏览器，同一个用户 ID 也不是同一个用户了
+            self.browser = browser
+            self.reset_keys(profile_ids)
+            return
+        self.apply_diff(profile_ids, self.changed_keys(old, profiles, _profile_signature))
 
 
 class ProfilesTable(TreeView):
@@ -109,7 +137,7 @@ class ProfilesTable(TreeView):
 
         self.profiles_model = ProfilesModel(browser, self.profiles, self)
 
-        proxy_model = ProfileSortFilterProxyModel(self)
+        proxy_model = SourceSortProxyModel(self)
         proxy_model.setSourceModel(self.profiles_model)
 
         self.setModel(proxy_model)
@@ -1,22 +1,55 @@
 # coding: utf8
+from collections.abc import Iterator
 from typing import Any
-from PySide6.QtCore import Qt, QAbstractItemModel, QModelIndex, QObject
-from PySide6.QtWidgets import QVBoxLayout, QWidget
-from qfluentwidgets import MessageBoxBase, TreeView, SmoothMode
+from PySide6.QtCore import Qt, QAbstractItemModel, QModelIndex, QObject, QTimer
+from PySide6.QtWidgets import QVBoxLayout, QWidget, QListWidgetItem
+from qfluentwidgets import MessageBoxBase, TreeView, SmoothMode, SearchLineEdit, ListWidget, CaptionLabel
 
 from app.common.config import cfg
+from app.common.rawdata_search import RawDataSearcher, MAX_SEARCH_RESULTS, value_text
+
+
+# 每次展开或者滚动到底时最多创建多少个子项
+FETCH_BATCH = 500
+SEARCH_DEBOUNCE_MS = 250
 
 
 # 以下两个类生成自 ChatGPT，并做了修改
 class DictTreeItem(object):
-    def __init__(self, key: str = "", value: Any = None, parent: "DictTreeItem" = None):
+    """
+    原始数据中的一项，值可以是字典、列表或者标量。
+    子项在视图需要时才分批创建，并记住自己在父项中的行号
+    """
+
+    def __init__(self, key: str = "", value: Any = None, parent: "DictTreeItem" = None, row: int = 0):
         self.key = key
         self.value = value
         self.parent_item = parent
+        self.row_in_parent = row
         self.child_items: list[DictTreeItem] = []
-
-    def append_child(self, child: "DictTreeItem"):
-        self.child_items.append(child)
+        self._pending: Iterator[tuple[str, Any]] | None = None
+
+    def is_container(self) -> bool:
+        return isinstance(self.value, (dict, list))
+
+    def total_count(self) -> int:
+        """全部子项的数量，包括还没创建的"""
+        return len(self.value) if self.is_container() else 0
+
+    def can_fetch_more(self) -> bool:
+        return len(self.child_items) < self.total_count()
+
+    def fetch(self, count: int) -> int:
+        """再创建最多 count 个子项，返回实际创建的数量"""
+        if self._pending is None:
+            if isinstance(self.value, dict):
+                self._pending = iter(self.value.items())
+            else:
+                self._pending = ((f"[{i}]", v) for i, v in enumerate(self.value))
+        start = len(self.child_items)
+        for row, (key, value) in zip(range(start, start + count), self._pending):
+            self.child_items.append(DictTreeItem(key, value, self, row))
+        return len(self.child_items) - start
 
     def child(self, row: int):
         return self.child_items[row]
@@ -25,9 +58,7 @@ class DictTreeItem(object):
         return len(self.child_items)
 
     def row(self):
-        if self.parent_item:
-            return self.parent_item.child_items.index(self)
-        return 0
+        return self.row_in_parent
 
     @staticmethod
     def column_count():
@@ -36,31 +67,54 @@ class DictTreeItem(object):
     def parent(self):
         return self.parent_item
 
+    def display_value(self):
+        if isinstance(self.value, dict):
+            # 折叠时也能看出里面有多少项
+            return f"{{{len(self.value)} 项}}"
+        if isinstance(self.value, list):
+            return f"[{len(self.value)} 项]"
+        if self.value is None or isinstance(self.value, bool):
+            return value_text(self.value)
+        return self.value
+
 
 class RawDataModel(QAbstractItemModel):
 
     def __init__(self, raw_data: dict, parent: QObject = None):
         super().__init__(parent)
-        self.root_item = DictTreeItem("Root")
-        self.setup_model_data(raw_data, self.root_item)
+        self.root_item = DictTreeItem("Root", raw_data)
+        self.root_item.fetch(FETCH_BATCH)
 
-    def setup_model_data(self, raw_data: dict, parent: DictTreeItem):
-        if isinstance(raw_data, dict):
-            for key, value in raw_data.items():
-                item = DictTreeItem(key, "" if isinstance(value, dict) else value, parent)
-                parent.append_child(item)
-                if isinstance(value, dict):
-                    self.setup_model_data(value, item)
+    def _item(self, index: QModelIndex) -> DictTreeItem:
+        return index.internalPointer() if index.isValid() else self.root_item
 
     def rowCount(self, parent: QModelIndex = ...):
-        if not parent.isValid():
-            return self.root_item.child_count()
-        parent_item = parent.internalPointer()
-        return parent_item.child_count()
+        if parent.isValid() and parent.column() != 0:
+            return 0
+        return self._item(parent).child_count()
 
     def columnCount(self, parent: QModelIndex = ...):
         return 2  # 我们定义两列
 
+    def hasChildren(self, parent: QModelIndex = ...):
+        # 子项还没创建也要显示展开箭头
+        if parent.isValid() and parent.column() != 0:
+            return False
+        return self._item(parent).total_count() > 0
+
+    def canFetchMore(self, parent: QModelIndex):
+        return self._item(parent).can_fetch_more()
+
+    def fetchMore(self, parent: QModelIndex):
+        item = self._item(parent)
+        start = item.child_count()
+        count = min(FETCH_BATCH, item.total_count() - start)
+        if count <= 0:
+            return
+        self.beginInsertRows(parent, start, start + count - 1)
+        item.fetch(count)
+        self.endInsertRows()
+
     def data(self, index: QModelIndex, role: int = ...):
         if not index.isValid():
             return None
@@ -70,7 +124,7 @@ class RawDataModel(QAbstractItemModel):
             if index.column() == 0:
                 return item.key
             elif index.column() == 1:
-                return item.value
+                return item.display_value()
         return None
 
     def headerData(self, section: int, orientation: Qt.Orientation, role: int = ...):
@@ -85,28 +139,37 @@ class RawDataModel(QAbstractItemModel):
         if not self.hasIndex(row, column, parent):
             return QModelIndex()
 
-        if not parent.isValid():
-            parent_item = self.root_item
-        else:
-            parent_item = parent.internalPointer()
-
-        child_item = parent_item.child(row)
-        if child_item:
-            return self.createIndex(row, column, child_item)
+        parent_item = self._item(parent)
+        if row < parent_item.child_count():
+            return self.createIndex(row, column, parent_item.child(row))
         return QModelIndex()
 
     def parent(self, index: QModelIndex = ...):
         if not index.isValid():
             return QModelIndex()
 
-        child_item = index.internalPointer()
-        parent_item = child_item.parent()
-
-        if parent_item == self.root_item or not parent_item:
+        parent_item = index.internalPointer().parent()
+        if parent_item is None or parent_item is self.root_item:
             return QModelIndex()
 
+        # 行号在创建时就记下了，不用在兄弟项中查找
         return self.createIndex(parent_item.row(), 0, parent_item)
 
+    def index_from_path(self, path: list[int]) -> QModelIndex:
+        """按每一层的行号找到对应的项，路径上还没创建的子项只创建到需要的那一行"""
+        index = QModelIndex()
+        for row in path:
+            item = self._item(index)
+            if row >= item.total_count():
+                return QModelIndex()
+            start = item.child_count()
+            if row >= start:
+                self.beginInsertRows(index, start, row)
+                item.fetch(row + 1 - start)
+                self.endInsertRows()
+            index = self.index(row, 0, index)
+        return index
+
 
 class RawDataDialog(MessageBoxBase):
 
@@ -118,6 +181,18 @@ class RawDataDialog(MessageBoxBase):
         self.vly_m = QVBoxLayout()
         self.cw.setLayout(self.vly_m)
 
+        self.sle_search = SearchLineEdit(self.cw)
+        self.sle_search.setPlaceholderText("正在建立索引…")
+        self.sle_search.setEnabled(False)
+        self.lb_status = CaptionLabel(self.cw)
+        self.lsw_results = ListWidget(self.cw)
+        self.lsw_results.setMaximumHeight(180)
+        self.vly_m.addWidget(self.sle_search)
+        self.vly_m.addWidget(self.lb_status)
+        self.vly_m.addWidget(self.lsw_results)
+        self.lb_status.hide()
+        self.lsw_results.hide()
+
         self.trv_m = TreeView(self.cw)
         self.trv_m.scrollDelagate.verticalSmoothScroll.setSmoothMode(cfg.get(cfg.smooth_mode))
         self.vly_m.addWidget(self.trv_m)
@@ -132,3 +207,73 @@ class RawDataDialog(MessageBoxBase):
 
         self.buttonLayout.insertStretch(0, 4)
         self.cancelButton.hide()
+
+        # 打开时就在子线程中建立索引，树本身仍然是用到时才创建
+        self.searcher = RawDataSearcher(data, self)
+        self.search_generation = 0
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+
+        self.searcher.indexed.connect(self.on_indexed)
+        self.searcher.found.connect(self.on_found)
+        self.searcher.finished.connect(self.on_search_finished)
+        self.search_timer.timeout.connect(self.start_search)
+        self.sle_search.textChanged.connect(lambda _: self.search_timer.start())
+        self.sle_search.searchSignal.connect(lambda _: self.start_search())
+        self.lsw_results.itemClicked.connect(self.on_result_clicked)
+
+    def on_indexed(self, count: int):
+        self.sle_search.setEnabled(True)
+        self.sle_search.setPlaceholderText(f"在 {count} 项中搜索键或值")
+        if len(self.sle_search.text().strip()) != 0:
+            self.start_search()
+
+    def start_search(self):
+        self.search_timer.stop()
+        self.lsw_results.clear()
+        text = self.sle_search.text()
+        self.search_generation = self.searcher.search(text)
+        searching = len(text.split()) != 0
+        self.lb_status.setText("正在搜索…")
+        self.lb_status.setVisible(searching)
+        self.lsw_results.setVisible(searching)
+
+    def on_found(self, generation: int, positions: list[int]):
+        if generation != self.search_generation:
+            return
+        index = self.searcher.index
+        for pos in positions:
+            item = QListWidgetItem(index.label(pos))
+            item.setData(Qt.ItemDataRole.UserRole, pos)
+            self.lsw_results.addItem(item)
+        self.lb_status.setText(f"已找到 {self.lsw_results.count()} 项，正在搜索…")
+
+    def on_search_finished(self, generation: int, total: int):
+        if generation != self.search_generation:
+            return
+        if total >= MAX_SEARCH_RESULTS:
+            self.lb_status.setText(f"只显示前 {total} 项")
+        else:
+            self.lb_status.setText(f"找到 {total} 项")
+
+    def on_result_clicked(self, item: QListWidgetItem):
+        path = self.searcher.index.path(item.data(Qt.ItemDataRole.UserRole))
+        index = self.model.index_from_path(path)
+        if not index.isValid():
+            return
+        # 只展开到目标的路径，其他分支保持折叠
+        parent = index.parent()
+        ancestors = []
+        while parent.isValid():
+            ancestors.append(parent)
+            parent = parent.parent()
+        for ancestor in reversed(ancestors):
+            self.trv_m.expand(ancestor)
+        self.trv_m.setCurrentIndex(index)
+        self.trv_m.scrollTo(index, TreeView.ScrollHint.PositionAtCenter)
+
+    def done(self, code: int):
+        # 对话框关闭后不再继续搜索
+        self.searcher.cancel()
+        super().done(code)
@@ -3,7 +3,7 @@ from PySide6.QtWidgets import QWidget
 from qfluentwidgets import (
     ScrollArea, ExpandLayout, SettingCardGroup,
     OptionsSettingCard, CustomColorSettingCard, setTheme, setThemeColor,
-    SwitchSettingCard, InfoBar, InfoBarPosition
+    SwitchSettingCard, InfoBar, InfoBarPosition, RangeSettingCard,
 )
 from qfluentwidgets import FluentIcon as Fi
 from app.common.config import cfg
@@ -58,9 +58,30 @@ class SettingsInterface(ScrollArea):
         self.personal_group.addSettingCard(self.switch_animation_card)
         self.personal_group.addSettingCard(self.smooth_mode_card)
 
+        self.debug_group = SettingCardGroup("调试", self.cw)
+        self.slow_query_card = RangeSettingCard(
+            cfg.slow_query_ms,
+            Fi.SPEED_HIGH,
+            "慢查询阈值（毫秒）",
+            "数据库语句耗时超过该值时输出到日志",
+            parent=self.debug_group,
+        )
+
+        self.log_to_file_card = SwitchSettingCard(
+            Fi.SAVE,
+            "保存日志到文件",
+            "输出页的日志同时写入应用目录下的 logs 文件夹",
+            configItem=cfg.log_to_file,
+            parent=self.debug_group,
+        )
+
+        self.debug_group.addSettingCard(self.slow_query_card)
+        self.debug_group.addSettingCard(self.log_to_file_card)
+
         self.ely.setSpacing(28)
         self.ely.setContentsMargins(20, 20, 20, 20)
         self.ely.addWidget(self.personal_group)
+        self.ely.addWidget(self.debug_group)
 
         cfg.themeChanged.connect(setTheme)
         cfg.appRestartSig.connect(self.show_restart_tip)
@@ -1,16 +1,26 @@
 # coding: utf8
 from ._types_def import (
-    DataType, NullType, BlobType,
+    DataType, NullType, BlobType, TransactionMode,
 )
-from ._column import Column, Table
+from ._column import Column, Table, Index
 from ._where import (
-    Operand, Expression, SortOption, NullOption, order
+    Operand, Expression, SortOption, NullOption, order, Param, excluded,
 )
-from ._worker import Sqlite3Worker
+from ._template import QueryTemplate
+from ._worker import Sqlite3Worker, PlanNode
+from ._async import AsyncSqlite3Worker
+from ._pragma import PragmaProfile, PRAGMA_PROFILES
+from ._stats import StatementStats, StatementRecord, fingerprint
+from ._fts import FtsTable, fts_query, fts_tokens, bm25, snippet, highlight
 
 
-__version__ = "2.3.0"
+__version__ = "3.0.0"
 __version_info__ = tuple(map(int, __version__.split(".")))
 
 __all__ = ["Sqlite3Worker", "Column", "DataType", "NullType", "BlobType",
-           "Operand", "Expression", "SortOption", "NullOption", "order", "Table"]
+           "Operand", "Expression", "SortOption", "NullOption", "order", "Table",
+           "TransactionMode", "Index", "PlanNode",
+           "StatementStats", "StatementRecord", "fingerprint",
+           "Param", "QueryTemplate", "excluded", "AsyncSqlite3Worker",
+           "PragmaProfile", "PRAGMA_PROFILES",
+           "FtsTable", "fts_query", "fts_tokens", "bm25", "snippet", "highlight"]
@@ -0,0 +1,128 @@
+# coding: utf8
+from __future__ import annotations
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+from os import PathLike
+from typing import Any, Callable
+
+from ._worker import Sqlite3Worker
+from ._pragma import PragmaProfile
+
+
+class AsyncSqlite3Worker(object):
+    """
+    在专用线程中持有一个 Sqlite3Worker，所有操作按提交顺序排队执行。
+    submit 返回 concurrent.futures.Future，其余同名方法返回可 await 的协程。
+    排队中的请求超过 max_pending 时，submit 会阻塞，await 则挂起等待，以此限制生产速度。
+    """
+
+    def __init__(
+            self,
+            db_name: str | PathLike[str] = ":memory:",
+            key: bytes = None,
+            fix_time: int = None,
+            fix_iv: bytes = None,
+            profile: str | PragmaProfile = None,
+            max_pending: int = 256,
+    ):
+        self._db_name = db_name
+        self._queue: queue.SimpleQueue[tuple | None] = queue.SimpleQueue()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._is_closed = False
+
+        # 连接必须在使用它的线程中创建
+        init_future: Future = Future()
+        self._thread = threading.Thread(
+            target=self._run, args=(db_name, key, fix_time, fix_iv, profile, init_future),
+            name="Sqlite3Worker", daemon=True,
+        )
+        self._thread.start()
+        init_future.result()
+
+    @property
+    def db_name(self) -> str:
+        return self._db_name
+
+    def _run(self, db_name, key, fix_time, fix_iv, profile, init_future: Future):
+        try:
+            worker = Sqlite3Worker(db_name, key, fix_time, fix_iv, profile)
+        except BaseException as e:
+            init_future.set_exception(e)
+            return
+        init_future.set_result(None)
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            func, args, kwargs, future = item
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(worker, *args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                self._slots.release()
+
+        worker.close()
+
+    def _check_closed(self):
+        if self._is_closed:
+            raise RuntimeError("Worker is closed")
+
+    def _put(self, func: Callable, args: tuple, kwargs: dict) -> Future:
+        future: Future = Future()
+        self._queue.put((func, args, kwargs, future))
+        return future
+
+    def run(self, func: Callable[..., Any], *args, **kwargs) -> Future:
+        """在数据库线程中执行 func(worker, *args, **kwargs)，可用于事务或者执行 QueryTemplate"""
+        self._check_closed()
+        self._slots.acquire()
+        return self._put(func, args, kwargs)
+
+    def submit(self, method: str, *args, **kwargs) -> Future:
+        """在数据库线程中调用 Sqlite3Worker 的同名方法"""
+        return self.run(lambda w, *a, **kw: getattr(w, method)(*a, **kw), *args, **kwargs)
+
+    async def arun(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        self._check_closed()
+        if not self._slots.acquire(blocking=False):
+            # 队列满了，到默认线程池里等空位，不堵塞事件循环
+            await asyncio.get_running_loop().run_in_executor(None, self._slots.acquire)
+        return await asyncio.wrap_future(self._put(func, args, kwargs))
+
+    async def _acall(self, method: str, *args, **kwargs) -> Any:
+        return await self.arun(lambda w, *a, **kw: getattr(w, method)(*a, **kw), *args, **kwargs)
+
+    async def select(self, *args, **kwargs) -> tuple[str, list[list]]:
+        return await self._acall("select", *args, **kwargs)
+
+    async def insert_into(self, *args, **kwargs) -> str:
+        return await self._acall("insert_into", *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs) -> int:
+        return await self._acall("insert_many", *args, **kwargs)
+
+    async def upsert(self, *args, **kwargs) -> str:
+        return await self._acall("upsert", *args, **kwargs)
+
+    async def upsert_many(self, *args, **kwargs) -> int:
+        return await self._acall("upsert_many", *args, **kwargs)
+
+    async def update(self, *args, **kwargs) -> str:
+        return await self._acall("update", *args, **kwargs)
+
+    async def delete_from(self, *args, **kwargs) -> str:
+        return await self._acall("delete_from", *args, **kwargs)
+
+    def close(self, wait: bool = True):
+        # 已经排队的请求会先执行完
+        if self._is_closed is False:
+            self._is_closed = True
+            self._queue.put(None)
+            if wait:
+                self._thread.join()
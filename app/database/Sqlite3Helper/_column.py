@@ -36,11 +36,26 @@ class Column(object):
     __repr__ = __str__
 
 
+@dataclass
+class Index(object):
+    name: str
+    # 元素可以是 Column、列名，也可以是 order() 的结果或者 lower(name) 这样的表达式
+    columns: list[Column | str]
+    unique: bool = False
+    # 不为空时是部分索引，只收录满足条件的行，类型为 Expression 或者 str
+    where: object = None
+
+    def __post_init__(self):
+        if len(self.columns) == 0:
+            raise ValueError("Index must have at least one column")
+
+
 @dataclass
 class Table(ABC):
     table: str = ""
 
     all: list[Column] = field(default_factory=list)
+    indexes: list[Index] = field(default_factory=list)
 
     def __post_init__(self):
         if len(self.table) == 0:
@@ -49,3 +64,5 @@ class Table(ABC):
             a = getattr(self, i)
             if isinstance(a, Column):
                 self.all.append(a)
+            elif isinstance(a, Index):
+                self.indexes.append(a)
@@ -0,0 +1,104 @@
+# coding: utf8
+from __future__ import annotations
+import re
+from dataclasses import dataclass, field
+from ._column import Column
+from ._util_func import to_string
+
+_RE_FTS_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class FtsTable(object):
+    """
+    FTS5 全文索引虚拟表
+
+    content_table 不为空时为外部内容表，索引的文本不再重复保存，
+    由触发器跟随内容表的增删改自动同步，此时 columns 的列名必须和内容表中的列名一致
+    """
+    name: str
+    columns: list[Column | str]
+    content_table: str = ""
+    # 内容表中与 FTS 的 rowid 对应的列，须为整数主键或者 rowid
+    content_rowid: str = "rowid"
+    # unicode61 不区分大小写并去掉变音符号，中文可以用 trigram（SQLite 3.34.0 以上）
+    tokenize: str = "unicode61"
+    # 前缀索引的长度，用于加速 "abc*" 这样的前缀查询
+    prefix: list[int] = field(default_factory=list)
+
+    def __post_init__(self):
+        if len(self.columns) == 0:
+            raise ValueError("FTS table must have at least one column")
+        for column in self.columns:
+            if isinstance(column, Column) and column.secure:
+                raise ValueError(f"Secure column {column.name} cannot be full-text indexed")
+
+    @property
+    def column_names(self) -> list[str]:
+        return [column.name if isinstance(column, Column) else column for column in self.columns]
+
+    @property
+    def trigger_names(self) -> list[str]:
+        return [f"{self.name}_ai", f"{self.name}_ad", f"{self.name}_au"]
+
+
+def fts_tokens(text: str) -> list[str]:
+    """fts_query 切分用户输入的方式，调用方可以据此判断哪些词能用全文索引"""
+    return _RE_FTS_TOKEN.findall(text)
+
+
+def fts_query(text: str, prefix: bool = False, any_: bool = False) -> str:
+    """
+    把用户输入的文本转为安全的 MATCH 查询，每个词都加上双引号，
+    避免其中的 AND、OR、NEAR、* 和引号等被当作 FTS5 语法
+
+    :param text: 用户输入的文本
+    :param prefix: 最后一个词是否按前缀匹配，适合边输入边搜索
+    :param any_: 为 True 时匹配任意一个词，否则要求所有词都出现
+    :return: MATCH 查询字符串，没有可搜索的词时为空字符串
+    """
+    tokens = fts_tokens(text)
+    if len(tokens) == 0:
+        return ""
+    terms = [f'"{token}"' for token in tokens]
+    if prefix:
+        terms[-1] = f"{terms[-1]}*"
+    return (" OR " if any_ else " ").join(terms)
+
+
+def _table_name(table: FtsTable | str) -> str:
+    return table.name if isinstance(table, FtsTable) else table
+
+
+def bm25(table: FtsTable | str, *weights: float) -> str:
+    """
+    bm25 相关度，值越小越相关，可以用在 select 的列或者 order_by 中
+
+    :param table: FTS 表
+    :param weights: 按列顺序的权重，不给则都为 1.0
+    """
+    args = [_table_name(table), *[str(float(w)) for w in weights]]
+    return f"bm25({', '.join(args)})"
+
+
+def snippet(table: FtsTable | str, column: int = -1,
+            start: str = "[", end: str = "]", ellipsis: str = "...", tokens: int = 16) -> str:
+    """
+    匹配文本的摘要，可以用在 select 的列中
+
+    :param table: FTS 表
+    :param column: 从第几列取摘要，-1 为自动选择匹配最好的列
+    :param start: 匹配词前插入的标记
+    :param end: 匹配词后插入的标记
+    :param ellipsis: 摘要截断处插入的文本
+    :param tokens: 摘要最多包含的词数，最大为 64
+    """
+    if not 0 < tokens <= 64:
+        raise ValueError("Tokens of snippet must be between 1 and 64")
+    return (f"snippet({_table_name(table)}, {column}, {to_string(start)}, {to_string(end)}, "
+            f"{to_string(ellipsis)}, {tokens})")
+
+
+def highlight(table: FtsTable | str, column: int, start: str = "[", end: str = "]") -> str:
+    """整列文本，匹配词前后插入标记，可以用在 select 的列中"""
+    return f"highlight({_table_name(table)}, {column}, {to_string(start)}, {to_string(end)})"
@@ -0,0 +1,52 @@
+# coding: utf8
+from __future__ import annotations
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class PragmaProfile(object):
+    name: str
+    journal_mode: str = "DELETE"  # DELETE / TRUNCATE / PERSIST / MEMORY / WAL / OFF
+    synchronous: str = "FULL"     # OFF / NORMAL / FULL / EXTRA
+    cache_size: int = -2000       # 负数为 KiB，正数为页数
+    temp_store: str = "DEFAULT"   # DEFAULT / FILE / MEMORY
+    mmap_size: int = 0            # 字节，0 为不使用内存映射
+
+    def items(self) -> list[tuple[str, str | int]]:
+        # journal_mode 放在最前，它只能在事务外修改
+        return [
+            ("journal_mode", self.journal_mode),
+            ("synchronous", self.synchronous),
+            ("cache_size", self.cache_size),
+            ("temp_store", self.temp_store),
+            ("mmap_size", self.mmap_size),
+        ]
+
+
+PRAGMA_PROFILES: dict[str, PragmaProfile] = {
+    # SQLite 的默认设置
+    "default": PragmaProfile("default"),
+    # 每次提交都落盘，断电也不丢数据
+    "durable": PragmaProfile(
+        "durable",
+        journal_mode="WAL",
+        synchronous="FULL",
+    ),
+    # 大批量重建缓存用，崩溃时数据库可能损坏，只适合可以重新生成的数据
+    "bulk-load": PragmaProfile(
+        "bulk-load",
+        journal_mode="MEMORY",
+        synchronous="OFF",
+        cache_size=-64 * 1024,
+        temp_store="MEMORY",
+    ),
+    # 界面上频繁查询用，断电可能丢掉最后几次提交，但不会损坏
+    "read-mostly": PragmaProfile(
+        "read-mostly",
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        cache_size=-32 * 1024,
+        temp_store="MEMORY",
+        mmap_size=256 * 1024 * 1024,
+    ),
+}
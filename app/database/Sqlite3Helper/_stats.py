@@ -0,0 +1,100 @@
+# coding: utf8
+from __future__ import annotations
+import re
+from dataclasses import dataclass, field
+
+# 直方图的桶上限，单位毫秒，最后一个桶收录所有更慢的
+HISTOGRAM_BOUNDS_MS = (1, 5, 10, 50, 100, 500, 1000, float("inf"))
+
+_RE_BLOB = re.compile(r"[xX]'[0-9a-fA-F]*'")
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?![\w.])")
+_RE_NULL = re.compile(r"(?<=[(,])(\s*)NULL\b", re.IGNORECASE)
+_RE_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_RE_ROWS = re.compile(r"VALUES\s*\(\?\+\)(?:\s*,\s*\(\?\+\))*", re.IGNORECASE)
+_RE_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """
+    把语句中的字面量替换为 ?，把值列表折叠成 ?+，
+    这样只是值不同的语句会得到同一个指纹，方便聚合统计
+    """
+    fp = _RE_BLOB.sub("?", statement)
+    fp = _RE_STRING.sub("?", fp)
+    fp = _RE_NUMBER.sub("?", fp)
+    fp = _RE_NULL.sub(r"\1?", fp)
+    fp = _RE_LIST.sub("?+", fp)
+    fp = fp.replace("(?)", "(?+)")
+    # 不管插入多少行都折叠成一样的
+    fp = _RE_ROWS.sub("VALUES (?+)...", fp)
+    return _RE_SPACE.sub(" ", fp).strip()
+
+
+@dataclass
+class StatementRecord(object):
+    fingerprint: str
+    count: int = 0
+    total_time: float = 0.0  # 秒
+    max_time: float = 0.0    # 秒
+    rows: int = 0            # SELECT 为返回行数，其他为影响行数
+    vm_steps: int = 0        # 进度回调次数乘以间隔，近似 SQLite 虚拟机执行的指令数
+    histogram: list[int] = field(default_factory=lambda: [0] * len(HISTOGRAM_BOUNDS_MS))
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.count if self.count > 0 else 0.0
+
+    def add(self, elapsed: float, rows: int, vm_steps: int):
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.rows += max(rows, 0)
+        self.vm_steps += vm_steps
+        elapsed_ms = elapsed * 1000
+        for i, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if elapsed_ms <= bound:
+                self.histogram[i] += 1
+                break
+
+
+class StatementStats(object):
+
+    def __init__(self):
+        self._records: dict[str, StatementRecord] = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def record(self, statement: str, elapsed: float, rows: int = 0, vm_steps: int = 0) -> StatementRecord:
+        fp = fingerprint(statement)
+        if fp not in self._records:
+            self._records[fp] = StatementRecord(fp)
+        rec = self._records[fp]
+        rec.add(elapsed, rows, vm_steps)
+        return rec
+
+    def records(self) -> list[StatementRecord]:
+        return list(self._records.values())
+
+    def top(self, n: int = 10, key: str = "total_time") -> list[StatementRecord]:
+        """按 total_time、max_time、mean_time、count、rows 或 vm_steps 取最多的 n 条"""
+        return sorted(self._records.values(), key=lambda r: getattr(r, key), reverse=True)[:n]
+
+    def histogram(self) -> list[int]:
+        """所有语句合并后的耗时直方图，桶的上限见 HISTOGRAM_BOUNDS_MS"""
+        merged = [0] * len(HISTOGRAM_BOUNDS_MS)
+        for rec in self._records.values():
+            for i, c in enumerate(rec.histogram):
+                merged[i] += c
+        return merged
+
+    def reset(self):
+        self._records.clear()
+
+    def summary(self, n: int = 10) -> str:
+        lines = []
+        for rec in self.top(n):
+            lines.append(f"{rec.count:>7} x {rec.mean_time * 1000:>9.2f}ms avg, "
+                         f"{rec.max_time * 1000:>9.2f}ms max, {rec.rows:>9} rows | {rec.fingerprint}")
+        return "\n".join(lines)
@@ -0,0 +1,68 @@
+# coding: utf8
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from ._types_def import GeneralValueTypes
+from ._column import Column
+from ._where import Param, bind_params
+
+if TYPE_CHECKING:
+    from ._worker import Sqlite3Worker
+
+
+class QueryTemplate(object):
+    """
+    编译好的带占位符的语句，每次执行只需绑定新的参数，
+    SQL 不用重新拼接，SQLite 也能从语句缓存中复用已经准备好的语句
+    """
+
+    def __init__(
+            self,
+            worker: Sqlite3Worker,
+            statement: str,
+            params: list[GeneralValueTypes | Param],
+            columns: list[Column | str] = None,
+            fetch: bool = False,
+            commit: bool = False,
+    ):
+        self._worker = worker
+        self._statement = statement
+        self._params = params
+        self._columns = columns or []
+        self._fetch = fetch
+        self._commit = commit
+
+    @property
+    def statement(self) -> str:
+        return self._statement
+
+    @property
+    def param_names(self) -> list[str]:
+        names = []
+        for param in self._params:
+            if isinstance(param, Param) and param.name not in names:
+                names.append(param.name)
+        return names
+
+    def bind(self, **values: GeneralValueTypes) -> list:
+        return bind_params(self._params, values)
+
+    def execute(self, **values: GeneralValueTypes) -> list[list] | int:
+        """
+        绑定参数并执行
+
+        :param values: 以 Param 的名字为键的参数值
+        :return: 查询语句返回结果行，其他语句返回影响的行数
+        """
+        return self._worker.execute_template(self, self.bind(**values))
+
+    @property
+    def columns(self) -> list[Column | str]:
+        return self._columns
+
+    @property
+    def fetch(self) -> bool:
+        return self._fetch
+
+    @property
+    def commit(self) -> bool:
+        return self._commit
@@ -12,6 +12,12 @@ class DataType(Enum):
     BLOB = "BLOB"
 
 
+class TransactionMode(Enum):
+    DEFERRED = "DEFERRED"
+    IMMEDIATE = "IMMEDIATE"
+    EXCLUSIVE = "EXCLUSIVE"
+
+
 class NullType(object):
 
     def __str__(self):
@@ -26,6 +32,10 @@ class BlobType(object):
     def __str__(self):
         return f"X'{self._data.hex()}'"
 
+    @property
+    def data(self) -> bytes:
+        return self._data
+
     def encrypt(self, fernet: NotRandomFernet) -> BlobType:
         if fernet is None:
             raise ValueError("Key is not set")
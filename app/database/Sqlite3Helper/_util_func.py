@@ -34,3 +34,16 @@ def to_string(value: GeneralValueTypes):
         value = BlobType(value)
 
     return str(value)
+
+
+def to_param(value: GeneralValueTypes):
+    """把值转为可以直接绑定到 ? 占位符的类型，与 to_string 的处理保持一致"""
+    if value is None or isinstance(value, NullType):
+        return None
+    if isinstance(value, BlobType):
+        return value.data
+    if isinstance(value, str):
+        # to_string 认为首尾都是单引号的字符串已经是 SQL 字面量了
+        if len(value) >= 2 and value.startswith("'") and value.endswith("'"):
+            return value[1:-1].replace("''", "'")
+    return value
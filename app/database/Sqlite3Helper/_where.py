@@ -4,36 +4,115 @@ import os
 import time
 import sqlite3
 from enum import Enum
+from typing import Callable
 from ._crypto import NotRandomFernet
 from ._types_def import (
     GeneralValueTypes, BlobType,
 )
-from ._util_func import to_string, implicitly_convert
+from ._util_func import to_string, to_param, implicitly_convert
 from ._column import Column
 
 
+class Param(object):
+    """
+    查询模板中的占位参数，执行模板时按名字绑定值，
+    例如 Operand(E.profile).equal_to(Param("profile"))
+    """
+
+    def __init__(self, name: str, convert: Callable[[GeneralValueTypes], GeneralValueTypes] = None):
+        self.name = name
+        # 绑定值时先经过的转换，用于隐式转换和加密
+        self.convert = convert
+
+    def __str__(self):
+        return f":{self.name}"
+
+
+class Value(object):
+    """语句中的一个值，拼成字符串时转为字面量，编译时转为 ? 和参数"""
+
+    __slots__ = ("value", )
+
+    def __init__(self, value: GeneralValueTypes | Param):
+        self.value = value
+
+    def __str__(self):
+        if isinstance(self.value, Param):
+            return str(self.value)
+        return to_string(self.value)
+
+
+# 语句由 SQL 片段和值交替组成，组合表达式时只拼接列表，
+# 直到需要时才生成带字面量的字符串或者带占位符的语句
+Parts = list[str | Value]
+
+
+def render_parts(parts: Parts) -> str:
+    return "".join([str(part) for part in parts])
+
+
+def compile_parts(parts: Parts) -> tuple[str, list[GeneralValueTypes | Param]]:
+    sql_ls = []
+    params = []
+    for part in parts:
+        if isinstance(part, Value):
+            sql_ls.append("?")
+            params.append(part.value if isinstance(part.value, Param) else to_param(part.value))
+        else:
+            sql_ls.append(part)
+    return "".join(sql_ls), params
+
+
+def bind_params(params: list[GeneralValueTypes | Param], values: dict[str, GeneralValueTypes]) -> list:
+    bound = []
+    for param in params:
+        if isinstance(param, Param):
+            if param.name not in values:
+                raise ValueError(f"Parameter {param.name} is not bound")
+            value = values[param.name]
+            if param.convert is not None:
+                value = param.convert(value)
+            param = to_param(value)
+        bound.append(param)
+    return bound
+
+
+def _parts_of(expression: Expression | str) -> Parts:
+    if isinstance(expression, Expression):
+        return expression.parts
+    return [str(expression)]
+
+
 class Expression(object):
 
-    def __init__(self, expr: str):
-        self._expr = expr
+    def __init__(self, expr: str | Parts):
+        self._parts: Parts = [expr] if isinstance(expr, str) else expr
 
     def __str__(self):
-        return self._expr
+        return render_parts(self._parts)
+
+    @property
+    def parts(self) -> Parts:
+        return self._parts
+
+    def compile(self) -> tuple[str, list[GeneralValueTypes | Param]]:
+        """生成带 ? 占位符的语句和对应的参数列表，Param 原样留在参数列表中"""
+        return compile_parts(self._parts)
 
     def and_(self, expression: Expression):
-        return Expression(f"{self._expr} AND {expression}")
+        return Expression([*self._parts, " AND ", *_parts_of(expression)])
 
     def or_(self, expression: Expression, high_priority: bool = False):
-        statement = f"{self._expr} OR {expression}"
+        parts = [*self._parts, " OR ", *_parts_of(expression)]
         if high_priority:
-            statement = f"({statement})"
-        return Expression(statement)
+            parts = ["(", *parts, ")"]
+        return Expression(parts)
 
     def exists(self, not_: bool = False):
         mark = "EXISTS"
         if not_:
             mark = "NOT EXISTS"
-        return Expression(f"{mark} ({self._expr})")
+        return Expression([f"{mark} (", *self._parts, ")"])
 
 
 class Operand(object):
@@ -62,48 +141,58 @@ class Operand(object):
 
         return value
 
-    def equal_to(self, value: GeneralValueTypes, not_: bool = False):
-        value = self._try_encrypt(value)
+    def _value(self, value: GeneralValueTypes | Param, convert: bool = False) -> Value:
+        if isinstance(value, Param):
+            # 占位参数等绑定的时候再转换
+            return Value(Param(value.name, self._try_encrypt if convert else None))
+        return Value(self._try_encrypt(value) if convert else value)
+
+    def equal_to(self, value: GeneralValueTypes | Param, not_: bool = False):
         op = "!=" if not_ else "="
-        return Expression(f"{self._name} {op} {to_string(value)}")
+        return Expression([f"{self._name} {op} ", self._value(value, convert=True)])
 
     # 上面的相等比较可能会用在字符串或者二进制数据上，所以进行隐式转换并尝试加密
     # 对于不等比较一般只用于数字，差别不大，所以不进行隐式转换
 
-    def less_than(self, value: GeneralValueTypes):
-        return Expression(f"{self._name} < {to_string(value)}")
+    def less_than(self, value: GeneralValueTypes | Param):
+        return Expression([f"{self._name} < ", self._value(value)])
 
-    def greater_than(self, value: GeneralValueTypes):
-        return Expression(f"{self._name} > {to_string(value)}")
+    def greater_than(self, value: GeneralValueTypes | Param):
+        return Expression([f"{self._name} > ", self._value(value)])
 
-    def less_equal(self, value: GeneralValueTypes):
-        return Expression(f"{self._name} <= {to_string(value)}")
+    def less_equal(self, value: GeneralValueTypes | Param):
+        return Expression([f"{self._name} <= ", self._value(value)])
 
-    def greater_equal(self, value: GeneralValueTypes):
-        return Expression(f"{self._name} >= {to_string(value)}")
+    def greater_equal(self, value: GeneralValueTypes | Param):
+        return Expression([f"{self._name} >= ", self._value(value)])
 
-    def between(self, minimum: GeneralValueTypes, maximum: GeneralValueTypes, not_: bool = False):
+    def between(self, minimum: GeneralValueTypes | Param, maximum: GeneralValueTypes | Param, not_: bool = False):
         mark = "BETWEEN"
         if not_:
             mark = "NOT BETWEEN"
-        return Expression(f"{self._name} {mark} {to_string(minimum)} AND {to_string(maximum)}")
+        return Expression([f"{self._name} {mark} ", self._value(minimum), " AND ", self._value(maximum)])
 
-    def in_(self, values: list[GeneralValueTypes], not_: bool = False):
+    def in_(self, values: list[GeneralValueTypes | Param], not_: bool = False):
         # in 也算是相等比较的一种，所以也给隐私转换并尝试加密了
-        values_str = ", ".join([to_string(self._try_encrypt(value)) for value in values])
         mark = "IN"
         if not_:
             mark = "NOT IN"
-        return Expression(f"{self._name} {mark} ({values_str})")
-
-    def like(self, regx: str, escape: str = "", not_: bool = False):
+        parts: Parts = [f"{self._name} {mark} ("]
+        for i, value in enumerate(values):
+            if i > 0:
+                parts.append(", ")
+            parts.append(self._value(value, convert=True))
+        parts.append(")")
+        return Expression(parts)
+
+    def like(self, regx: str | Param, escape: str = "", not_: bool = False):
         head = "LIKE"
         if not_:
             head = "NOT LIKE"
-        body = f"{head} {to_string(regx)}"
+        parts: Parts = [f"{self._name} {head} ", self._value(regx)]
         if len(escape) != 0:
-            body = f"{body} ESCAPE {to_string(escape)}"
-        return Expression(f"{self._name} {body}")
+            parts.extend([" ESCAPE ", self._value(escape)])
+        return Expression(parts)
 
     def is_null(self, not_: bool = False):
         mark = "IS NULL"
@@ -111,8 +200,12 @@ class Operand(object):
             mark = "IS NOT NULL"
         return Expression(f"{self._name} {mark}")
 
-    def glob(self, regx: str):
-        return Expression(f"{self._name} GLOB {to_string(regx)}")
+    def glob(self, regx: str | Param):
+        return Expression([f"{self._name} GLOB ", self._value(regx)])
+
+    def match(self, query: str | Param):
+        # 用于 FTS 表，列名为表名时搜索所有列，用户输入的文本最好先经过 fts_query 处理
+        return Expression([f"{self._name} MATCH ", self._value(query)])
 
 
 class SortOption(Enum):
@@ -140,3 +233,9 @@ def order(
             name = f"{name} {null_option.value}"
 
     return name
+
+
+def excluded(column: Column | str) -> str:
+    """upsert 时引用冲突行中本来要插入的值，如 count + excluded.count"""
+    name = column.name if isinstance(column, Column) else column
+    return f"excluded.{name}"
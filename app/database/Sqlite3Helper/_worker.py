@@ -2,8 +2,13 @@
 from __future__ import annotations
 
 import os
+import re
 import sqlite3
 import time
+from collections.abc import Iterable
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from logging import Logger
 from os import PathLike
 from types import NoneType
 try:
@@ -15,11 +20,59 @@ except ImportError:
 from ._crypto import NotRandomFernet
 from ._types_def import (
     DataType, GeneralValueTypes,
-    NullType, BlobType,
+    NullType, BlobType, TransactionMode,
 )
-from ._util_func import to_string, implicitly_convert
-from ._column import Column
-from ._where import Operand, Expression
+from ._util_func import to_string, to_param, implicitly_convert
+from ._column import Column, Index
+from ._where import (
+    Operand, Expression, Param, Value, Parts, excluded,
+    render_parts, compile_parts, bind_params,
+)
+from ._template import QueryTemplate
+from ._stats import StatementStats
+from ._pragma import PragmaProfile, PRAGMA_PROFILES
+from ._fts import FtsTable, bm25
+
+# 每执行这么多条虚拟机指令调用一次进度回调
+PROGRESS_INTERVAL = 1000
+# 慢语句日志里语句的最大长度，批量插入的语句可能非常长
+SLOW_LOG_MAX_LEN = 500
+# 单条语句最多能绑定的参数个数，超过时退回到字面量语句
+MAX_BIND_PARAMS = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+_RE_PRAGMA_WORD = re.compile(r"^[A-Za-z_]+$")
+
+
+@dataclass
+class PlanNode(object):
+    """EXPLAIN QUERY PLAN 结果中的一个节点"""
+    id: int
+    parent: int
+    detail: str
+    children: list[PlanNode] = field(default_factory=list)
+
+    @property
+    def uses_index(self) -> bool:
+        # 本节点及其子节点中是否用到了索引（含覆盖索引和主键）
+        if "USING" in self.detail and ("INDEX" in self.detail or "PRIMARY KEY" in self.detail):
+            return True
+        return any(child.uses_index for child in self.children)
+
+    @property
+    def has_full_scan(self) -> bool:
+        # 形如 SCAN bench，没有 USING 的才是全表扫描
+        if self.detail.startswith("SCAN") and "USING" not in self.detail:
+            return True
+        return any(child.has_full_scan for child in self.children)
+
+    def to_string(self, level: int = 0) -> str:
+        lines = [f"{'  ' * level}{self.detail}"]
+        for child in self.children:
+            lines.append(child.to_string(level + 1))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.to_string()
 
 
 class Sqlite3Worker(object):
@@ -30,11 +83,18 @@ class Sqlite3Worker(object):
             key: bytes = None,
             fix_time: int = None,
             fix_iv: bytes = None,
+            profile: str | PragmaProfile = None,
     ):
         self._db_name = db_name
         self._conn = sqlite3.connect(db_name)
         self._cursor = self._conn.cursor()
         self._is_closed = False
+        self._tx_depth = 0  # 当前事务嵌套层数，0 表示不在 transaction() 块中
+        self._stats: StatementStats | None = None
+        self._slow_threshold = 0.0
+        self._logger: Logger | None = None
+        self._progress_calls = 0
+        self._profile: PragmaProfile | None = None
         self._fernet = None
         if key is not None:
             fix_time = fix_time if fix_time is not None else int(time.time())
@@ -43,6 +103,8 @@ class Sqlite3Worker(object):
                 self._fernet = NotRandomFernet(key, fix_time, fix_iv)
             except ValueError:
                 pass
+        if profile is not None:
+            self.apply_profile(profile)
 
     def __del__(self):
         self.close()
@@ -57,14 +119,182 @@ class Sqlite3Worker(object):
             self._conn.close()
             self._is_closed = True
 
+    @property
+    def profile(self) -> PragmaProfile | None:
+        return self._profile
+
+    def pragma(self, name: str, value: str | int = None) -> str | int | None:
+        """读取或设置 PRAGMA，返回设置后的值"""
+        if not _RE_PRAGMA_WORD.match(name):
+            raise ValueError(f"Invalid pragma name: {name}")
+        if value is None:
+            statement = f"PRAGMA {name};"
+        else:
+            if not isinstance(value, int) and not _RE_PRAGMA_WORD.match(str(value)):
+                raise ValueError(f"Invalid pragma value: {value}")
+            statement = f"PRAGMA {name} = {value};"
+        rows = self._execute(statement, fetch=True)
+        if value is not None and len(rows) == 0:
+            # 有些 PRAGMA 设置后不返回值，再读一次
+            rows = self._execute(f"PRAGMA {name};", fetch=True)
+        return rows[0][0] if len(rows) != 0 else None
+
+    def apply_profile(self, profile: str | PragmaProfile) -> dict[str, str | int]:
+        """
+        切换调优方案，可选的名字见 PRAGMA_PROFILES，运行中也可以随时切换
+
+        :param profile: 方案名字或者 PragmaProfile 对象
+        :return: 各项设置后实际的值，例如内存数据库的 journal_mode 总是 memory
+        """
+        if isinstance(profile, str):
+            if profile not in PRAGMA_PROFILES:
+                raise ValueError(f"Unknown profile {profile}, must be one of {list(PRAGMA_PROFILES)}")
+            profile = PRAGMA_PROFILES[profile]
+        if self._conn.in_transaction:
+            raise ValueError("Cannot change pragma profile inside a transaction")
+
+        applied = {}
+        for name, value in profile.items():
+            applied[name] = self.pragma(name, value)
+        self._profile = profile
+        return applied
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._tx_depth > 0
+
+    @property
+    def lastrowid(self) -> int | None:
+        """最近一次 INSERT 插入的行的 rowid"""
+        return self._cursor.lastrowid
+
+    @property
+    def stats(self) -> StatementStats | None:
+        return self._stats
+
+    def enable_stats(self, slow_threshold: float = 0.1, logger: Logger = None):
+        """
+        开始统计每条语句的耗时、返回行数等信息
+
+        :param slow_threshold: 超过该秒数的语句会记录到 logger
+        :param logger: 为 None 则不记录慢语句
+        :return:
+        """
+        if self._stats is None:
+            self._stats = StatementStats()
+            self._conn.set_progress_handler(self._on_progress, PROGRESS_INTERVAL)
+        self._slow_threshold = slow_threshold
+        self._logger = logger
+
+    def disable_stats(self):
+        self._stats = None
+        self._logger = None
+        self._conn.set_progress_handler(None, PROGRESS_INTERVAL)
+
+    def _on_progress(self) -> int:
+        self._progress_calls += 1
+        return 0  # 返回非 0 会中断当前语句
+
+    def _record(self, statement: str, start: float, rows: int):
+        elapsed = time.perf_counter() - start
+        self._stats.record(statement, elapsed, rows, self._progress_calls * PROGRESS_INTERVAL)
+        if self._logger is not None and elapsed >= self._slow_threshold:
+            if len(statement) > SLOW_LOG_MAX_LEN:
+                statement = f"{statement[:SLOW_LOG_MAX_LEN]}..."
+            self._logger.warning(f"[SQL SLOW] {elapsed * 1000:.1f}ms, {rows} rows: {statement}")
+
     def commit(self):
-        self._conn.commit()
+        # 在 transaction() 块中时，由最外层负责统一提交
+        if self._tx_depth == 0:
+            if self._stats is None:
+                self._conn.commit()
+            else:
+                # 提交时的 fsync 往往才是写入的大头，也单独统计一下
+                start = time.perf_counter()
+                self._progress_calls = 0
+                self._conn.commit()
+                self._record("COMMIT;", start, 0)
+
+    def rollback(self):
+        if self._tx_depth == 0:
+            self._conn.rollback()
+
+    @contextmanager
+    def transaction(self, mode: TransactionMode = TransactionMode.DEFERRED):
+        """
+        在块内的所有写操作只在退出时提交一次，出现异常则全部回滚。
+        嵌套使用时内层变为 SAVEPOINT，内层出错只回滚内层的修改。
+
+        :param mode: 最外层事务的开始方式，嵌套时忽略
+        :return:
+        """
+        if self._tx_depth == 0:
+            # 之前可能有 commit=False 留下的隐式事务，直接并入即可
+            if not self._conn.in_transaction:
+                self._execute(f"BEGIN {mode.value};")
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                self._conn.rollback()
+                raise
+            else:
+                self._tx_depth -= 1
+                self.commit()
+        else:
+            savepoint = f"sp_{self._tx_depth}"
+            self._execute(f"SAVEPOINT {savepoint};")
+            self._tx_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._tx_depth -= 1
+                self._execute(f"ROLLBACK TO {savepoint};")
+                self._execute(f"RELEASE {savepoint};")
+                raise
+            else:
+                self._tx_depth -= 1
+                self._execute(f"RELEASE {savepoint};")
 
-    def _execute(self, statement: str):
+    def _execute(self, statement: str, fetch: bool = False, params: list | tuple = ()) -> list[tuple]:
+        # SELECT 的大部分工作在取结果时才做，所以 fetch 也放在这里一起计时
+        start = time.perf_counter()
+        self._progress_calls = 0
         try:
-            self._cursor.execute(statement)
+            self._cursor.execute(statement, params)
+            rows = self._cursor.fetchall() if fetch else []
         except sqlite3.Error as e:
             raise sqlite3.Error(f"Error name: {e.sqlite_errorname};\nError statement: {statement}")
+        if self._stats is not None:
+            # 非 DML 语句的 rowcount 为 -1
+            self._record(statement, start, len(rows) if fetch else max(self._cursor.rowcount, 0))
+        return rows
+
+    def _executemany(self, statement: str, params: Iterable[list]):
+        start = time.perf_counter()
+        self._progress_calls = 0
+        try:
+            self._cursor.executemany(statement, params)
+        except sqlite3.Error as e:
+            raise sqlite3.Error(f"Error name: {e.sqlite_errorname};\nError statement: {statement}")
+        if self._stats is not None:
+            self._record(statement, start, max(self._cursor.rowcount, 0))
+
+    def _execute_parts(self, parts: Parts, fetch: bool = False) -> list[tuple]:
+        # 值都通过参数绑定，只是值不同的语句可以复用 SQLite 已经准备好的语句
+        sql, params = compile_parts(parts)
+        if len(params) > MAX_BIND_PARAMS:
+            return self._execute(render_parts(parts), fetch)
+        return self._execute(sql, fetch, bind_params(params, {}))
+
+    def execute_template(self, template: QueryTemplate, params: list) -> list[list] | int:
+        rows = self._execute(template.statement, template.fetch, params)
+        if template.fetch:
+            return self._decrypt_rows(template.columns, rows)
+        if template.commit:
+            self.commit()
+        return max(self._cursor.rowcount, 0)
 
     @staticmethod
     def _check_data_type(data_type: DataType, allow_null: bool, value: GeneralValueTypes) -> bool:
@@ -165,11 +395,181 @@ class Sqlite3Worker(object):
             self._execute(statement)
         return statement
 
+    def create_index(self, table_name: str, index: Index,
+                     if_not_exists: bool = False, schema_name: str = "",
+                     *, execute: bool = True) -> str:
+        if index.name.startswith("sqlite_"):
+            raise ValueError("Index name must not start with 'sqlite_')")
+
+        head = "CREATE UNIQUE INDEX" if index.unique else "CREATE INDEX"
+        if if_not_exists:
+            head = f"{head} IF NOT EXISTS"
+        name = index.name
+        if len(schema_name) != 0:
+            name = f"{schema_name}.{name}"
+
+        body = f"{head} {name} ON {table_name} ({self._columns_to_string(index.columns)})"
+        if index.where is not None:
+            body = f"{body} WHERE {index.where}"
+
+        statement = f"{body};"
+        if execute:
+            self._execute(statement)
+        return statement
+
+    def drop_index(self, index_name: str, if_exists: bool = False,
+                   schema_name: str = "", *, execute: bool = True) -> str:
+        head = "DROP INDEX"
+        if if_exists:
+            head = f"{head} IF EXISTS"
+        name = index_name
+        if len(schema_name) != 0:
+            name = f"{schema_name}.{name}"
+
+        statement = f"{head} {name};"
+
+        if execute:
+            self._execute(statement)
+        return statement
+
+    def create_fts_table(self, fts: FtsTable, if_not_exists: bool = False,
+                         *, execute: bool = True) -> str:
+        """
+        创建 FTS5 虚拟表，外部内容表还会创建同步用的触发器。
+        内容表中已有的数据不会自动建立索引，需要再调用一次 rebuild_fts
+
+        :return: 所有语句，以换行分隔
+        """
+        if fts.name.startswith("sqlite_"):
+            raise ValueError("Table name must not start with 'sqlite_')")
+
+        names = fts.column_names
+        args = [*names, f"tokenize = {to_string(fts.tokenize)}"]
+        if len(fts.prefix) != 0:
+            args.append(f"prefix = '{' '.join([str(p) for p in fts.prefix])}'")
+        if len(fts.content_table) != 0:
+            args.extend([f"content = {to_string(fts.content_table)}",
+                         f"content_rowid = {to_string(fts.content_rowid)}"])
+
+        head = "CREATE VIRTUAL TABLE"
+        if if_not_exists:
+            head = f"{head} IF NOT EXISTS"
+        statements = [f"{head} {fts.name} USING fts5({', '.join(args)});"]
+
+        if len(fts.content_table) != 0:
+            cols = ", ".join(names)
+            new_values = ", ".join([f"new.{name}" for name in names])
+            old_values = ", ".join([f"old.{name}" for name in names])
+            delete_old = (f"INSERT INTO {fts.name}({fts.name}, rowid, {cols}) "
+                          f"VALUES ('delete', old.{fts.content_rowid}, {old_values});")
+            insert_new = (f"INSERT INTO {fts.name}(rowid, {cols}) "
+                          f"VALUES (new.{fts.content_rowid}, {new_values});")
+            # 只有被索引的列或者 rowid 变化时才需要更新索引
+            watched = names if fts.content_rowid == "rowid" else [*names, fts.content_rowid]
+            trigger = "CREATE TRIGGER IF NOT EXISTS" if if_not_exists else "CREATE TRIGGER"
+            ai, ad, au = fts.trigger_names
+            statements.extend([
+                f"{trigger} {ai} AFTER INSERT ON {fts.content_table} BEGIN {insert_new} END;",
+                f"{trigger} {ad} AFTER DELETE ON {fts.content_table} BEGIN {delete_old} END;",
+                f"{trigger} {au} AFTER UPDATE OF {', '.join(watched)} ON {fts.content_table} "
+                f"BEGIN {delete_old} {insert_new} END;",
+            ])
+
+        if execute:
+            with self.transaction():
+                for statement in statements:
+                    self._execute(statement)
+        return "\n".join(statements)
+
+    def drop_fts_table(self, fts: FtsTable, if_exists: bool = False,
+                       *, execute: bool = True) -> str:
+        head = "DROP TRIGGER IF EXISTS" if if_exists else "DROP TRIGGER"
+        statements = []
+        if len(fts.content_table) != 0:
+            statements.extend([f"{head} {name};" for name in fts.trigger_names])
+        statements.append(self.drop_table(fts.name, if_exists, execute=False))
+
+        if execute:
+            with self.transaction():
+                for statement in statements:
+                    self._execute(statement)
+        return "\n".join(statements)
+
+    def rebuild_fts(self, fts: FtsTable | str, *, commit: bool = True) -> str:
+        """按内容表重建整个索引，用于刚创建外部内容表或者索引与内容表不一致时"""
+        name = fts.name if isinstance(fts, FtsTable) else fts
+        statement = f"INSERT INTO {name}({name}) VALUES ('rebuild');"
+        self._execute(statement)
+        if commit:
+            self.commit()
+        return statement
+
+    def optimize_fts(self, fts: FtsTable | str, *, commit: bool = True) -> str:
+        """把索引的各个段合并为一个，大量写入之后执行可以加快查询"""
+        name = fts.name if isinstance(fts, FtsTable) else fts
+        statement = f"INSERT INTO {name}({name}) VALUES ('optimize');"
+        self._execute(statement)
+        if commit:
+            self.commit()
+        return statement
+
+    def fts_search(self, fts: FtsTable, query: str | Param, columns: list[Column | str] = None,
+                   weights: list[float] = None, where: Expression = None,
+                   limit: int = None, offset: int = None,
+                   *, execute: bool = True) -> tuple[str, list[list]]:
+        """
+        全文搜索，结果按相关度排序
+
+        :param fts: FTS 表
+        :param query: MATCH 查询，用户输入的文本应该先经过 fts_query 处理
+        :param columns: 要返回的列，可以包括 bm25()、snippet() 的结果，默认为 rowid 和所有被索引的列
+        :param weights: 各列的 bm25 权重，不给则都为 1.0
+        :param where: 额外的条件
+        :return: 同 select
+        """
+        if columns is None:
+            columns = ["rowid", *fts.column_names]
+        cond = Operand(fts.name).match(query)
+        if where is not None:
+            cond = cond.and_(where)
+        # rank 默认就是 bm25()，可以直接使用 FTS5 内部的排序优化
+        order_by = "rank" if not weights else bm25(fts, *weights)
+        return self.select(fts.name, columns, where=cond, order_by=order_by,
+                           limit=limit, offset=offset, execute=execute)
+
     def show_tables(self) -> list[str]:
         cond = Operand("type").equal_to("table").and_(Operand("name").like("sqlite_%", not_=True))
         _, tables = self.select("sqlite_schema", ["name"], where=cond)
         return [table[0] for table in tables]
 
+    def show_indexes(self, table_name: str = "") -> list[str]:
+        # 不包括 PRIMARY KEY 和 UNIQUE 自动创建的 sqlite_autoindex_*
+        cond = Operand("type").equal_to("index").and_(Operand("name").like("sqlite_%", not_=True))
+        if len(table_name) != 0:
+            cond = cond.and_(Operand("tbl_name").equal_to(table_name))
+        _, indexes = self.select("sqlite_schema", ["name"], where=cond)
+        return [index[0] for index in indexes]
+
+    def explain(self, statement: str) -> list[PlanNode]:
+        """
+        获取语句的 EXPLAIN QUERY PLAN 结果，整理成树
+
+        :param statement: 完整的 SQL 语句，可以用各方法 execute=False 时返回的语句
+        :return: 顶层节点列表
+        """
+        plan = self._execute(f"EXPLAIN QUERY PLAN {statement}", fetch=True)
+        nodes: dict[int, PlanNode] = {}
+        roots: list[PlanNode] = []
+        # 父节点总是先于子节点出现
+        for id_, parent, _, detail in plan:
+            node = PlanNode(id_, parent, detail)
+            nodes[id_] = node
+            if parent in nodes:
+                nodes[parent].children.append(node)
+            else:
+                roots.append(node)
+        return roots
+
     @staticmethod
     def _columns_to_string(columns: list[Column | str]) -> str:
         columns_str_ls = []
@@ -182,26 +582,27 @@ class Sqlite3Worker(object):
                 raise ValueError(f"Column must be str or Column object, found {type(column)}")
         return ", ".join(columns_str_ls)
 
+    def _convert_row(self, columns: list[Column | str], value_row: list[GeneralValueTypes]) -> list[GeneralValueTypes]:
+        if len(value_row) != len(columns):
+            raise ValueError(f"Length of values must be {len(columns)}")
+
+        converted = []
+        for column, value in zip(columns, value_row):
+            if isinstance(column, Column):
+                if not self._check_data_type(column.data_type, column.nullable, value):
+                    raise ValueError(f"Type of {column.name} must be {column.data_type}, found {type(value)}")
+                value = self._try_encrypt(column, implicitly_convert(column.data_type, value))
+            converted.append(value)
+        return converted
+
     def insert_into(self, table_name: str, columns: list[Column | str],
                     values: list[list[GeneralValueTypes]],
                     *, execute: bool = True, commit: bool = True) -> str:
-        col_count = len(columns)
         columns_str = self._columns_to_string(columns)
 
         values_str_ls = []
         for value_row in values:
-            if len(value_row) != col_count:
-                raise ValueError(f"Length of values must be {col_count}")
-
-            value_row_str_ls = []
-            for column, value in zip(columns, value_row):
-                if isinstance(column, Column):
-                    if not self._check_data_type(column.data_type, column.nullable, value):
-                        raise ValueError(f"Type of {column.name} must be {column.data_type}, found {type(value)}")
-                    value = self._try_encrypt(column, implicitly_convert(column.data_type, value))
-
-                value_row_str_ls.append(to_string(value))
-
+            value_row_str_ls = [to_string(value) for value in self._convert_row(columns, value_row)]
             values_str_ls.append(f"({', '.join(value_row_str_ls)})")
 
         values_str = ", ".join(values_str_ls)
@@ -211,30 +612,145 @@ class Sqlite3Worker(object):
         if execute:
             self._execute(statement)
             if commit:
-                self._conn.commit()
+                self.commit()
+        return statement
+
+    def insert_many(self, table_name: str, columns: list[Column | str],
+                    rows: Iterable[list[GeneralValueTypes]],
+                    *, commit: bool = True) -> int:
+        """
+        参数同 insert_into，但 rows 可以是生成器，逐行绑定执行，不用先拼出一整条语句
+
+        :return: 插入的行数
+        """
+        placeholders = ", ".join(["?"] * len(columns))
+        statement = f"INSERT INTO {table_name} ({self._columns_to_string(columns)}) VALUES ({placeholders});"
+
+        params = ([to_param(v) for v in self._convert_row(columns, row)] for row in rows)
+        self._executemany(statement, params)
+        if commit:
+            self.commit()
+        return max(self._cursor.rowcount, 0)
+
+    def _on_conflict_clause(self, table_name: str, columns: list[Column | str],
+                            conflict_target: list[Column | str] | None,
+                            update_columns: list[Column | str | tuple[Column | str, str]] | None,
+                            do_nothing: bool, only_changed: bool) -> str:
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            raise ValueError("SQLite under 3.24.0 does not support upsert")
+
+        target = ""
+        if conflict_target is not None and len(conflict_target) != 0:
+            target = f" ({self._columns_to_string(conflict_target)})"
+        if do_nothing:
+            return f"ON CONFLICT{target} DO NOTHING"
+        if len(target) == 0:
+            raise ValueError("DO UPDATE requires conflict target")
+
+        if update_columns is None:
+            # 默认更新冲突目标之外的所有列
+            target_names = self._columns_to_string(conflict_target).split(", ")
+            update_columns = [c for c in columns
+                              if (c.name if isinstance(c, Column) else c) not in target_names]
+        if len(update_columns) == 0:
+            raise ValueError("No column to update, use do_nothing instead")
+
+        sets = []
+        changed = []
+        for item in update_columns:
+            if isinstance(item, tuple):
+                # (列, 表达式)，表达式中可以用 excluded() 引用要插入的值
+                column, expr = item
+                name = self._columns_to_string([column])
+                sets.append(f"{name} = {expr}")
+            else:
+                name = self._columns_to_string([item])
+                sets.append(f"{name} = {excluded(name)}")
+                changed.append(f"{table_name}.{name} IS NOT {excluded(name)}")
+
+        clause = f"ON CONFLICT{target} DO UPDATE SET {', '.join(sets)}"
+        # 值都没变的行就不写了，重新同步时只有真正变化的行会被改动
+        if only_changed and len(changed) == len(sets):
+            clause = f"{clause} WHERE {' OR '.join(changed)}"
+        return clause
+
+    def upsert(self, table_name: str, columns: list[Column | str],
+               values: list[list[GeneralValueTypes]],
+               conflict_target: list[Column | str] = None,
+               update_columns: list[Column | str | tuple[Column | str, str]] = None,
+               do_nothing: bool = False, only_changed: bool = True,
+               *, execute: bool = True, commit: bool = True) -> str:
+        """
+        INSERT ... ON CONFLICT，已存在的行改为更新或者忽略
+
+        :param conflict_target: 冲突判断的列，须有 PRIMARY KEY 或 UNIQUE 约束；do_nothing 时可为空
+        :param update_columns: 冲突时更新的列，元素也可以是 (列, 表达式)；为 None 则更新冲突目标之外的所有列
+        :param do_nothing: 冲突时忽略
+        :param only_changed: 只更新值有变化的行
+        """
+        clause = self._on_conflict_clause(table_name, columns, conflict_target,
+                                          update_columns, do_nothing, only_changed)
+        statement = self.insert_into(table_name, columns, values, execute=False)
+        statement = f"{statement[:-1]} {clause};"
+        if execute:
+            self._execute(statement)
+            if commit:
+                self.commit()
         return statement
 
+    def upsert_many(self, table_name: str, columns: list[Column | str],
+                    rows: Iterable[list[GeneralValueTypes]],
+                    conflict_target: list[Column | str] = None,
+                    update_columns: list[Column | str | tuple[Column | str, str]] = None,
+                    do_nothing: bool = False, only_changed: bool = True,
+                    *, commit: bool = True) -> int:
+        """
+        参数同 upsert，但 rows 可以是生成器，逐行绑定执行，不用先拼出一整条语句
+
+        :return: 实际插入或更新的行数
+        """
+        clause = self._on_conflict_clause(table_name, columns, conflict_target,
+                                          update_columns, do_nothing, only_changed)
+        placeholders = ", ".join(["?"] * len(columns))
+        statement = f"INSERT INTO {table_name} ({self._columns_to_string(columns)}) VALUES ({placeholders}) {clause};"
+
+        params = ([to_param(v) for v in self._convert_row(columns, row)] for row in rows)
+        self._executemany(statement, params)
+        if commit:
+            self.commit()
+        # executemany 的 rowcount 是每一行改动数之和，不含触发器（例如全文索引）改动的行
+        return max(self._cursor.rowcount, 0)
+
     @staticmethod
     def _join_where_order_limit(body: str,
                                 where: Expression, order_by: list[str] | str,
-                                limit: int, offset: int) -> str:
+                                limit: int, offset: int,
+                                group_by: list[Column | str] | Column | str = None,
+                                having: Expression = None) -> Parts:
+        parts: Parts = [body]
         if where is not None:
-            body = f"{body} WHERE {where}"
+            parts.extend([" WHERE ", *where.parts])
+        if group_by is not None:
+            if not isinstance(group_by, list):
+                group_by = [group_by]
+            parts.append(f" GROUP BY {Sqlite3Worker._columns_to_string(group_by)}")
+            if having is not None:
+                parts.extend([" HAVING ", *having.parts])
         if order_by is not None:
             if not isinstance(order_by, list):
                 order_by = [order_by]
-            body = f"{body} ORDER BY {', '.join(order_by)}"
+            parts.append(f" ORDER BY {', '.join(order_by)}")
         if limit is not None:
-            body = f"{body} LIMIT {limit}"
+            parts.extend([" LIMIT ", Value(limit)])
             if offset is not None:
-                body = f"{body} OFFSET {offset}"
-        return body
-
-    def select(self, table_name: str, columns: list[Column | str], distinct: bool = False,
-               where: Expression = None,
-               order_by: list[str] | str = None,
-               limit: int = None, offset: int = None,
-               *, execute: bool = True) -> tuple[str, list[list]]:
+                parts.extend([" OFFSET ", Value(offset)])
+        return parts
+
+    def _select_parts(self, table_name: str, columns: list[Column | str], distinct: bool,
+                      where: Expression, order_by: list[str] | str,
+                      limit: int, offset: int,
+                      group_by: list[Column | str] | Column | str = None,
+                      having: Expression = None) -> Parts:
         if len(columns) == 0:
             columns_str = "*"
         else:
@@ -244,51 +760,82 @@ class Sqlite3Worker(object):
         if distinct:
             head = f"{head} DISTINCT"
         body = f"{head} {columns_str} FROM {table_name}"
-        body = self._join_where_order_limit(body, where, order_by, limit, offset)
+        return [*self._join_where_order_limit(body, where, order_by, limit, offset, group_by, having), ";"]
+
+    def _decrypt_rows(self, columns: list[Column | str], rows: list[tuple]) -> list[list]:
+        rows = [list(row) for row in rows]  # 将每行转成列表，方便替换解密数据
+        # 下面的整个循环都是为了找到需要解密的数据尝试解密
+        for i in range(len(columns)):
+            column = columns[i]
+            if isinstance(column, Column) and column.secure:
+                for row in rows:
+                    # 如果是加密的 BLOB 但是值不为 NULL 才解密
+                    if row[i] is not None and self._fernet is not None:
+                        # 不管是key错误还是密文错误，都是 InvalidToken，貌似没法区分
+                        # 因此如果有的数据不是加密过的，应该跳过，不应该影响之后的密文解密，
+                        # 因此这里还是得继续循环下去
+                        try:
+                            row[i] = self._fernet.decrypt(row[i])
+                        except (InvalidToken, AttributeError):
+                            pass
+        return rows
 
-        statement = f"{body};"
+    def select(self, table_name: str, columns: list[Column | str], distinct: bool = False,
+               where: Expression = None,
+               order_by: list[str] | str = None,
+               limit: int = None, offset: int = None,
+               group_by: list[Column | str] | Column | str = None,
+               having: Expression = None,
+               *, execute: bool = True) -> tuple[str, list[list]]:
+        parts = self._select_parts(table_name, columns, distinct, where, order_by, limit, offset,
+                                   group_by, having)
+        statement = render_parts(parts)
         if execute:
-            self._execute(statement)
-            rows = self._cursor.fetchall()
-            rows = [list(row) for row in rows]  # 将每行转成列表，方便替换解密数据
-            # 下面的整个循环都是为了找到需要解密的数据尝试解密
-            for i in range(len(columns)):
-                column = columns[i]
-                if isinstance(column, Column) and column.secure:
-                    for row in rows:
-                        # 如果是加密的 BLOB 但是值不为 NULL 才解密
-                        if row[i] is not None and self._fernet is not None:
-                            # 不管是key错误还是密文错误，都是 InvalidToken，貌似没法区分
-                            # 因此如果有的数据不是加密过的，应该跳过，不应该影响之后的密文解密，
-                            # 因此这里还是得继续循环下去
-                            try:
-                                row[i] = self._fernet.decrypt(row[i])
-                            except (InvalidToken, AttributeError):
-                                pass
-
-            return statement, rows
+            rows = self._execute_parts(parts, fetch=True)
+            return statement, self._decrypt_rows(columns, rows)
         else:
             return statement, []
 
-    def delete_from(self, table_name: str, where: Expression = None,
-                    *, execute: bool = True, commit: bool = True) -> str:
+    def prepare_select(self, table_name: str, columns: list[Column | str], distinct: bool = False,
+                       where: Expression = None,
+                       order_by: list[str] | str = None,
+                       limit: int | Param = None, offset: int | Param = None,
+                       group_by: list[Column | str] | Column | str = None,
+                       having: Expression = None) -> QueryTemplate:
+        """参数同 select，where、having、limit 和 offset 中可以用 Param 占位，执行时再绑定"""
+        parts = self._select_parts(table_name, columns, distinct, where, order_by, limit, offset,
+                                   group_by, having)
+        statement, params = compile_parts(parts)
+        return QueryTemplate(self, statement, params, columns, fetch=True)
+
+    def _delete_parts(self, table_name: str, where: Expression) -> Parts:
         head = "DELETE FROM"
-        body = f"{head} {table_name}"
+        parts: Parts = [f"{head} {table_name}"]
         if where is not None:
-            body = f"{body} WHERE {where}"
+            parts.extend([" WHERE ", *where.parts])
+        parts.append(";")
+        return parts
 
-        statement = f"{body};"
+    def delete_from(self, table_name: str, where: Expression = None,
+                    *, execute: bool = True, commit: bool = True) -> str:
+        parts = self._delete_parts(table_name, where)
+        statement = render_parts(parts)
         if execute:
-            self._execute(statement)
+            self._execute_parts(parts)
             if commit:
-                self._conn.commit()
+                self.commit()
         return statement
 
+    def prepare_delete(self, table_name: str, where: Expression = None,
+                       *, commit: bool = True) -> QueryTemplate:
+        statement, params = compile_parts(self._delete_parts(table_name, where))
+        return QueryTemplate(self, statement, params, commit=commit)
+
     def update(self, table_name: str, new_values: list[tuple[Column | str, GeneralValueTypes]],
                where: Expression = None,
                *, execute: bool = True, commit: bool = True) -> str:
-        new_values_str_ls = []
-        for column, value in new_values:
+        parts: Parts = [f"UPDATE {table_name} SET "]
+        for i, (column, value) in enumerate(new_values):
             if isinstance(column, Column):
                 if not self._check_data_type(column.data_type, column.nullable, value):
                     raise ValueError(f"Type of {column.name} must be {column.data_type}, found {type(value)}")
@@ -298,16 +845,17 @@ class Sqlite3Worker(object):
             else:
                 name = column
 
-            new_values_str_ls.append(f"{name} = {to_string(value)}")
+            if i > 0:
+                parts.append(", ")
+            parts.extend([f"{name} = ", Value(value)])
 
-        head = f"UPDATE {table_name}"
-        body = f"{head} SET {', '.join(new_values_str_ls)}"
         if where is not None:
-            body = f"{body} WHERE {where}"
+            parts.extend([" WHERE ", *where.parts])
+        parts.append(";")
 
-        statement = f"{body};"
+        statement = render_parts(parts)
         if execute:
-            self._execute(statement)
+            self._execute_parts(parts)
             if commit:
-                self._conn.commit()
+                self.commit()
         return statement
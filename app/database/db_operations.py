@@ -1,13 +1,18 @@
 # coding: utf8
+from concurrent.futures import Future
+from logging import Logger
 from pathlib import Path
 from dataclasses import dataclass
 from app.database.Sqlite3Helper import (
-    Sqlite3Worker, Column, DataType,
+    AsyncSqlite3Worker, Sqlite3Worker, Column, DataType,
     Operand, Table,
 )
+from app.common.logger import FakeLogger
 from app.chromy import get_browser_exec_path, get_browser_data_path
 from app.common.utils import SUPPORTED_BROWSERS
-from app.common.config import APP_DIR
+from app.common.config import APP_DIR, SENT_CACHE_FILE, cfg
+from app.database.inventory import InventoryStore
+from app.database.sent_store import SentExtStore
 
 
 @dataclass
@@ -25,41 +30,80 @@ U = UserDataTable()
 
 
 class DBManger(object):
+    """
+    所有数据库操作都在单独的线程中排队执行。
+    写操作直接返回 Future 不等待；读操作排在之前的写操作之后，所以总能读到最新数据
+    """
 
-    def __init__(self):
-        self.sqh = Sqlite3Worker(str(Path(APP_DIR) / "userdata.db"))
-        self.sqh.create_table(U.table, U.all, if_not_exists=True)
+    def __init__(self, logger: Logger = None):
+        self.logger = logger or FakeLogger()
+        self.sqh = AsyncSqlite3Worker(str(Path(APP_DIR) / "userdata.db"))
+        # 慢语句会输出到日志，也就显示在输出页里
+        self._write(self.sqh.submit("enable_stats", cfg.get(cfg.slow_query_ms) / 1000, logger))
+        self._write(self.sqh.submit("create_table", U.table, U.all, if_not_exists=True))
+        # 用户、插件和书签的清单与 userdata 在同一个数据库中，共用一个线程
+        self.inventory = InventoryStore(self.sqh, self.logger)
+        # 已经上传过的插件 ID，第一次运行时从以前的 JSON 文件导入
+        self.sent_store = SentExtStore(self.sqh, SENT_CACHE_FILE, self.logger)
 
-        # 如果数据库为空，则可能是第一次打开，就创建默认的表
-        _, results = self.sqh.select(U.table, U.all)
-        if len(results) == 0:
-            self.reset()
+        # 如果数据库为空，则可能是第一次打开，就创建默认的表。
+        # 检查也在数据库线程中进行，不用在这里等，之后的读操作排在它后面
+        self.reset(only_if_empty=True)
 
-    def reset(self):
-        self.sqh.delete_from(U.table)
-        values = []
-        for b in SUPPORTED_BROWSERS:
-            dp = get_browser_data_path(b)
-            if dp is None:
-                continue
+    def _log_error(self, future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error(f"[DATABASE] {future.exception()}")
 
-            ep = get_browser_exec_path(b)
-            values.append([b.capitalize(), b, ep, dp])
+    def _write(self, future: Future) -> Future:
+        future.add_done_callback(self._log_error)
+        return future
 
-        self.sqh.insert_into(U.table, [
-            U.name, U.type, U.exec_path, U.data_path
-        ], values)
+    def log_stats(self, n: int = 10) -> Future:
+        """把耗时最多的 n 条语句输出到日志，统计只在数据库线程中读写"""
+        def _log_stats(sqh: Sqlite3Worker):
+            if sqh.stats is None or len(sqh.stats) == 0:
+                self.logger.info("[SQL STATS] 还没有执行过语句")
+                return
+            self.logger.info(f"[SQL STATS] 共 {len(sqh.stats)} 种语句，总耗时最多的 {n} 种：\n{sqh.stats.summary(n)}")
+
+        return self._write(self.sqh.run(_log_stats))
+
+    def reset(self, only_if_empty: bool = False) -> Future:
+        def _reset(sqh: Sqlite3Worker):
+            # 删除和插入一起提交，中途出错也不会留下空表
+            with sqh.transaction():
+                if only_if_empty and len(sqh.select(U.table, [U.id], limit=1)[1]) != 0:
+                    return
+                # 查找浏览器路径也在数据库线程中进行
+                values = []
+                for b in SUPPORTED_BROWSERS:
+                    dp = get_browser_data_path(b)
+                    if dp is None:
+                        continue
 
-    def select_all(self):
-        _, results = self.sqh.select(U.table, [U.name, U.type, U.exec_path, U.data_path])
-        return results
+                    ep = get_browser_exec_path(b)
+                    values.append([b.capitalize(), b, ep, dp])
+                sqh.delete_from(U.table)
+                sqh.insert_into(U.table, [
+                    U.name, U.type, U.exec_path, U.data_path
+                ], values)
 
-    def insert_one(self, name: str, type_: str, exec_path: str, data_path: str):
-        self.sqh.insert_into(U.table, [
+        return self._write(self.sqh.run(_reset))
+
+    def select_all_async(self) -> Future:
+        return self.sqh.run(lambda sqh: sqh.select(U.table, [U.name, U.type, U.exec_path, U.data_path])[1])
+
+    def insert_one(self, name: str, type_: str, exec_path: str, data_path: str) -> Future:
+        return self._write(self.sqh.submit("insert_into", U.table, [
             U.name, U.type, U.exec_path, U.data_path
         ], [
             [name, type_, exec_path, data_path],
-        ])
+        ]))
+
+    def delete_one(self, name: str) -> Future:
+        self.inventory.forget_browser(name)
+        return self._write(self.sqh.submit("delete_from", U.table, where=Operand(U.name).equal_to(name)))
 
-    def delete_one(self, name: str):
-        self.sqh.delete_from(U.table, where=Operand(U.name).equal_to(name))
+    def close(self):
+        # 等排队中的写操作都完成
+        self.sqh.close()
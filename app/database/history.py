@@ -0,0 +1,211 @@
+# coding: utf8
+import time
+from collections.abc import Iterable
+from concurrent.futures import Future
+from dataclasses import dataclass
+from enum import Enum
+from logging import Logger
+from app.database.Sqlite3Helper import (
+    AsyncSqlite3Worker, Sqlite3Worker, Column, DataType,
+    Operand, Expression, Table, Index, order, SortOption,
+)
+from app.common.logger import FakeLogger
+
+# 上一个检查点之后累计的增量行数超过检查点行数的这个比例时，再保存一次完整状态。
+# 新检查点的行数不超过 旧检查点 + 增量 < (1 / 比例 + 1) * 增量，所以检查点的存储量也随变化量增长，
+# 重建状态时需要回放的增量也不会超过检查点的这个比例
+CHECKPOINT_RATIO = 0.5
+
+
+class ItemKind(Enum):
+    EXTENSION = "extension"
+    BOOKMARK = "bookmark"
+
+
+@dataclass
+class InvScansTable(Table):
+    table: str = "inv_scans"
+
+    id = Column("id", DataType.INTEGER, primary_key=True)
+    browser = Column("browser", DataType.TEXT, nullable=False)
+    time = Column("time", DataType.REAL, nullable=False)
+    checkpoint = Column("checkpoint", DataType.INTEGER, nullable=False, has_default=True, default=0)
+
+    idx_browser_time = Index("idx_inv_scans_browser_time", ["browser", "time"])
+
+
+@dataclass
+class InvHistoryTable(Table):
+    table: str = "inv_history"
+
+    # 每次扫描相对上一次的变化，只有变化的关联才有记录
+    scan = Column("scan", DataType.INTEGER, nullable=False)  # inv_scans.id
+    kind = Column("kind", DataType.TEXT, nullable=False)     # ItemKind
+    profile_id = Column("profile_id", DataType.TEXT, nullable=False)
+    item = Column("item", DataType.TEXT, nullable=False)     # 插件 ID 或书签网址
+    op = Column("op", DataType.INTEGER, nullable=False)      # 1 为新增，-1 为移除
+
+    idx_scan = Index("idx_inv_history_scan", ["scan"])
+    idx_item = Index("idx_inv_history_item", ["item"])
+
+
+@dataclass
+class InvCheckpointsTable(Table):
+    table: str = "inv_checkpoints"
+
+    # 检查点扫描之后的完整状态
+    scan = Column("scan", DataType.INTEGER, nullable=False)
+    kind = Column("kind", DataType.TEXT, nullable=False)
+    profile_id = Column("profile_id", DataType.TEXT, nullable=False)
+    item = Column("item", DataType.TEXT, nullable=False)
+
+    idx_scan = Index("idx_inv_checkpoints_scan", ["scan"])
+
+
+S = InvScansTable()
+H = InvHistoryTable()
+C = InvCheckpointsTable()
+
+
+def create_history_tables(sqh: Sqlite3Worker):
+    with sqh.transaction():
+        for t in (S, H, C):
+            sqh.create_table(t.table, t.all, if_not_exists=True)
+            for index in t.indexes:
+                sqh.create_index(t.table, index, if_not_exists=True)
+
+
+def _last_scan(sqh: Sqlite3Worker, where: Expression) -> int | None:
+    _, rows = sqh.select(S.table, [f"MAX({S.id.name})"], where=where)
+    return rows[0][0]
+
+
+def record_scan(sqh: Sqlite3Worker, browser: str, changes: list[list],
+                state: Iterable[list[str]]) -> int:
+    """
+    记录一次扫描，需要在同步清单的事务中调用。和上一次相比没有变化的扫描不记录
+
+    :param browser: userdata 表中的名称
+    :param changes: [[kind, profile_id, item, op]]，kind 为 ItemKind 的值
+    :param state: 扫描后的完整状态 [kind, profile_id, item]，只在需要保存检查点时才会被遍历
+    :return: 扫描的编号，没有记录时为上一次扫描的编号
+    """
+    of_browser = Operand(S.browser).equal_to(browser)
+    last_checkpoint = _last_scan(sqh, of_browser.and_(Operand(S.checkpoint).equal_to(1)))
+    if last_checkpoint is None:
+        # 第一次扫描，之前的状态未知，只能从完整状态开始
+        checkpoint = True
+    elif len(changes) == 0:
+        # 状态没变，查询某个时间点时用之前的扫描就可以了
+        return _last_scan(sqh, of_browser)
+    else:
+        _, rows = sqh.select(H.table, ["COUNT(*)"], where=_scans_between(browser, last_checkpoint))
+        delta_rows = rows[0][0] + len(changes)
+        _, rows = sqh.select(C.table, ["COUNT(*)"], where=Operand(C.scan).equal_to(last_checkpoint))
+        checkpoint = delta_rows > CHECKPOINT_RATIO * rows[0][0]
+
+    sqh.insert_into(S.table, [S.browser, S.time, S.checkpoint], [[browser, time.time(), int(checkpoint)]],
+                    commit=False)
+    scan = sqh.lastrowid
+    # 同一次扫描中不会有重复的行，直接插入，不用检查冲突
+    sqh.insert_many(H.table, [H.scan, H.kind, H.profile_id, H.item, H.op],
+                    ([scan, *change] for change in changes), commit=False)
+    if checkpoint:
+        sqh.insert_many(C.table, [C.scan, C.kind, C.profile_id, C.item],
+                        ([scan, *row] for row in state), commit=False)
+    return scan
+
+
+def _scans_between(browser: str, first: int, last: int = None) -> Expression:
+    # first < scan <= last，且属于该浏览器，没有 last 时不限上界
+    cond = Operand(S.browser).equal_to(browser).and_(Operand(S.id).greater_than(first))
+    if last is not None:
+        cond = cond.and_(Operand(S.id).less_equal(last))
+    return Expression([f"{H.scan.name} IN (SELECT {S.id.name} FROM {S.table} WHERE ", *cond.parts, ")"])
+
+
+def _state_at(sqh: Sqlite3Worker, browser: str, at: float) -> set[tuple[str, str, str]]:
+    of_browser = Operand(S.browser).equal_to(browser)
+    target = _last_scan(sqh, of_browser.and_(Operand(S.time).less_equal(at)))
+    if target is None:
+        return set()
+    checkpoint = _last_scan(sqh, of_browser.and_(Operand(S.checkpoint).equal_to(1)).and_(
+        Operand(S.id).less_equal(target)))
+    if checkpoint is None:
+        return set()
+
+    _, rows = sqh.select(C.table, [C.kind, C.profile_id, C.item], where=Operand(C.scan).equal_to(checkpoint))
+    state = {(kind, profile_id, item) for kind, profile_id, item in rows}
+    # 同一关联在多次扫描中的增删会互相抵消，只需要回放净变化
+    _, rows = sqh.select(H.table, [H.kind, H.profile_id, H.item, f"SUM({H.op.name})"],
+                         where=_scans_between(browser, checkpoint, target),
+                         group_by=[H.kind, H.profile_id, H.item])
+    for kind, profile_id, item, op in rows:
+        if op > 0:
+            state.add((kind, profile_id, item))
+        elif op < 0:
+            state.discard((kind, profile_id, item))
+    return state
+
+
+def _changes_between(sqh: Sqlite3Worker, browser: str, start: float, end: float) -> list[list]:
+    of_browser = Operand(S.browser).equal_to(browser)
+    first = _last_scan(sqh, of_browser.and_(Operand(S.time).less_equal(start)))
+    last = _last_scan(sqh, of_browser.and_(Operand(S.time).less_equal(end)))
+    if last is None:
+        return []
+    _, rows = sqh.select(H.table, [H.kind, H.profile_id, H.item, f"SUM({H.op.name})"],
+                         where=_scans_between(browser, first or 0, last),
+                         group_by=[H.kind, H.profile_id, H.item],
+                         having=Operand(f"SUM({H.op.name})").equal_to(0, not_=True),
+                         order_by=[H.kind.name, H.item.name, H.profile_id.name])
+    return rows
+
+
+class HistoryStore(object):
+    """
+    清单的历史，每次扫描只保存相对上一次的增删，没有变化的扫描不保存；
+    累计的增删达到完整状态的一定比例后才保存检查点，存储量随变化的多少增长，而不是随用户数和扫描次数增长
+    """
+
+    def __init__(self, sqh: AsyncSqlite3Worker, logger: Logger = None):
+        self.sqh = sqh
+        self.logger = logger or FakeLogger()
+        self.sqh.run(create_history_tables)
+
+    def state_at(self, browser: str, at: float) -> Future:
+        """
+        :param at: 时间戳，取这个时间之前最后一次扫描后的状态
+        :return: 结果为 {(kind, profile_id, item)}
+        """
+        return self.sqh.run(_state_at, browser, at)
+
+    def changes_between(self, browser: str, start: float, end: float) -> Future:
+        """
+        两个时间点之间的净变化，期间加了又删的不算
+
+        :return: 结果为 [[kind, profile_id, item, op]]，op 为 1 是新增，-1 是移除
+        """
+        return self.sqh.run(_changes_between, browser, start, end)
+
+    def timeline(self, item: str, browser: str = None) -> Future:
+        """
+        某个插件或书签在各用户中出现和消失的时间
+
+        :return: 结果为 [[time, browser, profile_id, op]]，按时间排序
+        """
+        cond = Operand(f"{H.table}.{H.item.name}").equal_to(item)
+        if browser is not None:
+            cond = cond.and_(Operand(f"{S.table}.{S.browser.name}").equal_to(browser))
+        return self.sqh.run(lambda sqh: sqh.select(
+            f"{H.table} JOIN {S.table} ON {H.table}.{H.scan.name} = {S.table}.{S.id.name}",
+            [f"{S.table}.{S.time.name}", f"{S.table}.{S.browser.name}", H.profile_id, H.op],
+            where=cond, order_by=[f"{S.table}.{S.id.name}", H.profile_id.name],
+        )[1])
+
+    def scans(self, browser: str) -> Future:
+        """结果为 [[id, time, checkpoint]]，从新到旧"""
+        return self.sqh.run(lambda sqh: sqh.select(
+            S.table, [S.id, S.time, S.checkpoint], where=Operand(S.browser).equal_to(browser),
+            order_by=order(S.id, SortOption.DESC),
+        )[1])
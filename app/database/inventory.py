@@ -0,0 +1,370 @@
+# coding: utf8
+from __future__ import annotations
+import sqlite3
+from concurrent.futures import Future
+from dataclasses import dataclass
+from logging import Logger
+from typing import TYPE_CHECKING
+from app.database.Sqlite3Helper import (
+    AsyncSqlite3Worker, Sqlite3Worker, Column, DataType,
+    Operand, Expression, Table, Index, Param, TransactionMode,
+    FtsTable, fts_query, fts_tokens, order, SortOption,
+)
+from app.common.logger import FakeLogger
+from app.database.history import HistoryStore, ItemKind, record_scan
+
+if TYPE_CHECKING:
+    from app.chromy import ChromInstance
+
+# trigram 能搜中文和网址中的片段，旧版本只能退回按词切分
+FTS_TOKENIZE = "trigram" if sqlite3.sqlite_version_info >= (3, 34, 0) else "unicode61"
+# trigram 查不到不足三个字的词（如 "广告"、"ub"），这样的词改用 LIKE 在内容表中逐行匹配
+FTS_MIN_TERM = 3 if FTS_TOKENIZE == "trigram" else 1
+# 同步时按键查编号，每条 IN 语句最多带多少个值，旧版本 SQLite 一条语句最多 999 个参数
+ID_LOOKUP_BATCH = 500
+
+
+@dataclass
+class InvProfilesTable(Table):
+    table: str = "inv_profiles"
+
+    id = Column("id", DataType.INTEGER, primary_key=True)
+    browser = Column("browser", DataType.TEXT, nullable=False)  # 即 userdata 表中的 name
+    profile_id = Column("profile_id", DataType.TEXT, nullable=False)
+    name = Column("name", DataType.TEXT)
+    user_name = Column("user_name", DataType.TEXT)
+    gaia_name = Column("gaia_name", DataType.TEXT)
+    profile_dir = Column("profile_dir", DataType.TEXT)
+
+    idx_browser_profile = Index("idx_inv_profiles_browser_profile", ["browser", "profile_id"], unique=True)
+
+
+@dataclass
+class InvExtensionsTable(Table):
+    table: str = "inv_extensions"
+
+    id = Column("id", DataType.INTEGER, primary_key=True)
+    ext_id = Column("ext_id", DataType.TEXT, nullable=False, unique=True)
+    name = Column("name", DataType.TEXT)
+    description = Column("description", DataType.TEXT)
+
+
+@dataclass
+class InvBookmarksTable(Table):
+    table: str = "inv_bookmarks"
+
+    id = Column("id", DataType.INTEGER, primary_key=True)
+    url = Column("url", DataType.TEXT, nullable=False, unique=True)
+    name = Column("name", DataType.TEXT)
+
+
+@dataclass
+class InvFoldersTable(Table):
+    table: str = "inv_folders"
+
+    id = Column("id", DataType.INTEGER, primary_key=True)
+    path = Column("path", DataType.TEXT, nullable=False, unique=True)  # 形如 /书签栏/工作
+
+
+@dataclass
+class InvProfileExtensionsTable(Table):
+    table: str = "inv_profile_extensions"
+
+    profile = Column("profile", DataType.INTEGER, nullable=False)      # inv_profiles.id
+    extension = Column("extension", DataType.INTEGER, nullable=False)  # inv_extensions.id
+
+    idx_profile_extension = Index("idx_inv_pe_profile_extension", ["profile", "extension"], unique=True)
+    # 按插件统计用户数
+    idx_extension = Index("idx_inv_pe_extension", ["extension"])
+
+
+@dataclass
+class InvProfileBookmarksTable(Table):
+    table: str = "inv_profile_bookmarks"
+
+    profile = Column("profile", DataType.INTEGER, nullable=False)    # inv_profiles.id
+    bookmark = Column("bookmark", DataType.INTEGER, nullable=False)  # inv_bookmarks.id
+    folder = Column("folder", DataType.INTEGER, nullable=False)      # inv_folders.id
+
+    idx_profile_bookmark = Index("idx_inv_pb_profile_bookmark", ["profile", "bookmark"], unique=True)
+    idx_bookmark = Index("idx_inv_pb_bookmark", ["bookmark"])
+    idx_folder = Index("idx_inv_pb_folder", ["folder"])
+
+
+P = InvProfilesTable()
+E = InvExtensionsTable()
+B = InvBookmarksTable()
+F = InvFoldersTable()
+PE = InvProfileExtensionsTable()
+PB = InvProfileBookmarksTable()
+
+# 外部内容表，文本只在 inv_bookmarks 和 inv_extensions 中存一份，由触发器同步索引
+BOOKMARKS_FTS = FtsTable("inv_bookmarks_fts", [B.name, B.url],
+                         content_table=B.table, content_rowid=B.id.name, tokenize=FTS_TOKENIZE)
+EXTENSIONS_FTS = FtsTable("inv_extensions_fts", [E.name, E.description],
+                          content_table=E.table, content_rowid=E.id.name, tokenize=FTS_TOKENIZE)
+
+
+@dataclass
+class InventorySnapshot(object):
+    """一次扫描的结果，只包含普通数据，可以安全地交给数据库线程"""
+    profiles: list[list[str]]             # [[profile_id, name, user_name, gaia_name, profile_dir]]
+    extensions: list[list[str]]           # [[ext_id, name, description]]
+    bookmarks: list[list[str]]            # [[url, name]]
+    profile_extensions: set[tuple[str, str]]       # {(profile_id, ext_id)}
+    profile_bookmarks: dict[tuple[str, str], str]  # {(profile_id, url): 书签路径}
+
+    @classmethod
+    def from_chrom_ins(cls, chrom_ins: ChromInstance) -> InventorySnapshot:
+        profiles = [[p.id, p.name, p.user_name, p.gaia_name, p.profile_dir]
+                    for p in chrom_ins.profiles.values()]
+        extensions = [[e.id, e.name, e.description] for e in chrom_ins.extensions.values()]
+        bookmarks = [[b.url, b.name] for b in chrom_ins.bookmarks.values()]
+        profile_extensions = {(profile_id, e.id)
+                              for e in chrom_ins.extensions.values() for profile_id in e.profiles}
+        profile_bookmarks = {(profile_id, b.url): path
+                             for b in chrom_ins.bookmarks.values() for profile_id, path in b.profiles.items()}
+        return cls(profiles, extensions, bookmarks, profile_extensions, profile_bookmarks)
+
+
+def _create_tables(sqh: Sqlite3Worker):
+    with sqh.transaction():
+        for t in (P, E, B, F, PE, PB):
+            sqh.create_table(t.table, t.all, if_not_exists=True)
+            for index in t.indexes:
+                sqh.create_index(t.table, index, if_not_exists=True)
+        sqh.create_fts_table(BOOKMARKS_FTS, if_not_exists=True)
+        sqh.create_fts_table(EXTENSIONS_FTS, if_not_exists=True)
+
+
+def _ids_of(sqh: Sqlite3Worker, table: str, key: Column, keys: set[str]) -> dict[str, int]:
+    # 分批用 IN 查，一条语句的参数个数有上限
+    ids = {}
+    keys = list(keys)
+    for i in range(0, len(keys), ID_LOOKUP_BATCH):
+        _, rows = sqh.select(table, ["id", key], where=Operand(key).in_(keys[i:i + ID_LOOKUP_BATCH]))
+        ids.update((k, id_) for id_, k in rows)
+    return ids
+
+
+def _sync(sqh: Sqlite3Worker, browser: str, snapshot: InventorySnapshot) -> dict[str, int]:
+    counts = {}
+    current = {row[0] for row in snapshot.profiles}
+    new_pe = {(p, e) for p, e in snapshot.profile_extensions if p in current}
+    new_pb = {(p, u): path for (p, u), path in snapshot.profile_bookmarks.items() if p in current}
+
+    # 整个同步是一个写事务，界面上的查询要么看到同步前的数据，要么看到同步后的数据
+    with sqh.transaction(TransactionMode.IMMEDIATE):
+        # 上一次同步的关联，按用户编号、插件编号和网址比较，这样变化也可以直接记入历史
+        of_browser = Operand(f"{P.table}.{P.browser.name}").equal_to(browser)
+        _, rows = sqh.select(f"{PE.table} JOIN {P.table} ON {PE.table}.profile = {P.table}.id "
+                             f"JOIN {E.table} ON {PE.table}.extension = {E.table}.id",
+                             [f"{P.table}.{P.profile_id.name}", E.ext_id], where=of_browser)
+        old_pe = {(p, e) for p, e in rows}
+        _, rows = sqh.select(f"{PB.table} JOIN {P.table} ON {PB.table}.profile = {P.table}.id "
+                             f"JOIN {B.table} ON {PB.table}.bookmark = {B.table}.id "
+                             f"JOIN {F.table} ON {PB.table}.folder = {F.table}.id",
+                             [f"{P.table}.{P.profile_id.name}", B.url, F.path], where=of_browser)
+        old_pb = {(p, u): path for p, u, path in rows}
+
+        # 元数据没有变化的行不会被改写，也就不会触发全文索引的更新
+        sqh.upsert_many(E.table, [E.ext_id, E.name, E.description], snapshot.extensions,
+                        conflict_target=[E.ext_id])
+        sqh.upsert_many(B.table, [B.url, B.name], snapshot.bookmarks, conflict_target=[B.url])
+        sqh.upsert_many(F.table, [F.path], ([p] for p in set(new_pb.values())), do_nothing=True)
+        sqh.upsert_many(P.table, [P.browser, P.profile_id, P.name, P.user_name, P.gaia_name, P.profile_dir],
+                        ([browser, *row] for row in snapshot.profiles),
+                        conflict_target=[P.browser, P.profile_id])
+
+        _, rows = sqh.select(P.table, [P.id, P.profile_id], where=Operand(P.browser).equal_to(browser))
+        profile_map = {profile_id: id_ for id_, profile_id in rows}
+
+        # 只查变化的关联用到的编号，不随所有浏览器的插件和书签总数增长
+        added_pe = new_pe - old_pe
+        removed_pe = old_pe - new_pe
+        moved_pb = {(p, u): path for (p, u), path in new_pb.items() if old_pb.get((p, u)) != path}
+        added_pb = new_pb.keys() - old_pb.keys()
+        removed_pb = old_pb.keys() - new_pb.keys()
+        ext_map = _ids_of(sqh, E.table, E.ext_id, {e for _, e in added_pe | removed_pe})
+        bmk_map = _ids_of(sqh, B.table, B.url, {u for _, u in moved_pb.keys() | removed_pb})
+        folder_map = _ids_of(sqh, F.table, F.path, set(moved_pb.values()))
+
+        # 插件关联，只写入和删除变化的部分
+        sqh.upsert_many(PE.table, [PE.profile, PE.extension],
+                        ([profile_map[p], ext_map[e]] for p, e in added_pe), do_nothing=True)
+        delete_pe = sqh.prepare_delete(PE.table, where=Operand(PE.profile).equal_to(Param("p")).and_(
+            Operand(PE.extension).equal_to(Param("e"))))
+        for p, e in removed_pe:
+            delete_pe.execute(p=profile_map[p], e=ext_map[e])
+        counts["added_extension_links"] = len(added_pe)
+        counts["removed_extension_links"] = len(removed_pe)
+
+        # 书签关联，路径变了的也要更新
+        changed_pb = [[profile_map[p], bmk_map[u], folder_map[path]] for (p, u), path in moved_pb.items()]
+        sqh.upsert_many(PB.table, [PB.profile, PB.bookmark, PB.folder], changed_pb,
+                        conflict_target=[PB.profile, PB.bookmark])
+        delete_pb = sqh.prepare_delete(PB.table, where=Operand(PB.profile).equal_to(Param("p")).and_(
+            Operand(PB.bookmark).equal_to(Param("b"))))
+        for p, u in removed_pb:
+            delete_pb.execute(p=profile_map[p], b=bmk_map[u])
+        counts["added_bookmark_links"] = len(added_pb)
+        counts["moved_bookmark_links"] = len(changed_pb) - len(added_pb)
+        counts["removed_bookmark_links"] = len(removed_pb)
+
+        # 已经不存在的用户，其关联在上面已经删掉了
+        removed = [id_ for profile_id, id_ in profile_map.items() if profile_id not in current]
+        if len(removed) != 0:
+            sqh.delete_from(P.table, where=Operand(P.id).in_(removed), commit=False)
+        counts["removed_profiles"] = len(removed)
+
+        ext_kind, bmk_kind = ItemKind.EXTENSION.value, ItemKind.BOOKMARK.value
+        changes = [
+            *[[ext_kind, p, e, 1] for p, e in added_pe],
+            *[[ext_kind, p, e, -1] for p, e in removed_pe],
+            *[[bmk_kind, p, u, 1] for p, u in added_pb],
+            *[[bmk_kind, p, u, -1] for p, u in removed_pb],
+        ]
+        state = (row for row in [
+            *[[ext_kind, p, e] for p, e in new_pe],
+            *[[bmk_kind, p, u] for p, u in new_pb],
+        ])
+        counts["scan"] = record_scan(sqh, browser, changes, state)
+
+        # 不再被任何用户引用的插件、书签和目录
+        sqh.delete_from(E.table, where=Expression(
+            f"SELECT 1 FROM {PE.table} WHERE {PE.table}.extension = {E.table}.id").exists(not_=True))
+        sqh.delete_from(B.table, where=Expression(
+            f"SELECT 1 FROM {PB.table} WHERE {PB.table}.bookmark = {B.table}.id").exists(not_=True))
+        sqh.delete_from(F.table, where=Expression(
+            f"SELECT 1 FROM {PB.table} WHERE {PB.table}.folder = {F.table}.id").exists(not_=True))
+    return counts
+
+
+def _split_terms(text: str) -> tuple[str, list[str]]:
+    """:return: 能走全文索引的 MATCH 查询，和只能逐行匹配的短词"""
+    tokens = fts_tokens(text)
+    query = fts_query(" ".join(t for t in tokens if len(t) >= FTS_MIN_TERM))
+    return query, [t for t in tokens if len(t) < FTS_MIN_TERM]
+
+
+def _contains_all(columns: list[Column], terms: list[str]) -> Expression:
+    # 每个词都要出现在其中一列中，LIKE 和 trigram 一样不区分 ASCII 字母的大小写
+    cond = None
+    for term in terms:
+        # 词是按 \w 切出来的，其中可能有 _，要转义
+        pattern = "%" + term.replace("\\", "\\\\").replace("_", "\\_") + "%"
+        any_column = None
+        for column in columns:
+            like = Operand(column).like(pattern, escape="\\")
+            any_column = like if any_column is None else any_column.or_(like)
+        any_column = Expression(["(", *any_column.parts, ")"])
+        cond = any_column if cond is None else cond.and_(any_column)
+    return cond
+
+
+def _browser_profiles(browser: str) -> Expression:
+    # 限定在某个浏览器的用户中，用在关联表的 profile 列上
+    cond = Operand(P.browser).equal_to(browser)
+    return Expression([f"profile IN (SELECT {P.id.name} FROM {P.table} WHERE ", *cond.parts, ")"])
+
+
+class InventoryStore(object):
+    """
+    把各浏览器的用户、插件和书签按关系拆开保存，每次扫描之后增量同步，
+    统计和搜索都在数据库线程中用 SQL 完成，不用再遍历内存中的字典
+    """
+
+    def __init__(self, sqh: AsyncSqlite3Worker, logger: Logger = None):
+        self.sqh = sqh
+        self.logger = logger or FakeLogger()
+        # 每次同步的变化都记入历史
+        self.history = HistoryStore(sqh, self.logger)
+        self.sqh.run(_create_tables)
+
+    def _log_error(self, future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error(f"[DATABASE] {future.exception()}")
+
+    def sync(self, browser: str, chrom_ins: ChromInstance) -> Future:
+        """
+        :param browser: userdata 表中的名称
+        :param chrom_ins: 已经读取完数据的实例，快照在调用线程中生成
+        :return: 结果为各类变化的数量
+        """
+        snapshot = InventorySnapshot.from_chrom_ins(chrom_ins)
+        future = self.sqh.run(_sync, browser, snapshot)
+        future.add_done_callback(self._log_error)
+        return future
+
+    def forget_browser(self, browser: str) -> Future:
+        # 相当于同步一次空的扫描结果，所有关联的移除也会记入历史
+        future = self.sqh.run(_sync, browser, InventorySnapshot([], [], [], set(), {}))
+        future.add_done_callback(self._log_error)
+        return future
+
+    def extensions_in_profiles(self, min_profiles: int, browser: str = None) -> Future:
+        """
+        被超过 min_profiles 个用户安装的插件
+
+        :return: 结果为 [[ext_id, name, 用户数]]，按用户数从多到少
+        """
+        where = None if browser is None else _browser_profiles(browser)
+        return self.sqh.run(lambda sqh: sqh.select(
+            f"{PE.table} JOIN {E.table} ON {PE.table}.extension = {E.table}.id",
+            [E.ext_id, E.name, "COUNT(*)"], where=where,
+            group_by=f"{E.table}.id", having=Operand("COUNT(*)").greater_than(min_profiles),
+            order_by=order("COUNT(*)", SortOption.DESC),
+        )[1])
+
+    def profiles_with_extension(self, ext_id: str, browser: str = None) -> Future:
+        """结果为 [[browser, profile_id]]"""
+        cond = Operand(f"{E.table}.{E.ext_id.name}").equal_to(ext_id)
+        if browser is not None:
+            cond = cond.and_(Operand(f"{P.table}.{P.browser.name}").equal_to(browser))
+        return self.sqh.run(lambda sqh: sqh.select(
+            f"{PE.table} JOIN {E.table} ON {PE.table}.extension = {E.table}.id "
+            f"JOIN {P.table} ON {PE.table}.profile = {P.table}.id",
+            [f"{P.table}.{P.browser.name}", f"{P.table}.{P.profile_id.name}"], where=cond,
+        )[1])
+
+    def search_bookmarks(self, text: str, browser: str = None, limit: int = 100) -> Future:
+        """
+        全文搜索书签的名称和网址，结果为 [[url, name]]，按相关度排序。
+        只有短词时逐行匹配，按名称排序
+        """
+        query, short = _split_terms(text)
+        if len(query) == 0 and len(short) == 0:
+            return self._done([])
+        where = _contains_all([B.name, B.url], short)
+        if browser is not None:
+            in_browser = Expression([f"rowid IN (SELECT bookmark FROM {PB.table} WHERE ",
+                                     *_browser_profiles(browser).parts, ")"])
+            where = in_browser if where is None else where.and_(in_browser)
+        if len(query) == 0:
+            return self.sqh.run(lambda sqh: sqh.select(B.table, [B.url, B.name], where=where,
+                                                       order_by=B.name.name, limit=limit)[1])
+        return self.sqh.run(lambda sqh: sqh.fts_search(BOOKMARKS_FTS, query, [B.url, B.name],
+                                                       where=where, limit=limit)[1])
+
+    def search_extensions(self, text: str, limit: int = 100) -> Future:
+        """
+        全文搜索插件的名称和描述，结果为 [[ext_id, name]]，按相关度排序，名称的权重更高。
+        只有短词时逐行匹配，按名称排序
+        """
+        query, short = _split_terms(text)
+        if len(query) == 0 and len(short) == 0:
+            return self._done([])
+        where = _contains_all([E.name, E.description], short)
+        if len(query) == 0:
+            return self.sqh.run(lambda sqh: sqh.select(E.table, [E.ext_id, E.name], where=where,
+                                                       order_by=E.name.name, limit=limit)[1])
+        return self.sqh.run(lambda sqh: sqh.fts_search(
+            EXTENSIONS_FTS, query,
+            [f"(SELECT {E.ext_id.name} FROM {E.table} WHERE {E.table}.id = {EXTENSIONS_FTS.name}.rowid)", E.name],
+            weights=[10.0, 1.0], where=where, limit=limit)[1])
+
+    @staticmethod
+    def _done(result) -> Future:
+        future = Future()
+        future.set_result(result)
+        return future
@@ -0,0 +1,161 @@
+# coding: utf8
+import json
+import time
+from collections.abc import Iterable
+from concurrent.futures import Future
+from dataclasses import dataclass
+from logging import Logger
+from pathlib import Path
+from app.database.Sqlite3Helper import (
+    AsyncSqlite3Worker, Sqlite3Worker, Column, DataType, Table, Operand,
+)
+from app.common.logger import FakeLogger
+
+
+@dataclass
+class SentExtensionsTable(Table):
+    table: str = "sent_extensions"
+
+    ext_id = Column("ext_id", DataType.TEXT, primary_key=True)
+    sent_at = Column("sent_at", DataType.REAL, nullable=False)
+
+
+@dataclass
+class UploadQueueTable(Table):
+    table: str = "upload_queue"
+
+    # 等待上传的插件，确认收到后移到 sent_extensions，重启后从这里继续
+    ext_id = Column("ext_id", DataType.TEXT, primary_key=True)
+    name = Column("name", DataType.TEXT)
+    queued_at = Column("queued_at", DataType.REAL, nullable=False)
+
+
+SE = SentExtensionsTable()
+UQ = UploadQueueTable()
+
+
+class SentExtStore(object):
+    """
+    已经上传过的插件 ID。内存中是一个集合，判断是否上传过是 O(1) 的；
+    每次服务器确认收到后立即写入数据库，程序中途崩溃也不会丢失。
+
+    要上传的插件先记入上传队列，确认收到后再移出，退出或者崩溃后下次启动可以继续上传；
+    正在上传的 ID 在内存中标记，避免重复上传，上传失败就取消标记，下次刷新时重新上传
+    """
+
+    def __init__(self, sqh: AsyncSqlite3Worker, legacy_file: str | Path = None, logger: Logger = None):
+        self.sqh = sqh
+        self.logger = logger or FakeLogger()
+        self.confirmed: set[str] = set()
+        self.pending: set[str] = set()
+        # 上次没有传完的，[[ext_id, name]]
+        self.unfinished: list[list[str]] = []
+        # 读完之前不知道哪些上传过，不能调用 filter_unsent 和 in
+        self.loaded = False
+
+        # 建表、导入和读取在同一个任务中，不堵塞界面，读完后在界面线程中调用 apply_loaded
+        legacy_file = None if legacy_file is None else Path(legacy_file)
+        self.loading: Future = self.sqh.run(self._load, legacy_file)
+        self.loading.add_done_callback(self._log_error)
+
+    def _load(self, sqh: Sqlite3Worker, legacy_file: Path | None) -> tuple[set[str], list[list[str]]]:
+        sqh.create_table(SE.table, SE.all, if_not_exists=True)
+        sqh.create_table(UQ.table, UQ.all, if_not_exists=True)
+        if legacy_file is not None:
+            self._migrate(sqh, legacy_file)
+        _, rows = sqh.select(SE.table, [SE.ext_id])
+        _, unfinished = sqh.select(UQ.table, [UQ.ext_id, UQ.name])
+        return {row[0] for row in rows}, unfinished
+
+    def _migrate(self, sqh: Sqlite3Worker, legacy_file: Path):
+        # 以前的版本把 ID 列表存在 JSON 文件中，导入一次后改名，不再使用
+        try:
+            ext_ids: list[str] = json.loads(legacy_file.read_text(encoding="utf-8"))
+        except (json.JSONDecodeError, FileNotFoundError, UnicodeDecodeError):
+            return
+        now = time.time()
+        sqh.upsert_many(SE.table, [SE.ext_id, SE.sent_at], [[ext_id, now] for ext_id in set(ext_ids)], do_nothing=True)
+        legacy_file.replace(legacy_file.with_name(f"{legacy_file.name}.migrated"))
+        self.logger.info(f"[DATABASE] 已导入 {len(ext_ids)} 个已发送的插件 ID")
+
+    def apply_loaded(self, result: tuple[set[str], list[list[str]]]):
+        """loading 完成后在使用它的线程中调用，之后都以内存中的集合为准"""
+        if self.loaded:
+            # 读完之前已经清空了
+            return
+        confirmed, self.unfinished = result
+        self.confirmed.update(confirmed)
+        self.loaded = True
+
+    def _log_error(self, future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error(f"[DATABASE] {future.exception()}")
+
+    def _check_loaded(self):
+        if not self.loaded:
+            raise RuntimeError("已上传的插件 ID 还没有读完")
+
+    def __contains__(self, ext_id: str) -> bool:
+        self._check_loaded()
+        return ext_id in self.confirmed or ext_id in self.pending
+
+    def __len__(self) -> int:
+        return len(self.confirmed)
+
+    def filter_unsent(self, ext_ids: Iterable[str]) -> list[str]:
+        """既没有确认上传过，也没有正在上传的 ID"""
+        self._check_loaded()
+        return [ext_id for ext_id in ext_ids if ext_id not in self]
+
+    def mark_pending(self, ext_ids: Iterable[str]):
+        self.pending.update(ext_ids)
+
+    def enqueue(self, items: list[list[str]]) -> Future:
+        """
+        开始上传前调用，记入上传队列，程序退出或崩溃后可以从队列中继续
+
+        :param items: [[ext_id, name]]
+        """
+        self.mark_pending([item[0] for item in items])
+        now = time.time()
+        future = self.sqh.submit("upsert_many", UQ.table, [UQ.ext_id, UQ.name, UQ.queued_at],
+                                 [[ext_id, name, now] for ext_id, name in items], do_nothing=True)
+        future.add_done_callback(self._log_error)
+        return future
+
+    def confirm(self, ext_ids: Iterable[str]) -> Future:
+        """服务器确认收到后调用，写入已上传，并从上传队列中移除"""
+        ext_ids = set(ext_ids)
+        new_ids = ext_ids - self.confirmed
+        self.pending.difference_update(ext_ids)
+        self.confirmed.update(new_ids)
+        now = time.time()
+
+        def _confirm(sqh: Sqlite3Worker):
+            # 两步在同一个事务中，不会出现已经移出队列却没有记为已上传的情况
+            with sqh.transaction():
+                sqh.upsert_many(SE.table, [SE.ext_id, SE.sent_at],
+                                [[ext_id, now] for ext_id in new_ids], do_nothing=True)
+                sqh.delete_from(UQ.table, where=Operand(UQ.ext_id).in_(list(ext_ids)))
+
+        future = self.sqh.run(_confirm)
+        future.add_done_callback(self._log_error)
+        return future
+
+    def release(self, ext_ids: Iterable[str]):
+        """上传失败后调用，这些 ID 仍留在上传队列中，下次刷新或者启动时会重新上传"""
+        self.pending.difference_update(ext_ids)
+
+    def clear(self) -> Future:
+        self.confirmed.clear()
+        self.pending.clear()
+        self.unfinished = []
+        # 读取排在清空之前，读出来的已经过时，不再使用
+        self.loaded = True
+
+        def _clear(sqh: Sqlite3Worker):
+            with sqh.transaction():
+                sqh.delete_from(SE.table)
+                sqh.delete_from(UQ.table)
+
+        return self.sqh.run(_clear)
@@ -0,0 +1,81 @@
+# coding: utf8
+"""
+对比各个 PRAGMA 调优方案下的写入和读取耗时
+
+写入分两种：逐条提交（界面上零散的修改）和单个事务批量写入（重建缓存），
+读取为按主键随机查询（界面上的频繁查询）。用 --db 选择要测试的磁盘，例如：
+
+    python -m benchmarks.bench_pragma --db /mnt/hdd/bench.db --rows 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from app.database.Sqlite3Helper import (
+    Sqlite3Worker, Column, DataType, Operand, Param, PRAGMA_PROFILES,
+)
+
+
+ID = Column("id", DataType.INTEGER, primary_key=True)
+NAME = Column("name", DataType.TEXT)
+COLUMNS = [ID, NAME]
+
+
+def _remove_db(db_path: str):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+
+
+def bench_profile(db_path: str, profile: str, rows: int, commits: int, lookups: int) -> dict[str, float]:
+    _remove_db(db_path)
+    sqh = Sqlite3Worker(db_path, profile=profile)
+    sqh.create_table("bench", COLUMNS)
+    result = {}
+
+    start = time.perf_counter()
+    for i in range(commits):
+        sqh.insert_into("bench", COLUMNS, [[i, f"name {i}"]])
+    result["autocommit"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sqh.upsert_many("bench", COLUMNS, ([i, f"name {i}"] for i in range(commits, commits + rows)), do_nothing=True)
+    result["bulk"] = time.perf_counter() - start
+
+    template = sqh.prepare_select("bench", COLUMNS, where=Operand(ID).equal_to(Param("id")))
+    ids = [random.randrange(commits + rows) for _ in range(lookups)]
+    start = time.perf_counter()
+    for id_ in ids:
+        template.execute(id=id_)
+    result["lookup"] = time.perf_counter() - start
+
+    sqh.close()
+    _remove_db(db_path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="", help="数据库文件路径，放在要测试的磁盘上；默认使用临时目录")
+    parser.add_argument("--rows", type=int, default=100000, help="批量写入的行数")
+    parser.add_argument("--commits", type=int, default=200, help="逐条提交的次数")
+    parser.add_argument("--lookups", type=int, default=20000, help="随机查询的次数")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.gettempdir(), "sqh_bench_pragma.db")
+    random.seed(0)
+
+    print(f"database: {db_path}")
+    print(f"{'profile':<12}{'autocommit':>14}{'bulk':>14}{'lookup':>14}")
+    for name in PRAGMA_PROFILES:
+        r = bench_profile(db_path, name, args.rows, args.commits, args.lookups)
+        print(f"{name:<12}"
+              f"{args.commits / r['autocommit']:>10.0f} r/s"
+              f"{args.rows / r['bulk']:>10.0f} r/s"
+              f"{args.lookups / r['lookup']:>10.0f} q/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# coding: utf8
+"""
+Sqlite3Helper 的基准测试
+
+覆盖 insert_into、select、update、delete_from 在不同数据量下的耗时，
+加密列与不加密列、大列表的 in_，以及只拼接语句不执行的开销。
+结果以 JSON 输出，可以用 --compare 和之前版本的结果对比，例如：
+
+    python -m benchmarks.bench_sqlite3helper --sizes 1000 100000 --output new.json
+    python -m benchmarks.bench_sqlite3helper --sizes 1000 100000 --compare old.json
+
+results/sqlite3helper-2.3.0.json 是改动之前（2.3.0）用同样参数得到的结果
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.database.Sqlite3Helper import (
+    Sqlite3Worker, Column, DataType, Operand, Expression,
+    __version__ as sqh_version,
+)
+from app.database.Sqlite3Helper._crypto import generate_key_and_stuff
+
+# 逐条操作的次数，与数据量无关
+POINT_OPS = 1000
+IN_SIZES = (100, 1000, 10000)
+
+ID = Column("id", DataType.INTEGER, primary_key=True)
+NAME = Column("name", DataType.TEXT)
+SCORE = Column("score", DataType.REAL)
+DATA = Column("data", DataType.BLOB)
+SECURE_DATA = Column("data", DataType.BLOB, secure=True)
+
+
+def _columns(secure: bool) -> list[Column]:
+    return [ID, NAME, SCORE, SECURE_DATA if secure else DATA]
+
+
+def _row(i: int) -> list:
+    return [i, f"name {i}", i / 3, f"payload {i}"]
+
+
+@contextmanager
+def _transaction(sqh: Sqlite3Worker):
+    # 2.3.0 还没有 transaction()，用 commit=False 加最后一次 commit 代替，两个版本的结果可以直接对比
+    if hasattr(sqh, "transaction"):
+        with sqh.transaction():
+            yield
+    else:
+        yield
+        sqh.commit()
+
+
+def _remove_db(db_path: str):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+
+
+class Timer(object):
+
+    def __init__(self, results: list[dict], name: str, size: int, secure: bool, ops: int):
+        self.results = results
+        self.name = name
+        self.size = size
+        self.secure = secure
+        self.ops = ops
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            return False
+        seconds = time.perf_counter() - self.start
+        self.results.append({
+            "name": self.name,
+            "size": self.size,
+            "secure": self.secure,
+            "ops": self.ops,
+            "seconds": seconds,
+            "ops_per_sec": self.ops / seconds if seconds > 0 else None,
+        })
+        print(f"  {self.name:<24} size={self.size:<9} secure={self.secure!s:<5} "
+              f"{seconds:>9.4f}s", file=sys.stderr)
+        return False
+
+
+def bench_size(db_path: str, size: int, secure: bool, key_stuff: tuple | None,
+               batch: int, results: list[dict]):
+    _remove_db(db_path)
+    if secure:
+        key, fix_time, fix_iv = key_stuff
+        sqh = Sqlite3Worker(db_path, key, fix_time, fix_iv)
+    else:
+        sqh = Sqlite3Worker(db_path)
+    columns = _columns(secure)
+    sqh.create_table("bench", columns)
+    ids = [random.randrange(size) for _ in range(POINT_OPS)]
+
+    def timer(name: str, ops: int) -> Timer:
+        return Timer(results, name, size, secure, ops)
+
+    with timer("insert_into", size):
+        with _transaction(sqh):
+            for start in range(0, size, batch):
+                sqh.insert_into("bench", columns, [_row(i) for i in range(start, min(start + batch, size))],
+                                commit=False)
+
+    with timer("select_all", size):
+        sqh.select("bench", columns)
+
+    with timer("select_eq", POINT_OPS):
+        for id_ in ids:
+            sqh.select("bench", columns, where=Operand(ID).equal_to(id_))
+
+    if secure:
+        # 加密列的相等比较要先加密再比较
+        operand = Operand(SECURE_DATA, *key_stuff)
+        with timer("select_eq_secure", POINT_OPS):
+            for id_ in ids:
+                sqh.select("bench", columns, where=operand.equal_to(f"payload {id_}"))
+
+    for n in IN_SIZES:
+        values = [random.randrange(size) for _ in range(n)]
+        with timer(f"select_in_{n}", 1):
+            sqh.select("bench", columns, where=Operand(ID).in_(values))
+
+    with timer("update_eq", POINT_OPS):
+        with _transaction(sqh):
+            for id_ in ids:
+                sqh.update("bench", [(NAME, f"new {id_}")], where=Operand(ID).equal_to(id_), commit=False)
+
+    with timer("update_half", size // 2):
+        sqh.update("bench", [(SCORE, 0.0)], where=Expression("id % 2 = 0"))
+
+    with timer("delete_eq", POINT_OPS):
+        with _transaction(sqh):
+            for id_ in ids:
+                sqh.delete_from("bench", where=Operand(ID).equal_to(id_), commit=False)
+
+    with timer("delete_all", size):
+        sqh.delete_from("bench")
+
+    sqh.close()
+    _remove_db(db_path)
+
+
+def bench_build(key_stuff: tuple | None, secure: bool, batch: int, results: list[dict]):
+    # 只拼接语句，不执行，不需要真实的数据库
+    if secure:
+        sqh = Sqlite3Worker(":memory:", *key_stuff)
+    else:
+        sqh = Sqlite3Worker(":memory:")
+    columns = _columns(secure)
+    rows = [_row(i) for i in range(batch)]
+
+    with Timer(results, "build_insert_into", batch, secure, 1):
+        sqh.insert_into("bench", columns, rows, execute=False)
+
+    for n in IN_SIZES:
+        values = list(range(n))
+        with Timer(results, f"build_select_in_{n}", n, secure, 1):
+            sqh.select("bench", columns, where=Operand(ID).in_(values), execute=False)
+
+    with Timer(results, "build_select_eq", POINT_OPS, secure, POINT_OPS):
+        for i in range(POINT_OPS):
+            sqh.select("bench", columns, where=Operand(ID).equal_to(i).and_(Operand(NAME).like("a%")),
+                       execute=False)
+    sqh.close()
+
+
+def compare(old: dict, new: dict):
+    def key(r: dict) -> tuple:
+        return r["name"], r["size"], r["secure"]
+
+    old_map = {key(r): r for r in old["results"]}
+    print(f"{'name':<24}{'size':>10}{'secure':>8}{'old(s)':>12}{'new(s)':>12}{'speedup':>10}")
+    for r in new["results"]:
+        o = old_map.get(key(r))
+        if o is None:
+            continue
+        speedup = o["seconds"] / r["seconds"] if r["seconds"] > 0 else float("inf")
+        print(f"{r['name']:<24}{r['size']:>10}{r['secure']!s:>8}"
+              f"{o['seconds']:>12.4f}{r['seconds']:>12.4f}{speedup:>9.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="", help="数据库文件路径；默认使用临时目录")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000], help="数据量")
+    parser.add_argument("--batch", type=int, default=1000, help="每条 INSERT 语句的行数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-secure", action="store_true", help="跳过加密列的测试")
+    parser.add_argument("--output", default="", help="结果 JSON 的保存路径；默认输出到标准输出")
+    parser.add_argument("--compare", default="", help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    db_path = args.db or os.path.join(tempfile.gettempdir(), "sqh_bench.db")
+
+    key_stuff = None
+    notes = []
+    if not args.no_secure:
+        try:
+            key_stuff = generate_key_and_stuff()
+        except ModuleNotFoundError:
+            notes.append("cryptography is not installed, secure benchmarks skipped")
+    secure_options = [False] if key_stuff is None else [False, True]
+
+    results: list[dict] = []
+    for secure in secure_options:
+        bench_build(key_stuff, secure, args.batch, results)
+        for size in args.sizes:
+            bench_size(db_path, size, secure, key_stuff, args.batch, results)
+
+    report = {
+        "sqlite3helper_version": sqh_version,
+        "sqlite_version": sqlite3.sqlite_version,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "args": vars(args),
+        "notes": notes,
+        "results": results,
+    }
+
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=4), encoding="utf-8")
+    elif not args.compare:
+        print(json.dumps(report, ensure_ascii=False, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# coding: utf8
+"""
+对比逐条提交和 transaction() 批量提交的写入耗时
+
+每次提交都要 fsync 一次，机械硬盘和网络磁盘上差距尤其明显，
+用 --db 把数据库放到要测试的磁盘上即可，例如：
+
+    python -m benchmarks.bench_transaction --db /mnt/hdd/bench.db --rows 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from app.database.Sqlite3Helper import Sqlite3Worker, Column, DataType
+
+
+ID = Column("id", DataType.INTEGER, primary_key=True)
+NAME = Column("name", DataType.TEXT)
+COLUMNS = [ID, NAME]
+
+
+def _prepare(db_path: str) -> Sqlite3Worker:
+    Path(db_path).unlink(missing_ok=True)
+    sqh = Sqlite3Worker(db_path)
+    sqh.create_table("bench", COLUMNS)
+    return sqh
+
+
+def bench_autocommit(db_path: str, rows: int) -> float:
+    sqh = _prepare(db_path)
+    start = time.perf_counter()
+    for i in range(rows):
+        sqh.insert_into("bench", COLUMNS, [[i, f"name {i}"]])
+    elapsed = time.perf_counter() - start
+    sqh.close()
+    return elapsed
+
+
+def bench_transaction(db_path: str, rows: int) -> float:
+    sqh = _prepare(db_path)
+    start = time.perf_counter()
+    with sqh.transaction():
+        for i in range(rows):
+            sqh.insert_into("bench", COLUMNS, [[i, f"name {i}"]])
+    elapsed = time.perf_counter() - start
+    sqh.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="", help="数据库文件路径，放在要测试的磁盘上；默认使用临时目录")
+    parser.add_argument("--rows", type=int, default=1000, help="插入的行数")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.gettempdir(), "sqh_bench_transaction.db")
+
+    t_auto = bench_autocommit(db_path, args.rows)
+    t_tx = bench_transaction(db_path, args.rows)
+    Path(db_path).unlink(missing_ok=True)
+
+    print(f"database:    {db_path}")
+    print(f"rows:        {args.rows}")
+    print(f"autocommit:  {t_auto:.3f}s ({args.rows / t_auto:.0f} rows/s)")
+    print(f"transaction: {t_tx:.3f}s ({args.rows / t_tx:.0f} rows/s)")
+    print(f"speedup:     {t_auto / t_tx:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
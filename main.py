@@ -1,4 +1,5 @@
 import sys
+import locale
 import logging
 from PySide6.QtWidgets import QApplication
 from PySide6.QtCore import QLocale
@@ -10,6 +11,12 @@ from app.common.config import ORG_NAME, APP_NAME, ZH_APP_NAME, VERSION
 
 
 def main():
+    try:
+        # 表格按系统区域设置的规则排序
+        locale.setlocale(locale.LC_COLLATE, "")
+    except locale.Error:
+        pass
+
     app = QApplication(sys.argv)
     app.setOrganizationName(ORG_NAME)
     app.setApplicationName(APP_NAME)
@@ -0,0 +1,114 @@
+import gzip
+import json
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+# 不安装也能直接在仓库根目录运行
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@dataclass
+class RecordedRequest:
+    method: str
+    path: str
+    headers: dict[str, str]
+    body: bytes
+    time: float
+
+    def json(self):
+        body = self.body
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return json.loads(body)
+
+
+@dataclass
+class MockResponse:
+    status: int = 200
+    body: bytes | dict | list = b"[]"
+    headers: dict[str, str] = field(default_factory=dict)
+    delay: float = 0.0    # 发送响应前等待的秒数，用来模拟慢服务器和超时
+    gzip: bool = False    # 按 Accept-Encoding 压缩响应体
+
+
+class MockServer(object):
+    """在本地端口上运行的 HTTP 服务器，按 responder 返回响应，并记录请求和发出的字节数"""
+
+    def __init__(self):
+        self.requests: list[RecordedRequest] = []
+        self.responder: Callable[[RecordedRequest], MockResponse] = lambda req: MockResponse()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                req = RecordedRequest(self.command, self.path, dict(self.headers), body, time.monotonic())
+                with mock._lock:
+                    mock.requests.append(req)
+                resp = mock.responder(req)
+                if resp.delay > 0:
+                    time.sleep(resp.delay)
+
+                payload = resp.body
+                if not isinstance(payload, bytes):
+                    payload = json.dumps(payload).encode("utf-8")
+                headers = dict(resp.headers)
+                if resp.gzip and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    payload = gzip.compress(payload)
+                    headers["Content-Encoding"] = "gzip"
+                if resp.status == 304:
+                    payload = b""
+                else:
+                    headers.setdefault("Content-Type", "application/json")
+                headers["Content-Length"] = str(len(payload))
+                # 先计数再发送，客户端收到响应时计数一定已经更新
+                with mock._lock:
+                    mock.bytes_sent += len(payload)
+                try:
+                    self.send_response(resp.status)
+                    for k, v in headers.items():
+                        self.send_header(k, v)
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端已经超时断开
+                    return
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def mock_server():
+    server = MockServer()
+    server.start()
+    yield server
+    server.stop()
@@ -0,0 +1,87 @@
+import random
+
+from app.database.Sqlite3Helper import Sqlite3Worker
+from app.database.history import (
+    C, H, S, ItemKind, create_history_tables, record_scan, _state_at, CHECKPOINT_RATIO,
+)
+
+EXT = ItemKind.EXTENSION.value
+
+
+def _count(sqh: Sqlite3Worker, table: str) -> int:
+    return sqh.select(table, ["COUNT(*)"])[1][0][0]
+
+
+class Fleet(object):
+    """模拟一个浏览器的插件关联，每次扫描时和上一次比较得到增删"""
+
+    def __init__(self, sqh: Sqlite3Worker, profiles: int, exts: int):
+        self.sqh = sqh
+        self.state = {(EXT, f"Profile {p}", f"ext{e}") for p in range(profiles) for e in range(exts)}
+        self.recorded = set()
+
+    def scan(self):
+        changes = [[*row, 1] for row in self.state - self.recorded]
+        changes += [[*row, -1] for row in self.recorded - self.state]
+        with self.sqh.transaction():
+            scan = record_scan(self.sqh, "Chrome", changes, (list(row) for row in self.state))
+        self.recorded = set(self.state)
+        return scan
+
+
+def test_unchanged_scans_are_not_recorded():
+    sqh = Sqlite3Worker(":memory:")
+    create_history_tables(sqh)
+    fleet = Fleet(sqh, 50, 20)
+
+    first = fleet.scan()
+    for _ in range(100):
+        assert fleet.scan() == first
+
+    assert _count(sqh, S.table) == 1
+    assert _count(sqh, C.table) == 1000
+    assert _count(sqh, H.table) == 1000
+
+
+def test_storage_grows_with_churn_not_scans():
+    sqh = Sqlite3Worker(":memory:")
+    create_history_tables(sqh)
+    fleet = Fleet(sqh, 50, 20)
+    fleet.scan()
+    rng = random.Random(1)
+
+    churn = 0
+    for i in range(200):
+        # 每次只装一个新插件
+        fleet.state.add((EXT, f"Profile {rng.randrange(50)}", f"new{i}"))
+        churn += 1
+        fleet.scan()
+
+    # 200 次小变化不足以触发新的检查点
+    assert churn < CHECKPOINT_RATIO * 1000
+    _, rows = sqh.select(S.table, [S.checkpoint])
+    assert sum(r[0] for r in rows) == 1
+    assert _count(sqh, C.table) == 1000
+    assert _count(sqh, H.table) == 1000 + churn
+
+
+def test_checkpoint_after_enough_churn_and_state_is_replayed():
+    sqh = Sqlite3Worker(":memory:")
+    create_history_tables(sqh)
+    fleet = Fleet(sqh, 10, 10)
+    fleet.scan()
+    rng = random.Random(2)
+
+    for i in range(40):
+        row = rng.choice(sorted(fleet.state))
+        fleet.state.discard(row)
+        fleet.state.add((EXT, row[1], f"x{i}"))
+        fleet.scan()
+
+    _, rows = sqh.select(S.table, [S.checkpoint])
+    checkpoints = sum(r[0] for r in rows)
+    assert checkpoints >= 2
+    # 检查点加起来不超过 初始状态 + (1 / 比例 + 1) * 变化量
+    assert _count(sqh, C.table) <= 100 + (1 / CHECKPOINT_RATIO + 1) * 80
+
+    assert _state_at(sqh, "Chrome", float("inf")) == fleet.state
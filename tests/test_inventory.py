@@ -0,0 +1,89 @@
+import pytest
+
+from app.database.Sqlite3Helper import AsyncSqlite3Worker
+from app.database.inventory import InventoryStore, InventorySnapshot, _sync, P, E, B, F, PE, PB
+
+
+def _snapshot() -> InventorySnapshot:
+    profiles = [["Default", "张三", "", "", "Default"], ["Profile 1", "李四", "", "", "Profile 1"]]
+    extensions = [
+        ["ext_adblock", "广告拦截", "拦截网页上的广告"],
+        ["ext_ublock", "uBlock Origin", "An efficient blocker"],
+        ["ext_e3", "E3 Helper", "工具"],
+    ]
+    bookmarks = [
+        ["https://github.com/", "GitHub"],
+        ["https://example.com/e3", "内部系统"],
+    ]
+    profile_extensions = {("Default", "ext_adblock"), ("Profile 1", "ext_ublock"), ("Default", "ext_e3")}
+    profile_bookmarks = {("Default", "https://github.com/"): "/书签栏",
+                         ("Profile 1", "https://example.com/e3"): "/书签栏/工作"}
+    return InventorySnapshot(profiles, extensions, bookmarks, profile_extensions, profile_bookmarks)
+
+
+@pytest.fixture
+def store(tmp_path):
+    sqh = AsyncSqlite3Worker(str(tmp_path / "inventory.db"))
+    store = InventoryStore(sqh)
+    sqh.run(_sync, "Chrome", _snapshot()).result()
+    yield store
+    sqh.close()
+
+
+def _ids(rows) -> set[str]:
+    return {row[0] for row in rows}
+
+
+def test_short_terms_fall_back_to_like(store):
+    assert _ids(store.search_extensions("广告").result()) == {"ext_adblock"}
+    assert _ids(store.search_extensions("ub").result()) == {"ext_ublock"}
+    assert _ids(store.search_extensions("e3").result()) == {"ext_e3"}
+    assert _ids(store.search_bookmarks("e3").result()) == {"https://example.com/e3"}
+    assert _ids(store.search_bookmarks("e3", browser="Edge").result()) == set()
+
+
+def test_long_and_short_terms_combined(store):
+    assert _ids(store.search_extensions("uBlock ub").result()) == {"ext_ublock"}
+    assert _ids(store.search_extensions("广告拦截 e3").result()) == set()
+    assert _ids(store.search_bookmarks("github gi").result()) == {"https://github.com/"}
+
+
+def test_underscore_is_not_a_wildcard(store):
+    assert store.search_extensions("_").result() == []
+
+
+def _links(store: InventoryStore, browser: str) -> tuple[set, set]:
+    def query(sqh):
+        _, pe = sqh.select(f"{PE.table} JOIN {P.table} ON {PE.table}.profile = {P.table}.id "
+                           f"JOIN {E.table} ON {PE.table}.extension = {E.table}.id",
+                           [P.profile_id, E.ext_id])
+        _, pb = sqh.select(f"{PB.table} JOIN {P.table} ON {PB.table}.profile = {P.table}.id "
+                           f"JOIN {B.table} ON {PB.table}.bookmark = {B.table}.id "
+                           f"JOIN {F.table} ON {PB.table}.folder = {F.table}.id",
+                           [P.profile_id, B.url, F.path])
+        return {tuple(r) for r in pe}, {tuple(r) for r in pb}
+    return store.sqh.run(query).result()
+
+
+def test_sync_applies_changes_in_batches(store):
+    snapshot = _snapshot()
+    # 超过一批的新插件
+    for i in range(1200):
+        snapshot.extensions.append([f"bulk{i}", f"批量 {i}", ""])
+        snapshot.profile_extensions.add(("Profile 1", f"bulk{i}"))
+    snapshot.profile_extensions.discard(("Default", "ext_e3"))
+    snapshot.extensions = [e for e in snapshot.extensions if e[0] != "ext_e3"]
+    snapshot.profile_bookmarks[("Default", "https://github.com/")] = "/书签栏/代码"
+
+    counts = store.sqh.run(_sync, "Chrome", snapshot).result()
+
+    assert counts["added_extension_links"] == 1200
+    assert counts["removed_extension_links"] == 1
+    assert counts["moved_bookmark_links"] == 1
+    pe, pb = _links(store, "Chrome")
+    assert pe == snapshot.profile_extensions
+    assert pb == {(p, u, path) for (p, u), path in snapshot.profile_bookmarks.items()}
+    assert store.search_extensions("e3").result() == []
+
+    counts = store.sqh.run(_sync, "Chrome", snapshot).result()
+    assert counts["added_extension_links"] == counts["removed_extension_links"] == 0
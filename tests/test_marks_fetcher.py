@@ -0,0 +1,137 @@
+import json
+
+import pytest
+
+from app.common.marks_fetcher import FetchError, SafeMarksFetcher
+
+from conftest import MockResponse
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Mon, 19 Oct 2026 08:00:00 GMT"
+
+
+def _marks(n: int) -> list[dict]:
+    return [{"ID": f"ext{i:05d}abcdefghijklmnopqrstu", "SAFE": i % 3 - 1} for i in range(n)]
+
+
+class MarksServer(object):
+    """支持 ETag、If-Modified-Since、since 游标和 gzip 的安全标记服务"""
+
+    def __init__(self, marks: list[dict]):
+        self.marks = {m["ID"]: m["SAFE"] for m in marks}
+        self.version = 1
+        self.log: list[tuple[int, dict]] = [(1, {})]  # [(版本, {ext_id: SAFE 或 None 表示删除})]
+
+    def change(self, updates: dict[str, int | None]):
+        self.version += 1
+        self.log.append((self.version, updates))
+        for ext_id, safe in updates.items():
+            if safe is None:
+                self.marks.pop(ext_id, None)
+            else:
+                self.marks[ext_id] = safe
+
+    def __call__(self, req) -> MockResponse:
+        etag = f'"v{self.version}"'
+        headers = {"ETag": etag, "Last-Modified": LAST_MODIFIED}
+        if req.headers.get("If-None-Match") == etag:
+            return MockResponse(304, headers=headers)
+        since = None
+        if "since=" in req.path:
+            since = int(req.path.split("since=")[1].split("&")[0])
+        if since is None:
+            body = {"marks": [{"ID": k, "SAFE": v} for k, v in self.marks.items()],
+                    "full": True, "cursor": str(self.version)}
+        else:
+            updates = {}
+            for version, changes in self.log:
+                if version > since:
+                    updates.update(changes)
+            body = {"marks": [{"ID": k, "SAFE": v} for k, v in updates.items() if v is not None],
+                    "removed": [k for k, v in updates.items() if v is None],
+                    "full": False, "cursor": str(self.version)}
+        return MockResponse(200, body, headers=headers, gzip=True)
+
+
+def _fetcher(server, validators=None) -> SafeMarksFetcher:
+    return SafeMarksFetcher(f"{server.url}/query_necessary", (1, 1), validators)
+
+
+def test_full_then_304_then_incremental(mock_server):
+    marks = _marks(2000)
+    service = MarksServer(marks)
+    mock_server.responder = service
+    fetcher = _fetcher(mock_server)
+
+    # 第一次：没有条件，拿到压缩过的完整列表
+    result = fetcher.fetch()
+    first = mock_server.requests[0]
+    assert "If-None-Match" not in first.headers and "since=" not in first.path
+    assert "gzip" in first.headers["Accept-Encoding"]
+    assert result.full and result.marks == marks and result.removed == []
+    plain_size = len(json.dumps({"marks": marks, "full": True, "cursor": "1"}).encode("utf-8"))
+    assert mock_server.bytes_sent < plain_size / 3
+    assert result.validators == {"etag": ETAG, "last_modified": LAST_MODIFIED, "cursor": "1"}
+
+    # 第二次：没有变化，304 没有响应体
+    sent = mock_server.bytes_sent
+    result = fetcher.fetch()
+    second = mock_server.requests[1]
+    assert second.headers["If-None-Match"] == ETAG
+    assert second.headers["If-Modified-Since"] == LAST_MODIFIED
+    assert "since=1" in second.path
+    assert result.not_modified and not result.full and result.marks == [] and result.removed == []
+    assert mock_server.bytes_sent == sent
+    assert fetcher.validators["cursor"] == "1"
+
+    # 第三次：改了一个、删了两个，只传变化的部分
+    removed = [marks[0]["ID"], marks[1]["ID"]]
+    service.change({marks[5]["ID"]: 1, removed[0]: None, removed[1]: None})
+    sent = mock_server.bytes_sent
+    result = fetcher.fetch()
+    assert "since=1" in mock_server.requests[2].path
+    assert not result.full
+    assert result.marks == [{"ID": marks[5]["ID"], "SAFE": 1}]
+    assert sorted(result.removed) == removed
+    assert mock_server.bytes_sent - sent < 200
+    assert fetcher.validators == {"etag": '"v2"', "last_modified": LAST_MODIFIED, "cursor": "2"}
+
+
+def test_saved_validators_are_sent_on_restart(mock_server):
+    service = MarksServer(_marks(10))
+    mock_server.responder = service
+    fetcher = _fetcher(mock_server, {"etag": ETAG, "last_modified": LAST_MODIFIED, "cursor": "1"})
+
+    result = fetcher.fetch()
+
+    assert result.not_modified
+    assert mock_server.bytes_sent == 0
+
+
+def test_plain_list_from_old_server(mock_server):
+    marks = _marks(3)
+    mock_server.responder = lambda req: MockResponse(200, marks)
+
+    result = _fetcher(mock_server, {"cursor": "9"}).fetch()
+
+    assert result.full and result.marks == marks and result.removed == []
+    assert result.validators == {}
+
+
+def test_error_status(mock_server):
+    mock_server.responder = lambda req: MockResponse(500, {"detail": "boom"})
+
+    with pytest.raises(FetchError, match="500.*boom"):
+        _fetcher(mock_server).fetch()
+
+
+def test_merge_applies_removed():
+    pytest.importorskip("PySide6")
+    from app.common.safe_marks import merge_safe_marks
+    from app.common.utils import SafeMark
+
+    current = {"a": SafeMark("a", safe=1), "b": SafeMark("b", safe=0), "c": SafeMark("c", safe=-1)}
+    changed = merge_safe_marks(current, {"b": 1}, full=False, removed=["c", "zzz"])
+
+    assert set(current) == {"a", "b"}
+    assert changed == {"b": SafeMark("b", safe=1), "c": SafeMark("c")}
@@ -0,0 +1,171 @@
+import threading
+import time
+
+from app.common import uploader as uploader_module
+from app.common.uploader import BatchUploader, RetryableError, UploadCancelled, split_batches
+from app.database.Sqlite3Helper import AsyncSqlite3Worker
+from app.database.sent_store import SentExtStore
+
+from conftest import MockResponse
+
+
+def _items(n: int) -> list[dict]:
+    return [{"ID": f"ext{i:04d}", "NAME": f"插件 {i}"} for i in range(n)]
+
+
+def _uploader(server, **kwargs) -> BatchUploader:
+    kwargs.setdefault("backoff_base", 0.01)
+    kwargs.setdefault("max_workers", 1)
+    return BatchUploader(f"{server.url}/add_batch", (1, 1), **kwargs)
+
+
+def test_split_batches_respects_bytes_and_items():
+    items = _items(25)
+    batches = split_batches(items, max_bytes=10_000, max_items=10)
+    assert [len(b) for b in batches] == [10, 10, 5]
+    assert [i for b in batches for i in b] == items
+
+    batches = split_batches(items, max_bytes=200, max_items=1000)
+    assert all(len(b) >= 1 for b in batches)
+    assert [i for b in batches for i in b] == items
+
+
+def test_retry_after_on_503(mock_server):
+    def respond(req):
+        if len(mock_server.requests) == 1:
+            return MockResponse(503, headers={"Retry-After": "0.3"})
+        return MockResponse(200, [])
+    mock_server.responder = respond
+
+    results = list(_uploader(mock_server).upload(_items(3)))
+
+    assert len(results) == 1
+    batch, response, error = results[0]
+    assert error is None and response.status_code == 200
+    first, second = mock_server.requests
+    # 退避时间很短，但要等够服务器给出的 Retry-After
+    assert second.time - first.time >= 0.3
+    assert second.json() == _items(3)
+
+
+def test_gives_up_after_max_attempts(mock_server):
+    mock_server.responder = lambda req: MockResponse(503)
+
+    results = list(_uploader(mock_server, max_attempts=3).upload(_items(2)))
+
+    _, response, error = results[0]
+    assert response is None
+    assert isinstance(error, RetryableError)
+    assert len(mock_server.requests) == 3
+
+
+def test_timeout_retries_with_exponential_backoff(mock_server, monkeypatch):
+    # 抖动取上限，重试间隔就是确定的 base * 2 ** attempt
+    monkeypatch.setattr(uploader_module.random, "uniform", lambda a, b: b)
+
+    def respond(req):
+        if len(mock_server.requests) <= 2:
+            return MockResponse(200, [], delay=0.5)
+        return MockResponse(200, [])
+    mock_server.responder = respond
+
+    up = BatchUploader(f"{mock_server.url}/add_batch", (1, 0.2), backoff_base=0.1, max_workers=1)
+    results = list(up.upload(_items(2)))
+
+    assert results[0][2] is None
+    times = [req.time for req in mock_server.requests]
+    assert len(times) == 3
+    # 每次等待 = 读取超时 0.2 + 退避 0.1、0.2
+    assert times[1] - times[0] >= 0.2 + 0.1
+    assert times[2] - times[1] >= 0.2 + 0.2
+
+
+def test_415_falls_back_to_plain_body_for_that_request_only(mock_server):
+    def respond(req):
+        if req.headers.get("Content-Encoding") == "gzip":
+            return MockResponse(415)
+        return MockResponse(200, [])
+    mock_server.responder = respond
+
+    up = _uploader(mock_server)
+    results = list(up.upload(_items(4)))
+
+    assert results[0][2] is None and results[0][1].status_code == 200
+    gz, plain = mock_server.requests
+    assert gz.headers.get("Content-Encoding") == "gzip"
+    assert "Content-Encoding" not in plain.headers
+    assert plain.json() == _items(4)
+    # 之后的请求仍然先尝试压缩
+    assert up.compress is True
+    list(up.upload(_items(1)))
+    assert mock_server.requests[2].headers.get("Content-Encoding") == "gzip"
+
+
+def test_400_does_not_disable_compression(mock_server):
+    mock_server.responder = lambda req: MockResponse(400, {"detail": "bad"})
+
+    up = _uploader(mock_server)
+    _, response, error = list(up.upload(_items(1)))[0]
+
+    assert error is None and response.status_code == 400
+    assert len(mock_server.requests) == 1
+    assert up.compress is True
+
+
+def test_stop_cancels_pending_retries(mock_server):
+    mock_server.responder = lambda req: MockResponse(503, headers={"Retry-After": "5"})
+
+    up = _uploader(mock_server)
+    timer = threading.Timer(0.3, up.stop)
+    timer.start()
+    start = time.monotonic()
+    _, response, error = list(up.upload(_items(1)))[0]
+
+    assert response is None
+    assert isinstance(error, UploadCancelled)
+    # 不用等到 Retry-After 结束
+    assert time.monotonic() - start < 2
+    assert len(mock_server.requests) == 1
+
+
+def _open_store(sqh: AsyncSqlite3Worker) -> SentExtStore:
+    # 界面中由 watch_future 在读完后调用 apply_loaded，这里直接等
+    store = SentExtStore(sqh)
+    store.apply_loaded(store.loading.result())
+    return store
+
+
+def test_resume_from_persisted_upload_queue(mock_server, tmp_path):
+    db = tmp_path / "userdata.db"
+    items = _items(30)
+
+    # 第一次运行：加入上传队列后只传了一部分就退出
+    sqh = AsyncSqlite3Worker(str(db))
+    store = _open_store(sqh)
+    store.enqueue([[i["ID"], i["NAME"]] for i in items]).result()
+    store.confirm([i["ID"] for i in items[:10]]).result()
+    sqh.close()
+
+    # 再次启动：从队列中取出没传完的继续上传
+    sqh = AsyncSqlite3Worker(str(db))
+    store = _open_store(sqh)
+    unfinished = sorted(store.unfinished)
+    assert unfinished == [[i["ID"], i["NAME"]] for i in items[10:]]
+    assert len(store) == 10
+
+    mock_server.responder = lambda req: MockResponse(200, [])
+    up = _uploader(mock_server, max_items=8)
+    store.mark_pending([ext_id for ext_id, _ in unfinished])
+    for batch, response, error in up.upload([{"ID": ext_id, "NAME": name} for ext_id, name in unfinished]):
+        assert error is None
+        store.confirm([e["ID"] for e in batch]).result()
+    sqh.close()
+
+    received = sorted(e["ID"] for req in mock_server.requests for e in req.json())
+    assert received == [i["ID"] for i in items[10:]]
+
+    sqh = AsyncSqlite3Worker(str(db))
+    store = _open_store(sqh)
+    assert store.unfinished == []
+    assert store.filter_unsent(i["ID"] for i in items) == []
+    sqh.close()